@@ -0,0 +1,38 @@
+import threading
+
+import pytest
+
+from vbimagetotext import client, telemetry
+from vbimagetotext.mockserver import MockConfig, make_server
+
+
+@pytest.fixture
+def mock_api():
+    """
+    Starts mock API servers and points the shared client at the last one started.
+    """
+    servers = []
+    base_url = client._settings["base_url"]
+
+    def start(config: MockConfig = None):
+        server = make_server(config=config)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client.configure_client(base_url=f"http://127.0.0.1:{server.server_port}/v1")
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    client.configure_client(base_url=base_url)
+
+
+@pytest.fixture(autouse=True)
+def telemetry_log(tmp_path, monkeypatch):
+    """
+    Keeps the telemetry of a test in its own log, instead of the user's.
+    """
+    log = telemetry.TelemetryLog(str(tmp_path / "telemetry.jsonl"), enabled=True)
+    monkeypatch.setattr(telemetry, "_log", log)
+    return log
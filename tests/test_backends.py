@@ -0,0 +1,110 @@
+import pytest
+from PIL import Image
+
+from vbimagetotext.backends import (
+    GeminiBackend, GenerateOptions, MockBackend, OpenAIBackend, backend_name, image_payload, make_backend, with_cached_tokens,
+)
+from vbimagetotext.hedge import HedgeBudget, HedgedBackend, LatencyStore
+from vbimagetotext.packing import packing_prompt, split_pages
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for page, color in enumerate(["white", "black", "gray"], start=1):
+        path = tmp_path / f"page_{page}.png"
+        Image.new("RGB", (64, 64), color).save(path)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture(autouse=True)
+def no_stub_delay(monkeypatch):
+    monkeypatch.setenv("VBIMAGETOTEXT_STUB_DELAY", "0")
+
+
+def test_make_backend():
+    assert backend_name("gpt-4o") == "openai"
+    assert isinstance(make_backend("gpt-4o", "key"), OpenAIBackend)
+    assert isinstance(make_backend("mock"), MockBackend)
+    backend = make_backend("gemini-1.5-flash", "key", transport="stub")
+    assert isinstance(backend, GeminiBackend) and backend.transport == "stub"
+
+
+def test_image_payload_sends_the_prompt_as_the_system_message(images):
+    payload = image_payload(images[:2], ["system prompt", "page 1"], "gpt-4o", 100)
+    system, user = payload["messages"]
+    assert system == {"role": "system", "content": "system prompt"}
+    assert [part["type"] for part in user["content"]] == ["image_url", "image_url", "text"]
+    assert user["content"][-1]["text"] == "page 1"
+
+    # The system message is the same whatever follows it.
+    other = image_payload(images[2:], ["system prompt", "page 2"], "gpt-4o", 100)
+    assert other["messages"][0] == system
+    assert image_payload(images[:1], "system prompt", "gpt-4o", 100)["messages"][1]["content"][-1]["type"] == "image_url"
+
+
+def test_with_cached_tokens():
+    assert with_cached_tokens(None) is None
+    assert with_cached_tokens({"prompt_tokens": 10})["cached_tokens"] == 0
+    assert with_cached_tokens({"prompt_tokens": 2000, "prompt_tokens_details": {"cached_tokens": 1024}})["cached_tokens"] == 1024
+    assert with_cached_tokens({"prompt_tokens": 10, "prompt_tokens_details": None})["cached_tokens"] == 0
+
+
+def test_mock_answers_each_page_differently(images):
+    backend = MockBackend(delay=0)
+    options = GenerateOptions("mock")
+    first = backend.generate_sync(images[:1], "prompt", options)
+    assert first.text == backend.generate_sync(images[:1], "prompt", options).text
+    assert first.text != backend.generate_sync(images[1:2], "prompt", options).text
+    assert first.usage["total_tokens"] == first.usage["prompt_tokens"] + first.usage["completion_tokens"]
+
+
+def test_mock_streams_the_same_text(images):
+    chunks = []
+    options = GenerateOptions("mock", stream=True, on_text=chunks.append)
+    generation = MockBackend(delay=0).generate_sync(images[:1], "prompt", options)
+    assert len(chunks) > 1
+    assert "".join(chunks) == generation.text
+    assert generation.timings["first_token"] is not None
+
+
+def test_mock_answers_a_packed_request_per_page(images):
+    pages = [4, 5, 6]
+    options = GenerateOptions("mock", pages=pages)
+    generation = MockBackend(delay=0).generate_sync(images, packing_prompt("prompt", pages), options)
+    parts = split_pages(generation.text, pages)
+    assert sorted(parts) == pages
+    assert len(set(parts.values())) == 3
+
+
+@pytest.mark.parametrize("model", ["gemini-1.5-flash", "gemini-pro-vision"])
+@pytest.mark.parametrize("stream", [False, True])
+def test_gemini_stub(images, model, stream):
+    chunks = []
+    options = GenerateOptions(model, stream=stream, on_text=chunks.append)
+    backend = GeminiBackend(transport="stub")
+    generation = backend.generate_sync(images[:2], ["system prompt", "page 1"], options)
+    assert f"Stub response from {model} for 2 image(s)." in generation.text
+    assert generation.usage["prompt_tokens"] > 2 * 258
+    assert "".join(chunks) == (generation.text if stream else "")
+
+
+def test_hedge_wins_over_a_silent_primary(images, tmp_path):
+    latencies = LatencyStore(str(tmp_path / "latency.json"))
+    backend = HedgedBackend(MockBackend(delay=2), MockBackend(delay=0), hedge_model="mock-hedge",
+                            after=0.05, latencies=latencies)
+    generation = backend.generate_sync(images[:1], "prompt", GenerateOptions("mock"))
+    assert generation.model == "mock-hedge"
+    assert (backend.hedges, backend.hedge_wins) == (1, 1)
+    assert generation.timings["first_token"] is None
+
+
+def test_no_hedge_over_budget(images, tmp_path):
+    latencies = LatencyStore(str(tmp_path / "latency.json"))
+    # Hedging with a priced model, which the budget cannot pay for.
+    backend = HedgedBackend(MockBackend(delay=0.2), MockBackend(delay=0), hedge_model="gpt-4o",
+                            after=0.05, budget=HedgeBudget(0), latencies=latencies)
+    generation = backend.generate_sync(images[:1], "prompt", GenerateOptions("mock"))
+    assert generation.model == "mock"
+    assert (backend.hedges, backend.skipped) == (0, 1)
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+from PIL import Image
+
+from vbimagetotext.batch import batch, output_collisions, page_output_name, result_error
+from vbimagetotext.mockserver import MockConfig
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "book").mkdir()
+    for page, color in enumerate(["white", "black", "gray"], start=1):
+        Image.new("RGB", (64, 64), color).save(tmp_path / "book" / f"page_{page}.png")
+    return tmp_path
+
+
+def run(*args):
+    return CliRunner().invoke(batch, list(args), catch_exceptions=False)
+
+
+def submit():
+    return run("submit", "-i", "book", "-p", "mcq", "-m", "gpt-4o", "-o", "out", "-w", "work")
+
+
+def test_submit_and_collect(book, mock_api):
+    mock_api()
+    assert submit().exit_code == 0
+    result = run("collect", "-w", "work")
+    assert result.exit_code == 0
+    assert "Wrote 3 pages, 0 failed, 0 not collected." in result.output
+    assert sorted(path.name for path in (book / "out").iterdir()) == ["problem_1.tex", "problem_2.tex", "problem_3.tex"]
+    assert "Mock response" in (book / "out" / "problem_2.tex").read_text()
+
+    # Already collected pages are skipped.
+    assert "Wrote 0 pages" in run("collect", "-w", "work").output
+
+
+def test_collect_reports_failed_requests(book, mock_api):
+    mock_api(MockConfig(error_rate=1.0))
+    assert submit().exit_code == 0
+    result = run("collect", "-w", "work")
+    assert result.exit_code == 0
+    assert "no output yet" not in result.output
+    assert result.output.count("server_error: The server had an error") == 3
+    assert "Wrote 0 pages, 3 failed, 3 not collected." in result.output
+
+    manifest = json.loads((book / "work" / "manifest.json").read_text())
+    assert manifest["request_counts"]["failed"] == 3
+
+
+def test_submit_rejects_colliding_outputs(book, mock_api):
+    server = mock_api()
+    Image.new("RGB", (64, 64)).save(book / "book" / "page_1.jpg")
+    result = submit()
+    assert result.exit_code == 1
+    assert "problem_1.tex" in result.output
+    assert server.state.requests == 0 and not server.state.files
+
+
+def test_page_output_name():
+    assert page_output_name("book/page_12.png") == "problem_12.tex"
+    assert page_output_name("book/cover.png") == "cover.tex"
+    assert output_collisions(["a/page_1.png", "a/page_1.jpg", "a/page_2.png"]) == {"problem_1.tex": ["a/page_1.png", "a/page_1.jpg"]}
+
+
+def test_result_error():
+    assert result_error({"error": {"code": "batch_expired", "message": "Expired"}}) == "batch_expired: Expired"
+    assert result_error({"error": None, "response": {"status_code": 400, "body": {
+        "error": {"type": "invalid_request_error", "code": None, "message": "Bad image"}}}}) == "invalid_request_error: Bad image"
+    assert result_error({"error": None, "response": {"status_code": 502, "body": {}}}) == "status code 502"
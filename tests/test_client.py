@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from vbimagetotext import client
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    saved = dict(client._settings)
+    yield
+    client.configure_client(**saved)
+
+
+def test_api_url():
+    client.configure_client(base_url="http://localhost:8000/v1/")
+    assert client.api_url("/chat/completions") == "http://localhost:8000/v1/chat/completions"
+    assert client.api_url("batches") == "http://localhost:8000/v1/batches"
+
+
+def test_configure_client_rebuilds_the_session_only_on_changes():
+    session = client.get_session()
+    assert client.get_session() is session
+    client.configure_client(pool_size=client._settings["pool_size"], read_timeout=None)
+    assert client.get_session() is session
+
+    client.configure_client(pool_size=client._settings["pool_size"] + 1)
+    rebuilt = client.get_session()
+    assert rebuilt is not session
+    assert rebuilt.get_adapter("https://api.openai.com")._pool_maxsize == client._settings["pool_size"]
+
+
+def test_connections_are_reused(mock_api):
+    mock_api()
+
+    times = []
+    for _ in range(3):
+        start = client.connect_seconds()
+        assert client.api_request("GET", "/batches/unknown", "key").status_code == 404
+        times.append(client.connect_seconds() - start)
+    # Only the first request opened a connection.
+    assert times[0] > 0 and times[1:] == [0, 0]
+
+    # Connection time is counted per thread.
+    other = []
+    thread = threading.Thread(target=lambda: other.append(client.connect_seconds()))
+    thread.start()
+    thread.join()
+    assert other == [0.0]
+
+
+def test_api_request_uses_the_configured_timeouts(monkeypatch):
+    client.configure_client(connect_timeout=3, read_timeout=9)
+    sent = {}
+
+    def request(method, url, **kwargs):
+        sent.update(kwargs, method=method, url=url)
+    monkeypatch.setattr(client.get_session(), "request", request)
+
+    client.api_request("GET", "/batches/b", "key", headers={"Accept": "application/json"})
+    assert sent["timeout"] == (3, 9)
+    assert sent["headers"] == {"Authorization": "Bearer key", "Accept": "application/json"}
+    assert sent["url"] == client.api_url("/batches/b")
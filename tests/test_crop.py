@@ -0,0 +1,38 @@
+from PIL import Image, ImageDraw
+
+from vbimagetotext.crop import boxes_tokens, choose_regions, content_bbox, question_boxes
+
+
+def page(blocks, size=(1000, 2000)):
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    for block in blocks:
+        draw.rectangle(block, fill=0)
+    return image
+
+
+def test_content_bbox():
+    assert content_bbox(page([(100, 200, 299, 399)])) == (92, 192, 308, 408)
+    # Padding stops at the edges.
+    assert content_bbox(page([(0, 0, 9, 9)])) == (0, 0, 18, 18)
+    assert content_bbox(page([])) == (0, 0, 1000, 2000)
+
+
+def test_question_boxes():
+    image = page([(100, 100, 899, 299), (100, 1700, 499, 1899)])
+    assert question_boxes(image) == [(92, 92, 908, 308), (92, 1692, 508, 1908)]
+    # A single ink row still counts as content.
+    assert len(question_boxes(page([(100, 100, 899, 299), (100, 320, 899, 320)]))) == 1
+
+
+def test_choose_regions():
+    # Two short questions far apart on a large page: one tile each instead of four.
+    spread = page([(100, 100, 579, 299), (1400, 2700, 1879, 2899)], size=(2000, 3000))
+    assert choose_regions(spread, "trim") == [content_bbox(spread)]
+    crops = choose_regions(spread, "questions")
+    assert crops == question_boxes(spread)
+    assert boxes_tokens(crops) < boxes_tokens([content_bbox(spread)])
+
+    # Two questions filling the page cost more as separate crops.
+    full = page([(50, 50, 949, 949), (50, 1050, 949, 1949)])
+    assert choose_regions(full, "questions") == [content_bbox(full)]
@@ -0,0 +1,109 @@
+import json
+import os
+import socket
+import threading
+
+import click
+import pytest
+
+from vbimagetotext import client, ratelimit
+from vbimagetotext.daemon import IMPORT_TIME_ENV, differing_settings, handle_connection, run_request
+from vbimagetotext.main import main
+
+
+@click.command()
+@click.argument("names", nargs=-1)
+def printenv(names):
+    for name in names:
+        click.echo(f"{name}={os.environ.get(name)}")
+
+
+@click.command()
+def pwd():
+    click.echo(os.getcwd())
+
+
+@pytest.fixture(autouse=True)
+def extra_commands():
+    main.add_command(printenv, "printenv")
+    main.add_command(pwd, "pwd")
+    yield
+    main.commands.pop("printenv")
+    main.commands.pop("pwd")
+
+
+def request(argv, env=None, cwd="."):
+    # The settings the daemon was started with, as a client of the same shell sends them.
+    env = {**{name: os.environ[name] for name in IMPORT_TIME_ENV if name in os.environ}, **(env or {})}
+    return {"argv": argv, "cwd": os.path.abspath(cwd), "env": env, "isatty": False}
+
+
+def test_client_sees_only_its_own_environment(monkeypatch, capsys):
+    monkeypatch.setenv("OPENAI_API_KEY", "daemon-key")
+    monkeypatch.setenv("VBIMAGETOTEXT_RPM", "10")
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+
+    assert run_request(request(["printenv", "OPENAI_API_KEY", "VBIMAGETOTEXT_RPM", "GOOGLE_API_KEY"],
+                               {"GOOGLE_API_KEY": "client-key"})) == 0
+    assert capsys.readouterr().out.splitlines() == ["OPENAI_API_KEY=None", "VBIMAGETOTEXT_RPM=None", "GOOGLE_API_KEY=client-key"]
+    # The daemon's own environment is back afterwards.
+    assert os.environ["OPENAI_API_KEY"] == "daemon-key"
+    assert os.environ["VBIMAGETOTEXT_RPM"] == "10"
+    assert "GOOGLE_API_KEY" not in os.environ
+
+
+def test_run_request_uses_the_client_directory(tmp_path, capsys):
+    cwd = os.getcwd()
+    assert run_request(request(["pwd"], cwd=tmp_path)) == 0
+    assert capsys.readouterr().out == f"{tmp_path}\n"
+    assert os.getcwd() == cwd
+
+
+def test_differing_settings(monkeypatch):
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://localhost:8000/v1")
+    monkeypatch.delenv("VBIMAGETOTEXT_CACHE_DIR", raising=False)
+    assert differing_settings({"OPENAI_BASE_URL": "http://localhost:8000/v1"}) == []
+    assert differing_settings({"OPENAI_BASE_URL": "http://localhost:8000/v1", "VBIMAGETOTEXT_CACHE_DIR": "/tmp"}) == ["VBIMAGETOTEXT_CACHE_DIR"]
+    assert differing_settings({}) == ["OPENAI_BASE_URL"]
+
+
+def test_run_request_refuses(monkeypatch, capsys):
+    monkeypatch.delenv("VBIMAGETOTEXT_CACHE_DIR", raising=False)
+    assert run_request(request(["printenv"], {"VBIMAGETOTEXT_CACHE_DIR": "/tmp"})) == 2
+    assert "VBIMAGETOTEXT_CACHE_DIR" in capsys.readouterr().err
+    assert run_request(request(["serve"])) == 2
+
+
+def test_exit_codes(capsys):
+    assert run_request(request(["printenv", "--unknown"])) == 2
+    assert run_request(request(["no-such-command"])) == 2
+
+
+def test_protocol():
+    daemon_end, client_end = socket.socketpair()
+    thread = threading.Thread(target=handle_connection, args=(daemon_end,))
+    thread.start()
+    with client_end, client_end.makefile("rb") as reader:
+        client_end.sendall(json.dumps(request(["printenv", "VBIMAGETOTEXT_MODE"], {"VBIMAGETOTEXT_MODE": "x"})).encode("utf-8") + b"\n")
+        messages = [json.loads(line) for line in reader]
+    thread.join()
+    assert messages == [{"stream": "stdout", "data": "VBIMAGETOTEXT_MODE=x\n"}, {"exit": 0}]
+
+
+def test_unchanged_settings_keep_the_warm_state(monkeypatch):
+    monkeypatch.delenv("VBIMAGETOTEXT_RPM", raising=False)
+    monkeypatch.delenv("VBIMAGETOTEXT_TPM", raising=False)
+    client.configure_client(pool_size=12)
+    session = client.get_session()
+    client.configure_client(pool_size=12)
+    assert client.get_session() is session
+
+    ratelimit.configure_limits(60, None, 5)
+    limiter = ratelimit.get_executor().limiter
+    ratelimit.get_executor().budget.take()
+    ratelimit.configure_limits(60, None, 5)
+    assert ratelimit.get_executor().limiter is limiter
+    assert ratelimit.get_executor().budget.used == 0
+    ratelimit.configure_limits(30, None, 5)
+    assert ratelimit.get_executor().limiter is not limiter
+    ratelimit.configure_limits()
@@ -0,0 +1,68 @@
+import random
+import sys
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+np = pytest.importorskip("numpy")
+
+from vbimagetotext.dedup import DedupIndex, load_numpy, perceptual_hash, popcount  # noqa: E402
+
+
+def page(path, seed):
+    # Lines of dark blocks standing in for words.
+    rng = random.Random(seed)
+    image = Image.new("L", (600, 800), 255)
+    draw = ImageDraw.Draw(image)
+    for top in range(40, 760, 30):
+        left = 40
+        while left < 540:
+            width = rng.randint(20, 90)
+            draw.rectangle([left, top, min(left + width, 560), top + 14], fill=rng.randint(0, 80))
+            left += width + rng.randint(8, 20)
+    image.save(path)
+    return image
+
+
+def distance(a, b):
+    return int(popcount(np.array([a ^ b], dtype=np.uint64))[0])
+
+
+def test_popcount():
+    values = np.array([0, 1, 0xFF, 2 ** 64 - 1], dtype=np.uint64)
+    assert popcount(values).tolist() == [0, 1, 8, 64]
+
+
+def test_blurred_copy_matches_and_other_page_does_not(tmp_path):
+    original = page(tmp_path / "page_1.png", seed=1)
+    original.filter(ImageFilter.GaussianBlur(1)).save(tmp_path / "blurred.jpg", quality=70)
+    page(tmp_path / "page_2.png", seed=2)
+
+    hashes = {name: perceptual_hash(str(tmp_path / name)) for name in ["page_1.png", "blurred.jpg", "page_2.png"]}
+    assert distance(hashes["page_1.png"], hashes["blurred.jpg"]) <= 6
+    assert distance(hashes["page_1.png"], hashes["page_2.png"]) > 12
+
+    index = DedupIndex(6, path=str(tmp_path / "phash.json"))
+    index.add("signature", [hashes["page_1.png"]], "key-1", "page_1.png")
+    assert index.find("signature", [hashes["blurred.jpg"]]) == ("key-1", "page_1.png")
+    assert index.find("signature", [hashes["page_2.png"]]) is None
+    # Only requests made with the same settings are reused.
+    assert index.find("other signature", [hashes["blurred.jpg"]]) is None
+
+
+def test_index_is_saved_and_reloaded(tmp_path):
+    path = str(tmp_path / "phash.json")
+    index = DedupIndex(0, path=path)
+    index.add("signature", [2 ** 63 + 5, 7], "key", "page_1.png")
+    index.save()
+
+    reloaded = DedupIndex(0, path=path)
+    assert reloaded.find("signature", [2 ** 63 + 5, 7]) == ("key", "page_1.png")
+    assert reloaded.find("signature", [2 ** 63 + 5]) is None
+
+
+def test_load_numpy_names_the_extra(monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    with pytest.raises(SystemExit):
+        load_numpy()
+    assert "'vbimagetotext[dedup]'" in capsys.readouterr().out
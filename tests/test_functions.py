@@ -0,0 +1,85 @@
+import pytest
+from PIL import Image
+
+from vbimagetotext.backends import MockBackend
+from vbimagetotext.functions import cached_tokens, extract_latex, process_images, process_text
+from vbimagetotext.mockserver import MockConfig
+from vbimagetotext.response_cache import ResponseCache
+from vbimagetotext.token_cost_calculations import CostLedger
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "page_1.png"
+    Image.new("RGB", (64, 64), "white").save(path)
+    return str(path)
+
+
+def test_process_images_streams_then_writes_the_latex(image, tmp_path, capsys, telemetry_log):
+    output = tmp_path / "out.tex"
+    result = process_images([image], "prompt", "mock", None, 100, copy=False, stream=True,
+                            output=str(output), backend=MockBackend(delay=0))
+    assert result.strip().startswith("\\item Mock response")
+    # The raw answer was printed as it arrived, the file holds the extracted code.
+    assert "```latex" in capsys.readouterr().out
+    assert output.read_text() == result
+    [record] = telemetry_log.read()
+    assert record["status"] == "ok" and record["cache"] == "off"
+
+
+def test_cached_response_is_printed_when_streaming(image, tmp_path, capsys):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    backend = MockBackend(delay=0)
+    first = process_images([image], "prompt", "mock", None, 100, copy=False, cache=cache, backend=backend)
+    capsys.readouterr()
+
+    output = tmp_path / "out.tex"
+    assert process_images([image], "prompt", "mock", None, 100, copy=False, cache=cache, stream=True,
+                          output=str(output), backend=backend) == first
+    printed = capsys.readouterr().out
+    assert "Cache hit" in printed and first in printed
+    assert output.read_text() == first
+
+
+def test_process_text_streams_the_answer(tmp_path, capsys, telemetry_log):
+    source = tmp_path / "question.tex"
+    source.write_text("\\item Solve $x^2 = 4$.")
+    output = tmp_path / "solution.tex"
+    message = process_text(str(source), "Solve this.", "mock", None, 100, stream=True, output=str(output),
+                           backend=MockBackend(delay=0), copy=False)
+    assert output.read_text() == message
+    assert extract_latex(message) in capsys.readouterr().out
+    assert [record["images"] for record in telemetry_log.read()] == [0]
+
+
+def test_process_text_streams_from_the_api(tmp_path, mock_api, capsys):
+    server = mock_api()
+    source = tmp_path / "question.tex"
+    source.write_text("\\item Solve $x^2 = 4$.")
+    output = tmp_path / "solution.tex"
+    message = process_text(str(source), "Solve this.", "gpt-4o", "key", 100, stream=True, output=str(output), copy=False)
+    assert "Mock response" in message
+    assert output.read_text() == message
+    assert server.state.requests == 1
+
+
+def test_cached_prompt_tokens_are_accounted(tmp_path, mock_api, capsys, telemetry_log):
+    mock_api(MockConfig(cache_min_tokens=0))
+    prompt = ["Convert to LaTeX. " * 200, "page"]
+    ledger = CostLedger()
+    for page, color in enumerate(["white", "black"], start=1):
+        path = tmp_path / f"page_{page}.png"
+        Image.new("RGB", (64, 64), color).save(path)
+        process_images([str(path)], prompt, "gpt-4o", "key", 100, copy=False, ledger=ledger)
+
+    first, second = telemetry_log.read()
+    assert first["cached_tokens"] == 0 and first["cache_savings"] == 0
+    assert second["cached_tokens"] > 0 and second["cache_savings"] > 0
+    assert second["cost"] < first["cost"]
+    assert ledger.totals()["gpt-4o"]["cached_tokens"] == second["cached_tokens"]
+
+
+def test_cached_tokens():
+    assert cached_tokens(None) == 0
+    assert cached_tokens({"prompt_tokens": 10}) == 0
+    assert cached_tokens({"cached_tokens": 256}) == 256
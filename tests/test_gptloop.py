@@ -0,0 +1,57 @@
+import re
+
+import pytest
+from click.testing import CliRunner
+from PIL import Image
+
+from vbimagetotext.gptloop import gptloop, page_image_path
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("VBIMAGETOTEXT_MOCK_DELAY", "0")
+    (tmp_path / "book").mkdir()
+    for page in range(1, 7):
+        Image.new("RGB", (64, 64), (page * 40, 0, 0)).save(tmp_path / "book" / f"page_{page}.png")
+    return tmp_path
+
+
+def run(*args):
+    return CliRunner().invoke(gptloop, ["-i", "book/page_1.png", "-p", "mcq", "-m", "mock", "--no-cache", *args],
+                              catch_exceptions=False)
+
+
+def written(output):
+    return [int(page) for page in re.findall(r"Page (\d+) written", output)]
+
+
+@pytest.mark.parametrize("pack", ["1", "3"])
+def test_pages_are_written_in_order(book, pack):
+    result = run("-r", "1", "6", "--concurrency", "4", "--pack", pack)
+    assert result.exit_code == 0
+    assert written(result.output) == [1, 2, 3, 4, 5, 6]
+    texts = [(book / "src" / "src_tex" / f"problem_{page}.tex").read_text() for page in range(1, 7)]
+    assert len(set(texts)) == 6
+
+
+@pytest.mark.parametrize("pack", ["1", "3"])
+def test_a_failing_page_leaves_the_others_written(book, pack):
+    (book / "book" / "page_3.png").unlink()
+    result = run("-r", "1", "6", "--concurrency", "4", "--pack", pack)
+    assert result.exit_code == 1
+    assert written(result.output) == [1, 2, 4, 5, 6]
+    assert "Error: page 3 failed: FileNotFoundError" in result.output
+    assert "1 pages failed: 3" in result.output
+    assert not (book / "src" / "src_tex" / "problem_3.tex").exists()
+
+    # Resuming only does the failed page.
+    Image.new("RGB", (64, 64)).save(book / "book" / "page_3.png")
+    result = run("-r", "1", "6", "--resume")
+    assert result.exit_code == 0
+    assert written(result.output) == [3]
+
+
+def test_page_image_path():
+    assert page_image_path("book/page_1.png", 12) == "book/page_12.png"
+    assert page_image_path("book/page_1.png", "{page}") == "book/page_{page}.png"
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from PIL import Image
+
+from vbimagetotext.imagemeta import detect_mime_type, find_images, probe_image
+
+
+FORMATS = [
+    ("png", "RGB", {}, "image/png"),
+    ("png", "L", {}, "image/png"),
+    ("jpg", "RGB", {}, "image/jpeg"),
+    ("jpg", "RGB", {"progressive": True}, "image/jpeg"),
+    ("jpg", "L", {"exif": Image.Exif()}, "image/jpeg"),
+    ("webp", "RGB", {}, "image/webp"),
+    ("webp", "RGB", {"lossless": True}, "image/webp"),
+    ("webp", "RGBA", {}, "image/webp"),
+    ("gif", "P", {}, "image/gif"),
+]
+
+
+@pytest.mark.parametrize("extension, mode, params, mime_type", FORMATS)
+def test_probe_image_matches_pillow(tmp_path, monkeypatch, extension, mode, params, mime_type):
+    path = tmp_path / f"page.{extension}"
+    Image.new(mode, (1234, 567)).save(path, **params)
+    with Image.open(path) as img:
+        expected = img.size
+
+    # The header is enough, Pillow is not needed.
+    def fail(*args, **kwargs):
+        raise AssertionError("probe_image decoded the image")
+    monkeypatch.setattr(Image, "open", fail)
+
+    info = probe_image(str(path))
+    assert (info.width, info.height) == expected
+    assert info.mime_type == mime_type
+    assert info.size == path.stat().st_size
+
+
+def test_probe_image_sees_a_rewritten_file(tmp_path):
+    path = tmp_path / "page.png"
+    Image.new("RGB", (10, 20)).save(path)
+    assert probe_image(str(path)).width == 10
+    Image.new("RGB", (300, 20)).save(path)
+    assert probe_image(str(path)).width == 300
+
+
+def test_detect_mime_type_ignores_a_wrong_extension():
+    assert detect_mime_type(b"\xff\xd8\xff\xe0" + bytes(8), "scan.png") == "image/jpeg"
+    assert detect_mime_type(b"unknown header", "scan.bmp") == "image/bmp"
+    assert detect_mime_type(b"unknown header") == "image/png"
+
+
+def test_find_images_in_page_order(tmp_path):
+    for name in ["page_10.png", "page_2.jpg", "page_1.webp", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    assert [os.path.basename(path) for path in find_images(str(tmp_path))] == ["page_1.webp", "page_2.jpg", "page_10.png"]
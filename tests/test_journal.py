@@ -0,0 +1,65 @@
+from vbimagetotext.gptloop import page_image_path
+from vbimagetotext.journal import RunJournal, run_key
+
+
+def write(directory, name, text):
+    path = directory / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_pending_skips_recorded_pages(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.jsonl"))
+    journal.record(1, write(tmp_path, "main_1.tex", "one"), "one", 0.5)
+    journal.record(2, None, "", 0.25)
+    journal.close()
+
+    resumed = RunJournal(str(tmp_path / "journal.jsonl"), resume=True)
+    assert resumed.pending([1, 2, 3], str(tmp_path)) == [3]
+    assert resumed.cost([1, 2, 3]) == 0.75
+    resumed.close()
+
+
+def test_pending_redoes_pages_whose_output_is_gone(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.jsonl"))
+    path = write(tmp_path, "main_1.tex", "one")
+    journal.record(1, path, "one", 0.5)
+    journal.close()
+
+    (tmp_path / "main_1.tex").unlink()
+    assert RunJournal(str(tmp_path / "journal.jsonl"), resume=True).pending([1], str(tmp_path)) == [1]
+
+
+def test_pending_keeps_edited_outputs(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.jsonl"))
+    journal.record(1, write(tmp_path, "main_1.tex", "one"), "one", 0.5)
+    journal.close()
+
+    write(tmp_path, "main_1.tex", "edited")
+    assert RunJournal(str(tmp_path / "journal.jsonl"), resume=True).pending([1], str(tmp_path)) == []
+
+
+def test_resume_ignores_a_truncated_line(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.jsonl"))
+    journal.record(1, write(tmp_path, "main_1.tex", "one"), "one", 0.5)
+    journal.close()
+    with open(tmp_path / "journal.jsonl", "a") as file:
+        file.write('{"page": 2, "fi')
+
+    assert RunJournal(str(tmp_path / "journal.jsonl"), resume=True).pending([1, 2], str(tmp_path)) == [2]
+
+
+def test_fresh_run_starts_a_fresh_journal(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.jsonl"))
+    journal.record(1, write(tmp_path, "main_1.tex", "one"), "one", 0.5)
+    journal.close()
+
+    RunJournal(str(tmp_path / "journal.jsonl")).close()
+    assert RunJournal(str(tmp_path / "journal.jsonl"), resume=True).pending([1], str(tmp_path)) == [1]
+
+
+def test_run_key_does_not_depend_on_the_sample_page():
+    first = run_key(page_image_path("./book/book_1.png", "{page}"), "prompt", "gpt-4o", 2000)
+    fifth = run_key(page_image_path("./book/book_5.png", "{page}"), "prompt", "gpt-4o", 2000)
+    assert first == fifth
+    assert first != run_key(page_image_path("./book/book_1.png", "{page}"), "prompt", "gpt-4o-mini", 2000)
@@ -0,0 +1,49 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from vbimagetotext.bench import GROUP_MODULES
+from vbimagetotext.main import COMMANDS, command_help, main
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOADED_AFTER_HELP = """
+import json, sys
+from vbimagetotext.main import main
+try:
+    main(["--help"], standalone_mode=False)
+finally:
+    print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def test_help_does_not_import_the_commands():
+    result = subprocess.run(
+        [sys.executable, "-c", LOADED_AFTER_HELP],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    assert "gptvision" in result.stdout
+    loaded = set(json.loads(result.stderr.strip().splitlines()[-1]))
+    modules = GROUP_MODULES + [f"vbimagetotext.{module}" for module, _ in COMMANDS.values()]
+    assert [module for module in modules if module in loaded] == []
+
+
+@pytest.mark.parametrize("name", sorted(COMMANDS))
+def test_command_help_matches_the_command(name):
+    module_name, attribute = COMMANDS[name]
+    command = getattr(importlib.import_module(f"vbimagetotext.{module_name}"), attribute)
+    assert command_help(module_name, attribute) == command.help
+
+
+def test_help_lists_every_command():
+    result = CliRunner().invoke(main, ["--help"])
+    assert result.exit_code == 0
+    listed = result.output.split("Commands:", 1)[1]
+    for name in COMMANDS:
+        assert f"  {name} " in listed
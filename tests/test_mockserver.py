@@ -0,0 +1,63 @@
+import pytest
+from PIL import Image
+
+from vbimagetotext.backends import GenerateOptions, OpenAIBackend
+from vbimagetotext.mockserver import MockConfig, MockState
+from vbimagetotext.packing import packing_prompt, split_pages
+
+
+@pytest.fixture
+def server(mock_api):
+    return mock_api(MockConfig(cache_min_tokens=0))
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for page, color in enumerate(["white", "black"], start=1):
+        path = tmp_path / f"page_{page}.png"
+        Image.new("RGB", (64, 64), color).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_chat_completion(server, images):
+    generation = OpenAIBackend("key").generate_sync(images[:1], "prompt", GenerateOptions("gpt-4o"))
+    assert generation.text.startswith("```latex\n\\item Mock response ")
+    assert generation.usage["prompt_tokens"] > 100
+    assert server.state.requests == 1
+
+
+def test_streamed_chat_completion(server, images):
+    chunks = []
+    options = GenerateOptions("gpt-4o", stream=True, on_text=chunks.append)
+    generation = OpenAIBackend("key").generate_sync(images[:1], "prompt", options)
+    assert len(chunks) > 1
+    assert "".join(chunks) == generation.text
+    assert generation.usage["completion_tokens"] > 0
+
+
+def test_prompt_cache(server, images):
+    backend = OpenAIBackend("key")
+    prompt = ["Convert to LaTeX. " * 200, "page"]
+    first = backend.generate_sync(images[:1], prompt, GenerateOptions("gpt-4o"))
+    second = backend.generate_sync(images[1:], prompt, GenerateOptions("gpt-4o"))
+    assert first.usage["cached_tokens"] == 0
+    assert second.usage["cached_tokens"] > 0
+    assert second.usage["cached_tokens"] % 128 == 0
+
+
+def test_packed_chat_completion(server, images):
+    pages = [7, 8]
+    generation = OpenAIBackend("key").generate_sync(images, packing_prompt("prompt", pages), GenerateOptions("gpt-4o"))
+    assert sorted(split_pages(generation.text, pages)) == pages
+
+
+def test_rate_limit():
+    state = MockState(MockConfig(rpm=2))
+    assert [state.admit(0)[0] for _ in range(3)] == [200, 200, 429]
+    status, headers = state.admit(0)
+    assert status == 429
+    assert headers["x-ratelimit-remaining-requests"] == "0"
+    assert float(headers["retry-after-ms"]) > 0
+    assert state.rate_limited == 2
@@ -0,0 +1,67 @@
+from PIL import Image
+
+from vbimagetotext.mockserver import marked_pages
+from vbimagetotext.packing import MAX_OUTPUT_TOKENS, PAGE_MARKER, pack_pages, packed_max_tokens, packing_prompt, split_pages
+
+
+def marked(pages):
+    return "\n".join(f"{PAGE_MARKER.format(page=page)}\n\\item Page {page}" for page in pages)
+
+
+def test_packing_prompt_keeps_the_prompt_as_its_own_part():
+    prompt, instructions = packing_prompt("Convert to LaTeX.", [3, 4, 5])
+    assert prompt == "Convert to LaTeX."
+    assert marked_pages(instructions) == [3, 4, 5]
+
+
+def test_split_pages():
+    parts = split_pages(marked([1, 2, 3]), [1, 2, 3])
+    assert parts == {1: "\n\\item Page 1\n", 2: "\n\\item Page 2\n", 3: "\n\\item Page 3\n"}
+
+
+def test_split_pages_leaves_out_missing_and_unrequested_pages():
+    parts = split_pages(marked([1, 3, 9]), [1, 2, 3])
+    assert sorted(parts) == [1, 3]
+
+
+def test_split_pages_keeps_the_first_of_a_repeated_marker():
+    text = marked([1]) + "\n" + PAGE_MARKER.format(page=1) + "\n\\item Again"
+    assert split_pages(text, [1]) == {1: "\n\\item Page 1\n"}
+
+
+def test_split_pages_accepts_indented_markers_only_on_their_own_line():
+    text = f"  {PAGE_MARKER.format(page=1)}  \nA\nsee {PAGE_MARKER.format(page=2)} inline"
+    assert sorted(split_pages(text, [1, 2])) == [1]
+
+
+def test_packed_max_tokens_is_capped():
+    assert packed_max_tokens(1) == 2000
+    assert packed_max_tokens(10) == MAX_OUTPUT_TOKENS
+
+
+def pages(tmp_path, count):
+    items = []
+    for page in range(1, count + 1):
+        path = tmp_path / f"p_{page}.png"
+        # 255 tokens each.
+        Image.new("RGB", (512, 512), "white").save(path)
+        items.append((page, str(path)))
+    return items
+
+
+def test_pack_pages_by_count(tmp_path):
+    packs = pack_pages(pages(tmp_path, 5), 2)
+    assert [[page for page, _ in pack] for pack in packs] == [[1, 2], [3, 4], [5]]
+
+
+def test_pack_pages_without_packing_does_not_read_the_images(tmp_path):
+    items = [(page, str(tmp_path / f"missing_{page}.png")) for page in range(1, 4)]
+    assert len(list(pack_pages(items, 1))) == 3
+
+
+def test_pack_pages_by_image_tokens(tmp_path):
+    items = pages(tmp_path, 4)
+    packs = list(pack_pages(items, max_pages=10, max_tokens=600))
+    assert [[page for page, _ in pack] for pack in packs] == [[1, 2], [3, 4]]
+    # A page over the budget on its own still goes, alone.
+    assert len(list(pack_pages(items, max_pages=10, max_tokens=100))) == 4
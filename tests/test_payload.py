@@ -0,0 +1,56 @@
+import base64
+import json
+
+import pytest
+from PIL import Image
+
+from vbimagetotext.payload import CHUNK_SIZE, ImageData, StreamingBody
+
+
+def payload(tmp_path):
+    path = tmp_path / "page.png"
+    # Noise, so the file spans several chunks.
+    Image.effect_noise((700, 700), 64).save(path)
+    return {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "Convert to LaTeX, \"quoted\" ünïcode."},
+            {"type": "image_url", "image_url": {"url": ImageData(path=str(path))}},
+            {"type": "image_url", "image_url": {"url": ImageData(data=b"GIF89a" + bytes(100))}},
+        ]}],
+    }, path.read_bytes()
+
+
+def test_length_matches_the_body(tmp_path):
+    body_payload, image = payload(tmp_path)
+    assert len(image) > CHUNK_SIZE
+    body = StreamingBody(body_payload)
+    data = body.read()
+    assert len(body) == len(data)
+    assert body.read() == b""
+
+
+def test_body_is_the_json_with_data_urls(tmp_path):
+    body_payload, image = payload(tmp_path)
+    content = json.loads(StreamingBody(body_payload).read())["messages"][0]["content"]
+    assert content[0]["text"] == "Convert to LaTeX, \"quoted\" ünïcode."
+    prefix, encoded = content[1]["image_url"]["url"].split(",", 1)
+    assert prefix == "data:image/png;base64"
+    assert base64.b64decode(encoded) == image
+    assert content[2]["image_url"]["url"].startswith("data:image/gif;base64,")
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096, CHUNK_SIZE + 1])
+def test_reading_in_pieces(tmp_path, size):
+    body_payload, _ = payload(tmp_path)
+    whole = StreamingBody(body_payload).read()
+    body = StreamingBody(body_payload)
+    parts = iter(lambda: body.read(size), b"")
+    assert b"".join(parts) == whole
+
+
+def test_image_data_needs_a_path_or_data():
+    with pytest.raises(ValueError):
+        ImageData()
+    with pytest.raises(ValueError):
+        ImageData(path="page.png", data=b"")
@@ -0,0 +1,34 @@
+import sys
+
+import pytest
+from PIL import Image
+
+from vbimagetotext.pdf import load_pdfium, render_scale
+
+
+def test_load_pdfium_names_the_extra(monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "pypdfium2", None)
+    with pytest.raises(SystemExit):
+        load_pdfium()
+    assert "'vbimagetotext[pdf]'" in capsys.readouterr().out
+
+
+def test_render_scale():
+    assert render_scale(612, 792, dpi=144) == 2.0
+    assert render_scale(612, 792) == render_scale(792, 612)
+
+
+def test_pdf_pages(tmp_path):
+    pytest.importorskip("pypdfium2")
+    from vbimagetotext.pdf import PdfPages, pdf_page_count
+
+    path = tmp_path / "book.pdf"
+    pages = [Image.new("RGB", (300, 400), color) for color in ["white", "black", "gray"]]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    assert pdf_page_count(str(path)) == 3
+
+    with PdfPages(str(path), [3, 1], dpi=72) as rendered:
+        images = list(rendered)
+        assert [page for page, _ in images] == [3, 1]
+        with Image.open(images[0][1]) as image:
+            assert image.getpixel((10, 10))[0] == 128
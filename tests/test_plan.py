@@ -0,0 +1,38 @@
+import pytest
+from click.testing import CliRunner
+from PIL import Image
+
+from vbimagetotext import plan as plan_module
+from vbimagetotext.plan import plan, requests_per_minute
+
+
+@pytest.mark.parametrize("rpm, tpm, rate", [
+    # 4 workers at 15 seconds a request.
+    (None, None, 16),
+    (10, None, 10),
+    # 3000 tokens a minute at 1000 tokens a request.
+    (None, 3000, 3),
+    (2, 3000, 2),
+])
+def test_requests_per_minute(rpm, tpm, rate):
+    assert requests_per_minute(4, 15.0, rpm, tpm, 1000) == rate
+
+
+def test_requests_per_minute_ignores_the_token_limit_without_tokens():
+    assert requests_per_minute(1, 30.0, None, 3000, 0) == 2
+
+
+def test_plan(tmp_path, monkeypatch):
+    monkeypatch.setattr(plan_module, "DEFAULT_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "book").mkdir()
+    for page in range(1, 5):
+        Image.new("RGB", (512, 512), "white").save(tmp_path / "book" / f"page_{page}.png")
+
+    result = CliRunner().invoke(plan, ["-i", str(tmp_path / "book"), "-p", "mcq", "-m", "gpt-4o", "-c", "2",
+                                       "--latency", "30", "--rpm", "1"], catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "4 pages, gpt-4o" in result.output
+    assert "Image tokens per page: min 255, p50 255, p95 255, max 255" in result.output
+    # The request limit is slower than the 4 requests per minute of the workers.
+    assert "Time at 1.0 requests per minute: 4m" in result.output
+    assert (tmp_path / "cache" / "imagemeta.json").exists()
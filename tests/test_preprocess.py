@@ -0,0 +1,63 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from vbimagetotext.preprocess import Preprocessing, make_preprocessing, preprocess_image, preprocess_regions
+
+
+def decode(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "page.png"
+    Image.new("RGB", (3000, 1500), "red").save(path)
+    return str(path)
+
+
+def test_make_preprocessing():
+    assert make_preprocessing(False, True, "png", 90) is None
+    assert make_preprocessing(True, True, "webp", 70) == Preprocessing(grayscale=True, format="WEBP", quality=70)
+    # Cropping alone still re-encodes, at full resolution.
+    assert make_preprocessing(False, False, "jpeg", 85, crop="trim").downscale is False
+
+
+def test_downscale_to_the_model_resolution(photo):
+    image = decode(preprocess_image(photo, Preprocessing()))
+    assert image.format == "JPEG" and image.mode == "RGB"
+    assert image.size == (1024, 512)
+
+    assert decode(preprocess_image(photo, Preprocessing(downscale=False))).size == (3000, 1500)
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "WEBP", "PNG"])
+def test_grayscale_and_format(photo, image_format):
+    preprocessing = Preprocessing(grayscale=True, format=image_format)
+    image = decode(preprocess_image(photo, preprocessing))
+    assert image.format == image_format
+    assert image.mode == "L" or (image_format == "WEBP" and image.mode == "RGB")
+    assert preprocessing.mime_type == f"image/{image_format.lower()}"
+
+
+def test_transparent_png_becomes_rgb_jpeg(tmp_path):
+    path = tmp_path / "page.png"
+    Image.new("RGBA", (100, 100), (0, 0, 0, 0)).save(path)
+    assert decode(preprocess_image(str(path), Preprocessing())).mode == "RGB"
+    assert decode(preprocess_image(str(path), Preprocessing(format="PNG"))).mode == "RGBA"
+
+
+def test_preprocess_regions(tmp_path):
+    path = tmp_path / "page.png"
+    image = Image.new("L", (1000, 2000), 255)
+    ImageDraw.Draw(image).rectangle([100, 100, 599, 299], fill=0)
+    image.save(path)
+
+    [whole] = preprocess_regions(str(path), Preprocessing())
+    assert decode(whole).size == (512, 1024)
+    [trimmed] = preprocess_regions(str(path), Preprocessing(crop="trim"))
+    # The content plus 8 pixels of padding on every side.
+    assert decode(trimmed).size == (516, 216)
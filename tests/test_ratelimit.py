@@ -0,0 +1,117 @@
+import email.utils
+import io
+import time
+
+import pytest
+import requests
+
+from vbimagetotext import ratelimit
+from vbimagetotext.ratelimit import RateLimiter, RequestExecutor, RetryBudget, TokenBucket, make_executor, parse_duration, parse_retry_after
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("1s", 1.0),
+    ("6m0s", 360.0),
+    ("20ms", 0.02),
+    ("1h2m3.5s", 3723.5),
+    ("7d", 604800.0),
+    ("2.5", 2.5),
+    ("soon", None),
+    (None, None),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_parse_retry_after_prefers_milliseconds():
+    assert parse_retry_after({"retry-after-ms": "250", "Retry-After": "3"}) == 0.25
+
+
+def test_parse_retry_after_seconds_and_dates():
+    assert parse_retry_after({"Retry-After": "3"}) == 3.0
+    assert parse_retry_after({"Retry-After": "-1"}) == 0.0
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < parse_retry_after({"Retry-After": date}) <= 30
+    assert parse_retry_after({}) is None
+
+
+def test_parse_retry_after_ignores_malformed_headers():
+    assert parse_retry_after({"Retry-After": "soon"}) is None
+    assert parse_retry_after({"Retry-After": ""}) is None
+    assert parse_retry_after({"retry-after-ms": "soon", "Retry-After": "2"}) == 2.0
+
+
+def test_execute_backs_off_on_a_malformed_retry_after(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda seconds: None)
+    responses = iter([response(503, {"Retry-After": "soon"}), response(200)])
+    executor = RequestExecutor(RateLimiter(), RetryBudget())
+
+    assert executor.execute(lambda: next(responses)).status_code == 200
+
+
+def test_unlimited_bucket_does_not_block():
+    bucket = TokenBucket()
+    start = time.monotonic()
+    for _ in range(1000):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.5
+
+
+def test_bucket_waits_for_refill():
+    # 100 tokens a second.
+    bucket = TokenBucket(6000)
+    bucket.acquire(6000)
+    start = time.monotonic()
+    bucket.acquire(10)
+    assert 0.05 < time.monotonic() - start < 1.0
+
+
+def test_bucket_learns_the_limit_from_the_server():
+    bucket = TokenBucket()
+    bucket.update(limit=100, remaining=40, reset=None)
+    assert bucket.capacity == 100
+    assert bucket.tokens == pytest.approx(40, abs=1)
+
+
+def test_bucket_blocks_until_the_reset_when_exhausted():
+    bucket = TokenBucket(100)
+    bucket.update(limit=100, remaining=0, reset=30)
+    assert bucket.blocked_until > time.monotonic() + 25
+
+
+def response(status_code, headers=None):
+    result = requests.Response()
+    result.status_code = status_code
+    result.headers.update(headers or {})
+    result.raw = io.BytesIO(b"")
+    return result
+
+
+def test_execute_retries_after_the_requested_delay(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    responses = iter([response(503, {"retry-after-ms": "200"}), response(200)])
+    executor = RequestExecutor(RateLimiter(), RetryBudget(), base_delay=0.0)
+
+    assert executor.execute(lambda: next(responses)).status_code == 200
+    assert sleeps == [0.2]
+
+
+def test_execute_stops_when_the_retry_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda seconds: None)
+    executor = RequestExecutor(RateLimiter(), RetryBudget(1))
+
+    assert executor.execute(lambda: response(503)).status_code == 503
+    assert executor.budget.used == 1
+
+
+def test_make_executor_falls_back_to_the_environment(monkeypatch):
+    monkeypatch.setenv("VBIMAGETOTEXT_RPM", "30")
+    monkeypatch.setenv("VBIMAGETOTEXT_MAX_RETRIES", "2")
+    monkeypatch.delenv("VBIMAGETOTEXT_TPM", raising=False)
+
+    executor = make_executor(tokens_per_minute=1000)
+    assert executor.limiter.requests.capacity == 30
+    assert executor.limiter.tokens.capacity == 1000
+    assert executor.budget.max_retries == 2
+    assert make_executor(requests_per_minute=5).limiter.requests.capacity == 5
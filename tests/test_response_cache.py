@@ -0,0 +1,96 @@
+import os
+import threading
+
+from PIL import Image
+
+from vbimagetotext.response_cache import ResponseCache, cache_key
+
+
+KEYS = [f"{digit}" * 64 for digit in "abc"]
+
+
+def age(cache, key, mtime):
+    os.utime(cache._path(key), (mtime, mtime))
+
+
+def test_get_after_put(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get(KEYS[0]) is None
+    cache.put(KEYS[0], "\\item One", model="gpt-4o")
+    assert cache.get(KEYS[0]) == "\\item One"
+    assert cache.stats()["entries"] == 1
+
+
+def test_put_evicts_the_least_recently_used(tmp_path):
+    message = "x" * 1000
+    # Room for two entries.
+    cache = ResponseCache(str(tmp_path), max_size_mb=2500 / (1024 * 1024))
+    cache.put(KEYS[0], message)
+    cache.put(KEYS[1], message)
+    age(cache, KEYS[0], 1000)
+    age(cache, KEYS[1], 2000)
+
+    # Reading the older entry makes it the most recent.
+    assert cache.get(KEYS[0]) == message
+    cache.put(KEYS[2], message)
+
+    assert cache.get(KEYS[1]) is None
+    assert cache.get(KEYS[0]) == message
+    assert cache.get(KEYS[2]) == message
+
+
+def test_prune(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    for mtime, key in enumerate(KEYS):
+        cache.put(key, "message")
+        age(cache, key, 1000 + mtime)
+    assert cache.prune(cache.stats()["size"] - 1) == 1
+    assert cache.get(KEYS[0]) is None
+    assert cache.prune(0) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_get_survives_a_concurrent_prune(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+    cache.put(KEYS[0], "message")
+
+    def removed(path, times=None):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, "utime", removed)
+    assert cache.get(KEYS[0]) == "message"
+
+
+def test_concurrent_puts_and_prunes(tmp_path):
+    # Room for a few entries only, so every put prunes.
+    cache = ResponseCache(str(tmp_path), max_size_mb=300 / (1024 * 1024))
+    errors = []
+
+    def work(worker):
+        try:
+            for i in range(100):
+                key = f"{worker:02x}{i:062x}"
+                cache.put(key, "x" * 50)
+                cache.get(key)
+                cache.stats()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_cache_key(tmp_path):
+    path = tmp_path / "page.png"
+    Image.new("RGB", (10, 10), "white").save(path)
+    images = [str(path)]
+    key = cache_key(images, "prompt", "gpt-4o", 2000)
+    assert key == cache_key(images, "prompt", "gpt-4o", 2000)
+    assert key != cache_key(images, "prompt", "gpt-4o", 1000)
+    assert cache_key(images, ["system", "prompt"], "gpt-4o", 2000) != cache_key(images, "systemprompt", "gpt-4o", 2000)
+
+    Image.new("RGB", (10, 10), "black").save(path)
+    assert key != cache_key(images, "prompt", "gpt-4o", 2000)
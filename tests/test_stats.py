@@ -0,0 +1,73 @@
+import pytest
+from click.testing import CliRunner
+
+from vbimagetotext.metrics import format_duration, percentile
+from vbimagetotext.stats import prompt_caching, stats, summarize
+from vbimagetotext.telemetry import TelemetryLog
+
+
+def record(time, total=None, cache="miss", status="ok", **fields):
+    phases = {} if total is None else {"total": total, "ttfb": total / 2}
+    return {"time": time, "model": "gpt-4o", "prompt": "mcq", "cache": cache, "status": status, "phases": phases, **fields}
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 0.5) == 2.0
+    assert percentile(values, 0.99) == 4.0
+    assert percentile(values, 0) == 1.0
+
+
+def test_format_duration():
+    assert format_duration(42.4) == "42s"
+    assert format_duration(125) == "2m 05s"
+    assert format_duration(3 * 3600 + 61) == "3h 01m 01s"
+
+
+def test_summarize():
+    records = [
+        record(0, 2.0, output_tokens=100, cost=1.0),
+        record(10, 4.0, output_tokens=300, cost=2.0),
+        # Neither cache hits nor errors count towards latency.
+        record(20, 0.01, cache="hit"),
+        record(30, 9.0, status="error"),
+    ]
+    summary = summarize(records)
+    assert (summary["requests"], summary["cached"], summary["failed"]) == (4, 1, 1)
+    assert (summary["p50"], summary["p99"], summary["ttfb_p50"]) == (2.0, 4.0, 1.0)
+    # Active from 0 to 39 seconds.
+    assert summary["requests_per_minute"] == pytest.approx(4 * 60 / 39)
+    assert summary["output_tokens_per_second"] == pytest.approx(400 / 39)
+    assert summary["cost"] == 3.0
+
+
+def test_prompt_caching():
+    records = [
+        record(0, 3.0, tokens_exact=True, input_tokens=2000, cached_tokens=0),
+        record(1, 2.0, tokens_exact=True, input_tokens=2000, cached_tokens=1024, cache_savings=0.5),
+        record(2, 1.0, tokens_exact=False, input_tokens=2000),
+    ]
+    assert prompt_caching(records) == {"mcq": {
+        "requests": 2, "cached_requests": 1, "cached_share": 1024 / 4000,
+        "p50_cached": 2.0, "p50_uncached": 3.0, "savings": 0.5,
+    }}
+
+
+def test_stats_command(tmp_path):
+    path = tmp_path / "telemetry.jsonl"
+    log = TelemetryLog(str(path), enabled=True)
+    for time in (0, 60, 3600):
+        log.write(record(time, 2.0, bytes_sent=1_000_000))
+    log.write({**record(3700, 2.0), "model": "gpt-4o-mini"})
+
+    result = CliRunner().invoke(stats, ["--since", "all", "-w", "1h", "-m", "gpt-4o", "--path", str(path)])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert "2 requests (0 cached, 0 failed)" in lines[0]
+    assert "1 requests" in lines[1]
+    assert "All 1h 00m 00s" in result.output and "3 requests" in result.output
+    assert "Sent 3.00 MB" in result.output
+
+    empty = CliRunner().invoke(stats, ["--path", str(tmp_path / "missing.jsonl")])
+    assert empty.exit_code == 1
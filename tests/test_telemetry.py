@@ -0,0 +1,62 @@
+import threading
+
+from vbimagetotext.prompts import switch_prompt
+from vbimagetotext.telemetry import TelemetryLog, Trace, prompt_key
+
+
+def test_trace_adds_up_phases():
+    trace = Trace()
+    trace.add("connect", 0.5)
+    trace.add("connect", 0.25)
+    trace.add("ttfb", None)
+    with trace.phase("postprocess"):
+        pass
+    assert trace.phases["connect"] == 0.75
+    assert "ttfb" not in trace.phases
+    assert trace.phases["postprocess"] >= 0
+
+    other = Trace()
+    other.add("connect", 1)
+    other.bytes_sent = 100
+    trace.merge(other)
+    assert trace.phases["connect"] == 1.75
+    assert trace.bytes_sent == 100
+
+
+def test_prompt_key():
+    assert prompt_key(switch_prompt("mcq")) == "mcq"
+    assert prompt_key("Some prompt") == prompt_key("Some prompt")
+    assert prompt_key("Some prompt").startswith("custom-")
+
+
+def test_log_reads_back_its_records(tmp_path):
+    log = TelemetryLog(str(tmp_path / "logs" / "telemetry.jsonl"), enabled=True)
+    assert log.read() == []
+    log.write({"time": 100, "status": "ok"})
+    log.write({"time": 200, "status": "error"})
+    with open(log.path, "a") as file:
+        file.write("{not json\n")
+    assert [r["time"] for r in log.read()] == [100, 200]
+    assert [r["time"] for r in log.read(since=150)] == [200]
+
+
+def test_disabled_log_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.setenv("VBIMAGETOTEXT_TELEMETRY", "0")
+    log = TelemetryLog(str(tmp_path / "telemetry.jsonl"))
+    log.write({"time": 100})
+    assert not (tmp_path / "telemetry.jsonl").exists()
+
+
+def test_concurrent_writes_keep_whole_lines(tmp_path):
+    log = TelemetryLog(str(tmp_path / "telemetry.jsonl"), enabled=True)
+
+    def work(worker):
+        for i in range(100):
+            log.write({"time": i, "worker": worker, "padding": "x" * 500})
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(log.read()) == 400
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from vbimagetotext import token_cost_calculations
+from vbimagetotext.token_cost_calculations import (
+    CostLedger, cache_savings, cached_input_rate, count_text_tokens, estimate_piece_tokens, exact_text_tokens,
+    image_tokens, model_pricing, tokens_cost,
+)
+
+
+@pytest.fixture
+def no_tiktoken(monkeypatch):
+    monkeypatch.setattr(token_cost_calculations, "tiktoken", None)
+    token_cost_calculations._encoding.cache_clear()
+    yield
+    token_cost_calculations._encoding.cache_clear()
+
+
+def test_estimator_without_tiktoken(no_tiktoken):
+    assert not exact_text_tokens("gpt-4o")
+    assert count_text_tokens("") == 0
+    # o200k_base counts 29 tokens for this.
+    latex = r"\begin{equation} x^2 + y^2 = z^2 \end{equation} The quick brown fox."
+    assert 20 <= count_text_tokens(latex, "gpt-4o") <= 40
+
+
+@pytest.mark.parametrize("piece, tokens", [
+    (" the", 1),
+    ("1234567", 3),
+    ("\\frac", 2),
+    ("{}", 1),
+    ("\n\n", 1),
+])
+def test_estimate_piece_tokens(piece, tokens):
+    assert estimate_piece_tokens(piece) == tokens
+
+
+def test_image_tokens():
+    assert image_tokens(512, 512) == 255
+    # Downscaled to 1024 x 512 first.
+    assert image_tokens(2048, 1024) == 85 + 170 * 2
+
+
+def test_model_pricing():
+    assert model_pricing("gpt-4o-mini") == (0.15, 0.6)
+    # Dated snapshots are priced like their base model.
+    assert model_pricing("gpt-4o-mini-2024-07-18") == (0.15, 0.6)
+    assert model_pricing("unknown") == token_cost_calculations.DEFAULT_PRICING
+
+
+def test_cached_input_pricing():
+    assert cached_input_rate("gpt-4o-mini") == 0.5
+    assert cached_input_rate("gemini-1.5-flash") == 0.25
+    assert cached_input_rate("gpt-4-turbo") == 1.0
+    assert cache_savings("gpt-4-turbo", 1000) == 0
+    assert cache_savings("gpt-4o", 1000) == pytest.approx(tokens_cost(1000, 5.0) / 2)
+
+
+def test_ledger_totals():
+    ledger = CostLedger()
+    ledger.add("gpt-4o", 1000, 100)
+    ledger.add("gpt-4o", 2000, 200, cached_tokens=1024)
+    ledger.add("gpt-4o-mini", 500, 50, exact=False)
+    totals = ledger.totals()
+
+    assert totals["gpt-4o"] == {
+        "requests": 2, "input_tokens": 3000, "output_tokens": 300, "cached_tokens": 1024,
+        "cost": pytest.approx(tokens_cost(3000, 5.0) + tokens_cost(300, 15.0) - tokens_cost(1024, 2.5)),
+    }
+    assert totals["gpt-4o-mini"]["requests"] == 1
+    assert ledger.total_cost() == pytest.approx(totals["gpt-4o"]["cost"] + totals["gpt-4o-mini"]["cost"])
+
+
+def test_ledger_merge():
+    page = CostLedger()
+    page.add("gpt-4o", 1000, 100, cached_tokens=128)
+    run = CostLedger()
+    run.add("gpt-4o", 10, 1)
+    run.merge(page)
+    run.merge(page)
+    assert run.totals()["gpt-4o"]["requests"] == 3
+    assert run.totals()["gpt-4o"]["cached_tokens"] == 256
+
+
+def test_ledger_from_many_threads():
+    ledger = CostLedger()
+
+    def work():
+        for _ in range(200):
+            ledger.add("gpt-4o", 1, 1)
+            ledger.totals()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ledger.totals()["gpt-4o"]["requests"] == 800
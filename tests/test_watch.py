@@ -0,0 +1,89 @@
+import os
+import sys
+
+import pytest
+
+from vbimagetotext.watch import Debouncer, PollingWatcher, is_stale, make_watcher, mirror_path, scan_tree
+
+
+def set_mtime(path, seconds):
+    os.utime(path, ns=(seconds * 10 ** 9, seconds * 10 ** 9))
+
+
+def test_debouncer_waits_for_the_file_to_settle(tmp_path):
+    scan = tmp_path / "scan.png"
+    scan.write_bytes(b"x")
+    debouncer = Debouncer(settle=2)
+    debouncer.touch(str(scan), now=100)
+    assert debouncer.ready(now=101) == []
+    assert debouncer.timeout(now=101) == 1
+
+    # Still being written: the wait starts over.
+    scan.write_bytes(b"xx")
+    assert debouncer.ready(now=101.5) == []
+    assert debouncer.ready(now=103) == []
+    assert debouncer.ready(now=103.5) == [str(scan)]
+    assert debouncer.pending == {}
+    assert debouncer.timeout(now=104, default=5) == 5
+
+
+def test_debouncer_drops_removed_files(tmp_path):
+    scan = tmp_path / "scan.png"
+    scan.write_bytes(b"x")
+    debouncer = Debouncer(settle=0)
+    debouncer.touch(str(scan), now=0)
+    scan.unlink()
+    assert debouncer.ready(now=10) == []
+    assert debouncer.pending == {}
+
+
+def test_mirror_path():
+    assert mirror_path("scans/ch1/page_1.png", "scans", "out") == os.path.join("out", "ch1", "page_1.tex")
+    assert mirror_path("/in/scan.jpeg", "/in", "/out") == "/out/scan.tex"
+
+
+def test_is_stale(tmp_path):
+    scan = tmp_path / "scan.png"
+    output = tmp_path / "scan.tex"
+    assert not is_stale(str(scan), str(output))
+
+    scan.write_bytes(b"x")
+    assert is_stale(str(scan), str(output))
+    output.write_text("\\item")
+    set_mtime(scan, 1000)
+    set_mtime(output, 2000)
+    assert not is_stale(str(scan), str(output))
+    # Rescanned after the output was written.
+    set_mtime(scan, 3000)
+    assert is_stale(str(scan), str(output))
+
+
+def test_scan_tree_skips_the_output_directory(tmp_path):
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "copy.png").write_bytes(b"x")
+    (tmp_path / "scan.png").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_text("")
+    assert list(scan_tree(str(tmp_path), exclude=str(tmp_path / "out"))) == [str(tmp_path / "scan.png")]
+
+
+def test_polling_watcher_reports_changes(tmp_path):
+    watcher = PollingWatcher(str(tmp_path), interval=0)
+    (tmp_path / "scan.png").write_bytes(b"x")
+    assert watcher.poll(0) == [str(tmp_path / "scan.png")]
+    assert watcher.poll(0) == []
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_watcher_reports_new_directories(tmp_path):
+    watcher = make_watcher(str(tmp_path))
+    try:
+        (tmp_path / "ch1").mkdir()
+        (tmp_path / "ch1" / "scan.png").write_bytes(b"x")
+        changed = set()
+        for _ in range(10):
+            changed.update(watcher.poll(0.1))
+            if str(tmp_path / "ch1" / "scan.png") in changed:
+                break
+        assert str(tmp_path / "ch1" / "scan.png") in changed
+    finally:
+        watcher.close()
@@ -0,0 +1,500 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Union
+
+from rich.console import Console
+
+from .client import post_chat_completion, received_bytes
+from .mockserver import mock_packed_answer
+from .payload import ImageData
+from .preprocess import Preprocessing, preprocess_regions
+from .ratelimit import RETRYABLE_STATUS_CODES, APIError, get_executor
+from .telemetry import Trace
+from .token_cost_calculations import count_text_tokens, count_total_image_tokens
+
+
+@dataclass
+class GenerateOptions:
+    """
+    Settings of one generation request, shared by every backend.
+    """
+    model: str
+    max_tokens: int = 2000
+    preprocessing: Preprocessing = None
+    # Stream the response, calling `on_text` with every chunk as it arrives.
+    stream: bool = False
+    on_text: Callable[[str], None] = None
+    # Collects phase timings and sizes for the telemetry log.
+    trace: Optional[Trace] = None
+    # Page numbers of the images of a packed request, see `packing`.
+    pages: Optional[List[int]] = None
+
+
+@dataclass
+class Generation:
+    """
+    The result of a generation request.
+
+    `usage` has `prompt_tokens` and `completion_tokens` when the provider reported
+    them, and is None otherwise. `cached_tokens`, when present, are the prompt tokens
+    the provider read from its prompt cache. `timings` has the seconds to the `first_token` (None
+    unless streaming) and the `total` seconds. `model` is the model that answered,
+    when it may differ from the one asked for.
+    """
+    text: str
+    usage: Optional[dict] = None
+    timings: dict = field(default_factory=dict)
+    model: Optional[str] = None
+
+
+class Cancelled(Exception):
+    """
+    Raised from an `on_text` callback to stop a streaming request, e.g. the loser
+    of a hedged request. The connection is closed, which stops the generation.
+    """
+
+
+def text_parts(prompt: Union[str, List[str]]) -> List[str]:
+    return [prompt] if isinstance(prompt, str) else list(prompt)
+
+
+def with_cached_tokens(usage: Optional[dict]) -> Optional[dict]:
+    """
+    Adds `cached_tokens` to the `usage` block of a chat completion, from its
+    `prompt_tokens_details`.
+    """
+    if usage:
+        usage["cached_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return usage
+
+
+def create_image_dicts(image_names: List[str], preprocessing: Preprocessing = None) -> List[dict]:
+    """
+    Creates a list of image dictionaries for the request payload.
+
+    The URLs are `ImageData` objects that `StreamingBody` encodes to base64 data URLs
+    chunk by chunk while the request is sent, with the MIME type detected from the
+    file header.
+
+    Args:
+        image_names (List[str]): List of image file names.
+        preprocessing (Preprocessing, optional): Downscale and re-encode the images first.
+
+    Returns:
+        List[dict]: List of dictionaries containing the image data.
+    """
+    image_datas = []
+    for image_name in image_names:
+        if preprocessing is not None:
+            # Cropping may turn one image into several regions.
+            image_datas.extend(
+                ImageData(data=data, mime_type=preprocessing.mime_type)
+                for data in preprocess_regions(image_name, preprocessing))
+        else:
+            image_datas.append(ImageData(path=image_name))
+    image_dicts = []
+    for image_data in image_datas:
+        image_dict = {
+            "type": "image_url",
+            "image_url": {
+                "url": image_data
+            }
+        }
+        image_dicts.append(image_dict)
+    return image_dicts
+
+
+def image_payload(image_names: List[str], prompt: Union[str, List[str]], model: str, max_tokens: int, preprocessing: Preprocessing = None) -> dict:
+    """
+    Builds the chat completion payload for a prompt and a list of images.
+
+    The first text part, the prompt template, is sent alone as the system message,
+    byte for byte the same for every request with that prompt, so the provider's
+    prompt cache can serve it. What changes from request to request, the images and
+    any further text parts, follows in the user message.
+
+    Args:
+        image_names (List[str]): List of image file names.
+        prompt (Union[str, List[str]]): Prompt for the model, or the prompt followed
+            by text parts that vary per request.
+        model (str): The model name.
+        max_tokens (int): Maximum number of tokens to generate.
+        preprocessing (Preprocessing, optional): Downscale and re-encode the images first.
+
+    Returns:
+        dict: The payload, with `ImageData` in place of the image URLs.
+    """
+    image_dicts = create_image_dicts(image_names, preprocessing)
+    system, *texts = text_parts(prompt)
+
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": system
+            },
+            {
+                "role": "user",
+                "content": [
+                    *image_dicts,
+                    *({"type": "text", "text": text} for text in texts)
+                ]
+            }
+        ],
+        "max_tokens": max_tokens
+    }
+
+
+def estimate_request_tokens(image_names: List[str], prompt: str, max_tokens: int) -> int:
+    """
+    Roughly estimates the tokens a request counts against the tokens per minute limit.
+
+    The API reserves `max_tokens` for the completion up front, so it is included.
+    """
+    return count_total_image_tokens(image_names) + count_text_tokens(prompt) + max_tokens
+
+
+def response_content(response) -> tuple:
+    """
+    Returns the message content and the token usage of a chat completion response.
+
+    Raises:
+        APIError: If the request failed or the response has no message.
+    """
+    if response.status_code != 200:
+        raise APIError(
+            f"API request failed with status code {response.status_code}.", response.status_code)
+
+    response_json = response.json()
+    if 'choices' not in response_json or 'message' not in response_json["choices"][0]:
+        raise APIError("'choices' or 'message' not found in the API response.")
+    return response_json["choices"][0]["message"]["content"], with_cached_tokens(response_json.get("usage"))
+
+
+class Backend:
+    """
+    A model provider.
+
+    `generate` is a coroutine, so requests to any provider can be awaited together;
+    `generate_sync` runs one from synchronous code, e.g. a worker thread.
+    """
+    name = "backend"
+
+    async def generate(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        """
+        Sends a prompt and images to the model.
+
+        Args:
+            images (List[str]): Paths of the images.
+            prompt (Union[str, List[str]]): The prompt, or several text parts sent in order.
+            options (GenerateOptions): Model, token limit, preprocessing and streaming.
+
+        Returns:
+            Generation: The text, token usage and timings.
+
+        Raises:
+            APIError: If the request failed after all retries.
+        """
+        raise NotImplementedError
+
+    def generate_sync(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        return asyncio.run(self.generate(images, prompt, options))
+
+
+# Not the event loop's default executor: `asyncio.run` waits for that one on exit,
+# which would hold up a run on the abandoned loser of a hedged request.
+_blocking_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="backend")
+
+
+class ThreadedBackend(Backend):
+    """
+    A backend whose client library blocks. Requests run in a worker thread, so they
+    share the pooled connections, rate limiter and retries of the sync code paths.
+    """
+
+    async def generate(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_blocking_executor, self.generate_blocking, images, prompt, options)
+
+    def generate_sync(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        # No event loop needed when the caller is synchronous anyway.
+        return self.generate_blocking(images, prompt, options)
+
+    def generate_blocking(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        raise NotImplementedError
+
+
+class OpenAIBackend(ThreadedBackend):
+    """
+    Chat completions over the pooled `requests` session in `client`.
+    """
+    name = "openai"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def generate_blocking(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        trace = options.trace or Trace()
+        start = time.perf_counter()
+        with trace.phase("prepare"):
+            payload = image_payload(images, prompt, options.model, options.max_tokens, options.preprocessing)
+            tokens = estimate_request_tokens(images, "".join(text_parts(prompt)), options.max_tokens)
+        if not options.stream:
+            response = post_chat_completion(payload, self.api_key, tokens=tokens, trace=trace)
+            trace.bytes_received += received_bytes(response)
+            message, usage = response_content(response)
+            return Generation(message, usage, {"first_token": None, "total": time.perf_counter() - start})
+
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        response = post_chat_completion(payload, self.api_key, stream=True, tokens=tokens, trace=trace)
+        if response.status_code != 200:
+            raise APIError(
+                f"API request failed with status code {response.status_code}.", response.status_code)
+
+        parts = []
+        usage = None
+        first_token = None
+        with response:
+            for line in response.iter_lines():
+                # Decoded here, requests yields bytes when the charset is not declared.
+                line = line.decode("utf-8")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = with_cached_tokens(chunk["usage"])
+                if not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    parts.append(delta)
+                    if options.on_text is not None:
+                        options.on_text(delta)
+            trace.bytes_received += received_bytes(response)
+        return Generation("".join(parts), usage, {"first_token": first_token, "total": time.perf_counter() - start})
+
+
+_genai_lock = threading.Lock()
+_genai_settings = None
+# Gemini models from before 1.5 answer a system instruction with a 400 error.
+GEMINI_LEGACY_PREFIXES = ("gemini-pro", "gemini-1.0")
+
+
+def supports_system_instruction(model: str) -> bool:
+    return not model.startswith(GEMINI_LEGACY_PREFIXES)
+
+
+class GeminiBackend(ThreadedBackend):
+    """
+    Google's Gemini models through `google.generativeai`, or the offline stub model
+    with the `stub` transport.
+
+    Requests go through the shared rate limiter, and failures before the first chunk
+    of the response are retried with backoff.
+    """
+    name = "gemini"
+
+    def __init__(self, api_key: str = None, transport: str = "grpc"):
+        self.api_key = api_key
+        self.transport = transport
+
+    def model(self, name: str, system_instruction: str = None):
+        global _genai_settings
+        if self.transport == "stub":
+            from .gemini_stub import StubGenerativeModel
+            return StubGenerativeModel(name, system_instruction=system_instruction)
+
+        # Imported here, google.generativeai alone takes longer to load than the rest of the CLI.
+        import google.generativeai as genai
+
+        with _genai_lock:
+            # genai keeps its client settings globally, so only reconfigure on change.
+            if _genai_settings != (self.api_key, self.transport):
+                genai.configure(api_key=self.api_key, transport=self.transport)
+                _genai_settings = (self.api_key, self.transport)
+        return genai.GenerativeModel(name, system_instruction=system_instruction)
+
+    def load_images(self, images: List[str], preprocessing: Preprocessing = None) -> list:
+        from PIL import Image
+
+        if preprocessing is None:
+            return [Image.open(image_name) for image_name in images]
+        return [
+            Image.open(io.BytesIO(data))
+            for image_name in images
+            for data in preprocess_regions(image_name, preprocessing)
+        ]
+
+    def generate_blocking(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        trace = options.trace or Trace()
+        start = time.perf_counter()
+        with trace.phase("prepare"):
+            # Laid out like `image_payload`: the prompt template as the system
+            # instruction, the images and varying text after it. Older models
+            # get the template as the first content part instead.
+            system, *texts = text_parts(prompt)
+            contents = [*self.load_images(images, options.preprocessing), *texts]
+            if supports_system_instruction(options.model):
+                model = self.model(options.model, system)
+            else:
+                model = self.model(options.model)
+                contents.insert(0, system)
+            tokens = estimate_request_tokens(images, "".join(text_parts(prompt)), options.max_tokens)
+        parts = []
+        timings = {"first_token": None}
+
+        def attempt():
+            response = model.generate_content(
+                contents, stream=options.stream,
+                generation_config={"max_output_tokens": options.max_tokens})
+            if not options.stream:
+                parts.append(response.text)
+                return response
+            for chunk in response:
+                text = chunk.text
+                if timings["first_token"] is None:
+                    timings["first_token"] = time.perf_counter() - start
+                parts.append(text)
+                if options.on_text is not None:
+                    options.on_text(text)
+            return response
+
+        def retryable(error: Exception) -> bool:
+            # Once text has been passed on, a retry would repeat it.
+            if parts:
+                return False
+            return getattr(error, "code", None) in RETRYABLE_STATUS_CODES or isinstance(error, (ConnectionError, TimeoutError))
+
+        response = get_executor().call(attempt, tokens, retryable)
+        if not parts:
+            raise APIError("'text' not found in the response.")
+        metadata = getattr(response, "usage_metadata", None)
+        usage = None
+        if metadata is not None and getattr(metadata, "prompt_token_count", None):
+            usage = {
+                "prompt_tokens": metadata.prompt_token_count,
+                "completion_tokens": metadata.candidates_token_count,
+                "total_tokens": metadata.total_token_count,
+                "cached_tokens": getattr(metadata, "cached_content_token_count", 0) or 0,
+            }
+        timings["total"] = time.perf_counter() - start
+        return Generation("".join(parts), usage, timings)
+
+
+class MockBackend(Backend):
+    """
+    In-process stand-in for a provider, for offline runs and benchmarks.
+
+    The answer names a hash of the request, so different pages get different answers
+    and the same page always gets the same one; a packed request gets one marked
+    answer per image. `delay` (`VBIMAGETOTEXT_MOCK_DELAY`,
+    default 0) is the simulated latency before the first chunk.
+    """
+    name = "mock"
+
+    def __init__(self, delay: float = None):
+        if delay is None:
+            delay = float(os.getenv("VBIMAGETOTEXT_MOCK_DELAY", "0"))
+        self.delay = delay
+
+    async def generate(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        start = time.perf_counter()
+        digest = hashlib.sha256()
+        for text in text_parts(prompt):
+            digest.update(text.encode("utf-8"))
+        image_digests = []
+        for image_name in images:
+            with open(image_name, "rb") as image_file:
+                data = image_file.read()
+            digest.update(data)
+            image_digests.append(hashlib.sha256(data).hexdigest()[:12])
+        text = f"```latex\n\\item Mock response {digest.hexdigest()[:12]}\n```"
+        if options.pages:
+            text = mock_packed_answer(options.pages, image_digests)
+
+        await asyncio.sleep(self.delay)
+        first_token = time.perf_counter() - start
+        if options.stream and options.on_text is not None:
+            words = text.split(" ")
+            for word in words[:-1]:
+                options.on_text(word + " ")
+            options.on_text(words[-1])
+        usage = {
+            "prompt_tokens": count_total_image_tokens(images) + count_text_tokens("".join(text_parts(prompt)), options.model),
+            "completion_tokens": count_text_tokens(text, options.model),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        timings = {"first_token": first_token if options.stream else None, "total": time.perf_counter() - start}
+        return Generation(text, usage, timings)
+
+
+def backend_name(model: str) -> str:
+    """
+    Returns the provider that serves a model: `gemini`, `mock` or `openai`.
+    """
+    if model.startswith("gemini"):
+        return "gemini"
+    if model.startswith("mock"):
+        return "mock"
+    return "openai"
+
+
+API_KEY_VARIABLES = {
+    "openai": "OPENAI_API_KEY",
+    "gemini": "GOOGLE_API_KEY",
+}
+
+
+def require_api_key(model: str) -> Optional[str]:
+    """
+    Returns the API key for the provider of a model, exiting with an error if it is not set.
+
+    Returns:
+        str: The key, or None for the mock backend which needs none.
+    """
+    variable = API_KEY_VARIABLES.get(backend_name(model))
+    if variable is None:
+        return None
+    api_key = os.getenv(variable)
+    if api_key is None:
+        console = Console()
+        console.print(
+            f"API key not found. Please set the {variable} environment variable.", style="bold red")
+        sys.exit(1)
+    return api_key
+
+
+def make_backend(model: str, api_key: str = None, transport: str = None) -> Backend:
+    """
+    Creates the backend for a model.
+
+    Args:
+        model (str): The model name, e.g. `gpt-4o`, `gemini-1.5-flash` or `mock`.
+        api_key (str, optional): API key of the provider.
+        transport (str, optional): Gemini transport, `grpc`, `rest` or `stub`.
+            Defaults to `VBIMAGETOTEXT_GEMINI_TRANSPORT` or `grpc`.
+
+    Returns:
+        Backend: The backend.
+    """
+    name = backend_name(model)
+    if name == "gemini":
+        transport = transport or os.getenv("VBIMAGETOTEXT_GEMINI_TRANSPORT", "grpc")
+        return GeminiBackend(api_key, transport)
+    if name == "mock":
+        return MockBackend()
+    return OpenAIBackend(api_key)
@@ -0,0 +1,385 @@
+import click
+import json
+import os
+import re
+import shutil
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+from rich.console import Console
+
+from .client import api_request
+from .backends import image_payload, require_api_key
+from .functions import extract_latex, write_atomic
+from .imagemeta import find_images
+from .payload import StreamingBody
+from .preprocess import make_preprocessing, preprocessing_options
+from .prompts import switch_prompt
+from .token_cost_calculations import CostLedger
+from .choice_option import ChoiceOption
+
+
+MANIFEST = "manifest.json"
+
+
+def page_output_name(image_path: str) -> str:
+    """
+    Names the .tex file of a page: `problem_{i}.tex` for `name_{i}.png`, like `gptloop`,
+    and the image name with a .tex extension otherwise.
+    """
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    match = re.search(r"_(\d+)$", stem)
+    if match:
+        return f"problem_{match.group(1)}.tex"
+    return f"{stem}.tex"
+
+
+def output_collisions(image_paths: List[str]) -> Dict[str, List[str]]:
+    """
+    Returns the output names shared by several images, e.g. `page_1.png` and
+    `page_1.jpg`, with the images that would overwrite each other.
+    """
+    images = {}
+    for image_path in image_paths:
+        images.setdefault(page_output_name(image_path), []).append(image_path)
+    return {name: paths for name, paths in images.items() if len(paths) > 1}
+
+
+def load_manifest(work_dir: str) -> dict:
+    path = os.path.join(work_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_manifest(work_dir: str, manifest: dict) -> None:
+    write_atomic(os.path.join(work_dir, MANIFEST), json.dumps(manifest, indent=2))
+
+
+def check_response(response, action: str) -> dict:
+    if response.status_code != 200:
+        console = Console()
+        console.print(
+            f"Error: {action} failed with status code {response.status_code}: {response.text}", style="bold red")
+        sys.exit(1)
+    return response.json()
+
+
+def download_file(file_id: str, path: str, api_key: str) -> None:
+    """
+    Downloads the content of an API file, unless it is already at `path`.
+    """
+    if os.path.exists(path):
+        return
+    response = api_request("GET", f"/files/{file_id}/content", api_key, stream=True)
+    if response.status_code != 200:
+        check_response(response, "Download")
+    with response, open(path + ".tmp", "wb") as file:
+        for chunk in response.iter_content(chunk_size=1 << 20):
+            file.write(chunk)
+    os.replace(path + ".tmp", path)
+
+
+def read_results(path: str) -> Iterator[dict]:
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def result_error(result: dict) -> str:
+    """
+    Describes why a request of a batch failed, from its line in the output or error file.
+    """
+    error = result.get("error")
+    if not error:
+        response = result.get("response") or {}
+        error = (response.get("body") or {}).get("error") or f"status code {response.get('status_code')}"
+    if isinstance(error, dict):
+        return f"{error.get('code') or error.get('type')}: {error.get('message')}"
+    return str(error)
+
+
+@click.group(
+    help="Convert whole books through the OpenAI Batch API."
+)
+def batch():
+    """
+    Convert whole books through the OpenAI Batch API.
+
+    The state of a batch lives in `manifest.json` inside the work directory, so every
+    step can be re-run after a crash and picks up where it stopped.
+    """
+    pass
+
+
+work_dir_option = click.option(
+    "-w",
+    "--work-dir",
+    type=click.Path(file_okay=False),
+    default="./batch",
+    show_default=True,
+    help="Directory holding the batch manifest, input and output files",
+)
+
+
+@batch.command(
+    help="Build a JSONL batch file from images and submit it."
+)
+@click.option(
+    "-i",
+    "--images",
+    required=True,
+    help="Directory of page images, or a glob pattern like 'book/page_*.png'",
+)
+@click.option(
+    "-p",
+    "--prompt",
+    cls=ChoiceOption,
+    type=click.Choice(
+        [
+            "assertion_reason",
+            "mcq",
+            "mcq_list",
+            "mcq_solution",
+            "subjective",
+            "subjective_list",
+            "match",
+            "comprehension",
+            "answer",
+            "subjective_irodov",
+            "solution_irodov",
+            "prompt",
+        ],
+        case_sensitive=False),
+    prompt=True,
+    default=2,
+    show_default=True,
+    help="Prompt to use for the completion",
+)
+@click.option(
+    "-m",
+    "--model",
+    cls=ChoiceOption,
+    type=click.Choice(
+        [
+            "gpt-4o",
+            "gpt-4o-2024-08-06",
+            "gpt-4-turbo",
+            "gpt-4o-mini"
+        ],
+        case_sensitive=False),
+    prompt=True,
+    default=1,
+    show_default=True,
+    help="Model to use for the completion",
+)
+@click.option(
+    "--max-tokens",
+    type=int,
+    default=2000,
+    show_default=True,
+    help="The maximum number of tokens to generate.",
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default="./src/src_tex",
+    show_default=True,
+    help="Directory the per-page .tex files are collected into",
+)
+@work_dir_option
+@preprocessing_options
+def submit(images, prompt, model, max_tokens, output_dir, work_dir, downscale, grayscale, image_format, quality, crop):
+    """
+    Build a JSONL batch file from images and submit it.
+    """
+    api_key = require_api_key(model)
+    console = Console()
+    os.makedirs(work_dir, exist_ok=True)
+
+    manifest = load_manifest(work_dir)
+    if manifest is None:
+        image_paths = find_images(images)
+        if not image_paths:
+            console.print(f"Error: No images found for {images}.", style="bold red")
+            sys.exit(1)
+        collisions = output_collisions(image_paths)
+        if collisions:
+            for name, paths in collisions.items():
+                console.print(f"Error: {', '.join(paths)} would all be written to {name}.", style="bold red")
+            console.print("Rename the images so that every page number appears once.", style="bold red")
+            sys.exit(1)
+
+        if prompt == "prompt":
+            prompt = click.prompt("Please enter your custom prompt", type=str)
+
+        manifest = {
+            "prompt": switch_prompt(prompt),
+            "model": model,
+            "max_tokens": max_tokens,
+            "pages": {
+                f"page-{index}": {
+                    "image": image_path,
+                    "output": os.path.join(output_dir, page_output_name(image_path)),
+                    "done": False,
+                }
+                for index, image_path in enumerate(image_paths)
+            },
+        }
+        save_manifest(work_dir, manifest)
+    else:
+        console.print(
+            f"Resuming the batch in {work_dir}, the options of the first submit are kept.", style="deep_pink3")
+
+    if "input_file" not in manifest:
+        preprocessing = make_preprocessing(downscale, grayscale, image_format, quality, crop)
+        input_file = os.path.join(work_dir, "input.jsonl")
+        with open(input_file + ".tmp", "wb") as file:
+            for custom_id, page in manifest["pages"].items():
+                request = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": image_payload(
+                        [page["image"]], manifest["prompt"], manifest["model"],
+                        manifest["max_tokens"], preprocessing),
+                }
+                shutil.copyfileobj(StreamingBody(request), file)
+                file.write(b"\n")
+        os.replace(input_file + ".tmp", input_file)
+        manifest["input_file"] = input_file
+        save_manifest(work_dir, manifest)
+        console.print(f"Wrote {len(manifest['pages'])} requests to {input_file}")
+
+    if "file_id" not in manifest:
+        with open(manifest["input_file"], "rb") as file:
+            response = api_request(
+                "POST", "/files", api_key,
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(manifest["input_file"]), file)},
+            )
+        manifest["file_id"] = check_response(response, "Upload")["id"]
+        save_manifest(work_dir, manifest)
+        console.print(f"Uploaded {manifest['input_file']} as {manifest['file_id']}")
+
+    if "batch_id" not in manifest:
+        response = api_request(
+            "POST", "/batches", api_key,
+            json={
+                "input_file_id": manifest["file_id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h",
+            },
+        )
+        batch_info = check_response(response, "Batch creation")
+        manifest["batch_id"] = batch_info["id"]
+        manifest["status"] = batch_info["status"]
+        save_manifest(work_dir, manifest)
+
+    console.print(f"Batch {manifest['batch_id']} submitted.", style="deep_pink3")
+
+
+def refresh_status(work_dir: str) -> Tuple[dict, str]:
+    """
+    Loads the manifest of the submitted batch and updates it with the batch's status.
+
+    Returns:
+        Tuple[dict, str]: The manifest and the API key.
+    """
+    manifest = load_manifest(work_dir)
+    if manifest is None or "batch_id" not in manifest:
+        Console().print(f"Error: No submitted batch in {work_dir}.", style="bold red")
+        sys.exit(1)
+    api_key = require_api_key(manifest["model"])
+    response = api_request("GET", f"/batches/{manifest['batch_id']}", api_key)
+    batch_info = check_response(response, "Status request")
+    manifest["status"] = batch_info["status"]
+    manifest["output_file_id"] = batch_info.get("output_file_id")
+    manifest["error_file_id"] = batch_info.get("error_file_id")
+    manifest["request_counts"] = batch_info.get("request_counts")
+    manifest["errors"] = batch_info.get("errors")
+    save_manifest(work_dir, manifest)
+    return manifest, api_key
+
+
+@batch.command(
+    help="Show the status of the submitted batch."
+)
+@work_dir_option
+def status(work_dir):
+    """
+    Show the status of the submitted batch.
+    """
+    manifest, _ = refresh_status(work_dir)
+    console = Console()
+    console.print(f"Batch {manifest['batch_id']}: {manifest['status']}", style="deep_pink3")
+    counts = manifest.get("request_counts") or {}
+    if counts:
+        console.print(
+            f"Completed {counts.get('completed', 0)} of {counts.get('total', 0)}, failed {counts.get('failed', 0)}")
+    done = sum(page["done"] for page in manifest["pages"].values())
+    console.print(f"Collected {done} of {len(manifest['pages'])} pages")
+
+
+@batch.command(
+    help="Download the results of a finished batch into per-page .tex files."
+)
+@work_dir_option
+def collect(work_dir):
+    """
+    Download the results of a finished batch into per-page .tex files.
+
+    Pages that were already collected are skipped, so this is safe to re-run.
+    """
+    console = Console()
+    manifest, api_key = refresh_status(work_dir)
+    if manifest.get("output_file_id") is None and manifest.get("error_file_id") is None:
+        if manifest["status"] in ("failed", "expired", "cancelled"):
+            console.print(f"Batch {manifest['batch_id']} {manifest['status']} without results.", style="bold red")
+        else:
+            console.print(
+                f"Batch {manifest['batch_id']} has no output yet, status: {manifest['status']}", style="bold red")
+        for error in (manifest.get("errors") or {}).get("data") or []:
+            console.print(f"  {error.get('code')}: {error.get('message')}", style="bold red", markup=False)
+        sys.exit(1)
+
+    # Successful requests are in the output file, failed ones in the error file.
+    result_files = []
+    for key in ("output_file_id", "error_file_id"):
+        if manifest.get(key) is not None:
+            path = os.path.join(work_dir, f"{manifest[key]}.jsonl")
+            download_file(manifest[key], path, api_key)
+            result_files.append(path)
+
+    written = failed = 0
+    ledger = CostLedger()
+    for path in result_files:
+        for result in read_results(path):
+            page = manifest["pages"].get(result["custom_id"])
+            if page is None or page["done"]:
+                continue
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                failed += 1
+                console.print(
+                    f"Error: {page['image']} failed: {result_error(result)}", style="bold red", markup=False)
+                continue
+            message = response["body"]["choices"][0]["message"]["content"]
+            usage = response["body"].get("usage")
+            if usage:
+                ledger.add(manifest["model"], usage["prompt_tokens"], usage["completion_tokens"])
+            os.makedirs(os.path.dirname(page["output"]) or ".", exist_ok=True)
+            write_atomic(page["output"], extract_latex(message))
+            page["done"] = True
+            written += 1
+    save_manifest(work_dir, manifest)
+
+    remaining = sum(not page["done"] for page in manifest["pages"].values())
+    console.print(
+        f"Wrote {written} pages, {failed} failed, {remaining} not collected.", style="deep_pink3")
+    if written:
+        # List prices, the Batch API bills about half of this.
+        ledger.print_summary()
@@ -0,0 +1,465 @@
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+import click
+
+from .response_cache import DEFAULT_CACHE_DIR
+
+
+# Modules no command should need just to print its help.
+HEAVY_MODULES = ["PIL", "google.generativeai", "openai", "tiktoken", "numpy", "pypdfium2"]
+# Modules the group itself should not need to list its commands.
+GROUP_MODULES = HEAVY_MODULES + ["requests", "rich", "pyperclip"]
+
+# Throughput scenarios, each run in a fresh interpreter so its peak RSS is its own.
+SCENARIOS = ["process_images", "process_text", "gptloop"]
+BENCH_MODEL = "gpt-4o"
+DEFAULT_HISTORY_PATH = os.path.join(DEFAULT_CACHE_DIR, "bench-history.jsonl")
+# Size of a synthetic page, A4 at 150 dpi.
+PAGE_SIZE = (1240, 1754)
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from vbimagetotext.main import main
+try:
+    main(sys.argv[1:], prog_name="vbimagetotext", standalone_mode=False)
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+heavy = json.loads({heavy!r})
+loaded = [name for name in heavy if name in sys.modules]
+sys.stderr.write(json.dumps({{"seconds": elapsed, "loaded": loaded}}) + "\\n")
+"""
+
+
+def measure_startup(args: list, heavy_modules: list) -> dict:
+    """
+    Runs the CLI with `args` in a fresh interpreter.
+
+    Returns:
+        dict: The wall-clock `seconds` of the whole process, the `import_seconds` from
+        importing the CLI to the end of the command, and the heavy modules `loaded`.
+    """
+    script = STARTUP_SCRIPT.format(heavy=json.dumps(heavy_modules))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    seconds = time.perf_counter() - start
+    report = json.loads(result.stderr.strip().splitlines()[-1])
+    return {"seconds": seconds, "import_seconds": report["seconds"], "loaded": report["loaded"]}
+
+
+@click.group(
+    help="Benchmarks that guard the performance of the CLI."
+)
+def bench():
+    """
+    Benchmarks that guard the performance of the CLI.
+    """
+    pass
+
+
+@bench.command(
+    help="Time the startup of the CLI and fail if it regressed."
+)
+@click.option(
+    "-n",
+    "--runs",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of runs per command, the median is reported",
+)
+@click.option(
+    "--max-ms",
+    type=click.FloatRange(min=0, min_open=True),
+    default=300.0,
+    show_default=True,
+    help="Fail if the median time to import the CLI and resolve a command exceeds this",
+)
+@click.argument("commands", nargs=-1)
+def startup(runs, max_ms, commands):
+    """
+    Time the startup of the CLI and fail if it regressed.
+
+    The group and every command are run with `--help` in a fresh interpreter. It fails
+    if the median time from importing the CLI to printing the help exceeds `--max-ms`,
+    or if a heavy dependency like Pillow or google.generativeai was imported on the way.
+    Listing the commands must not import any of the command modules at all.
+    """
+    from .main import COMMANDS
+
+    commands = list(commands) or sorted(set(COMMANDS) - {"bench"})
+    failed = False
+    for args in [[]] + [[command] for command in commands]:
+        if args:
+            modules = HEAVY_MODULES
+        else:
+            modules = GROUP_MODULES + [f"vbimagetotext.{module}" for module, _ in COMMANDS.values()]
+        samples = [measure_startup(args + ["--help"], modules) for _ in range(runs)]
+        median = statistics.median(sample["import_seconds"] for sample in samples) * 1000
+        total = statistics.median(sample["seconds"] for sample in samples) * 1000
+        loaded = sorted({name for sample in samples for name in sample["loaded"]})
+        label = " ".join(["vbimagetotext", *args, "--help"])
+        status = "ok"
+        if median > max_ms:
+            status = f"slower than {max_ms:.0f} ms"
+        if loaded:
+            status = f"imported {', '.join(loaded)}"
+        failed = failed or status != "ok"
+        click.echo(f"{label:<40} {median:7.1f} ms (process {total:6.1f} ms)  {status}")
+    if failed:
+        click.echo("Startup regressed.", err=True)
+        sys.exit(1)
+
+
+SCENARIO_SCRIPT = """
+import json, sys
+from vbimagetotext.bench import run_scenario
+run_scenario(json.loads(sys.argv[1]))
+"""
+
+
+def make_corpus(directory: str, pages: int, seed: int = 0) -> List[str]:
+    """
+    Draws synthetic question pages: lines of dark word-like blocks on white, with
+    larger gaps between questions, so they compress and crop like scans of print.
+
+    Returns:
+        List[str]: The paths `page_1.png` to `page_{pages}.png`, in a form `gptloop` reads.
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    width, height = PAGE_SIZE
+    paths = []
+    for page in range(1, pages + 1):
+        img = Image.new("L", PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(img)
+        y = 120
+        while y < height - 140:
+            if rng.random() < 0.12:
+                y += rng.randint(60, 140)
+                continue
+            x = 100
+            while x < width - 140:
+                word = rng.randint(20, 110)
+                draw.rectangle((x, y, min(x + word, width - 100), y + 18), fill=rng.randint(0, 90))
+                x += word + rng.randint(10, 18)
+            y += 34
+        path = os.path.join(directory, f"page_{page}.png")
+        img.save(path, "PNG")
+        paths.append(path)
+    return paths
+
+
+def make_texts(directory: str, count: int, seed: int = 0) -> List[str]:
+    """
+    Writes synthetic problems for the `solution` prompt, `problem_1.tex` onwards.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for index in range(1, count + 1):
+        lines = [
+            f"\\item A block of mass ${rng.randint(1, 9)}\\,\\mathrm{{kg}}$ moves at "
+            f"${rng.randint(2, 40)}\\,\\mathrm{{m/s}}$ on a rough surface. Find the work done by friction."
+            for _ in range(rng.randint(3, 8))
+        ]
+        path = os.path.join(directory, f"problem_{index}.tex")
+        with open(path, "w") as file:
+            file.write("\n".join(lines))
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb() -> float:
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_scenario(spec: dict) -> None:
+    """
+    Runs one throughput scenario in this process and writes its metrics, as JSON, to `spec["result"]`.
+
+    The mock server URL, API key and a private cache directory come from the
+    environment, so the telemetry log holds exactly this scenario's requests.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .client import configure_client
+    from .functions import process_images, process_text
+    from .prompts import switch_prompt
+    from .ratelimit import APIError
+    from .telemetry import get_telemetry
+    from .token_cost_calculations import CostLedger
+
+    scenario, concurrency = spec["scenario"], spec["concurrency"]
+    configure_client(pool_size=max(concurrency, 10))
+    ledger = CostLedger()
+
+    def send_image(path):
+        try:
+            process_images([path], switch_prompt("mcq"), BENCH_MODEL, "bench", 2000, copy=False, ledger=ledger)
+        except APIError:
+            pass
+
+    def send_text(path):
+        try:
+            process_text(path, switch_prompt("solution"), BENCH_MODEL, "bench", 2000, copy=False)
+        except APIError:
+            pass
+
+    start = time.perf_counter()
+    if scenario == "gptloop":
+        from .gptloop import gptloop
+
+        args = ["-i", spec["images"][0], "-r", "1", str(len(spec["images"])), "-p", "mcq",
+                "-m", BENCH_MODEL, "-c", str(concurrency), "--no-cache"]
+        try:
+            gptloop.main(args, standalone_mode=False)
+        except SystemExit:
+            # Exits 1 when pages failed, which the failures count shows.
+            pass
+    else:
+        send, items = (send_image, spec["images"]) if scenario == "process_images" else (send_text, spec["texts"])
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(send, items))
+    seconds = time.perf_counter() - start
+
+    records = get_telemetry().read()
+    succeeded = [r for r in records if r["status"] == "ok"]
+    latencies = sorted(r["phases"].get("total", 0) * 1000 for r in succeeded)
+    result = {
+        "requests": len(records),
+        "failed": len(records) - len(succeeded),
+        "seconds": seconds,
+        "requests_per_second": len(succeeded) / seconds,
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": latencies[max(0, int(len(latencies) * 0.99 + 0.5) - 1)] if latencies else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "bytes_sent": sum(r.get("bytes_sent", 0) for r in records),
+    }
+    with open(spec["result"], "w") as file:
+        json.dump(result, file)
+
+
+def package_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("vbimagetotext")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def read_history(path: str) -> List[dict]:
+    try:
+        with open(path, "r") as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Returns the metrics that regressed by more than `tolerance` (a fraction) against a baseline.
+    """
+    regressions = []
+    if metrics["requests_per_second"] < baseline["requests_per_second"] * (1 - tolerance):
+        regressions.append("requests/s")
+    for name in ("p99_ms", "peak_rss_mb", "bytes_sent"):
+        if metrics[name] > baseline[name] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def change(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+
+@bench.command(
+    help="Measure throughput against a local mock API and fail if it regressed."
+)
+@click.option(
+    "-s",
+    "--scenario",
+    "scenarios",
+    type=click.Choice(SCENARIOS),
+    multiple=True,
+    help="Scenario to run, can be repeated  [default: all]",
+)
+@click.option(
+    "--pages",
+    type=click.IntRange(min=1),
+    default=40,
+    show_default=True,
+    help="Number of synthetic pages (and problems) per scenario",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Requests in flight at the same time",
+)
+@click.option(
+    "--latency",
+    type=click.FloatRange(min=0),
+    default=0.2,
+    show_default=True,
+    help="Seconds the mock server takes to answer",
+)
+@click.option(
+    "--jitter",
+    type=click.FloatRange(min=0),
+    default=0.1,
+    show_default=True,
+    help="Up to this many extra seconds of latency, at random",
+)
+@click.option(
+    "--tokens-per-second",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    show_default=True,
+    help="Pace of the mock server's tokens, 0 for all at once",
+)
+@click.option(
+    "--error-rate",
+    type=click.FloatRange(0, 1),
+    default=0.0,
+    show_default=True,
+    help="Fraction of requests the mock server fails with a 500",
+)
+@click.option(
+    "--rpm",
+    type=click.FloatRange(min=1),
+    default=None,
+    help="Requests per minute before the mock server answers 429",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Seed for the corpus and the mock server",
+)
+@click.option(
+    "--history",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_HISTORY_PATH,
+    help="JSON Lines file the results are appended to and compared against.  [default: bench-history.jsonl in the cache directory]",
+)
+@click.option(
+    "--tolerance",
+    type=click.FloatRange(min=0),
+    default=0.2,
+    show_default=True,
+    help="Fraction a metric may get worse by before it counts as a regression",
+)
+@click.option(
+    "--save/--no-save",
+    default=True,
+    show_default=True,
+    help="Append the results to the history",
+)
+def throughput(scenarios, pages, concurrency, latency, jitter, tokens_per_second, error_rate, rpm, seed, history, tolerance, save):
+    """
+    Measure throughput against a local mock API and fail if it regressed.
+
+    A synthetic corpus of page images and problems is generated, and a mock
+    `/v1/chat/completions` server is started with the given latency, pacing,
+    errors and rate limit. Each scenario runs in a fresh interpreter with a private
+    cache directory, and reports requests per second, p50 and p99 latency from
+    its telemetry, peak RSS and the bytes sent.
+
+    Results are appended to `--history` with the package version. Each is compared
+    with the last earlier result of the same scenario and settings, and the command
+    fails if requests per second dropped, or p99 latency, peak RSS or bytes sent
+    grew, by more than `--tolerance`.
+    """
+    from .mockserver import MockConfig, make_server
+
+    scenarios = list(scenarios) or SCENARIOS
+    config = {
+        "pages": pages, "concurrency": concurrency, "latency": latency, "jitter": jitter,
+        "tokens_per_second": tokens_per_second, "error_rate": error_rate, "rpm": rpm, "seed": seed,
+    }
+    server = make_server(config=MockConfig(latency, jitter, tokens_per_second, error_rate, rpm, seed))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    directory = tempfile.mkdtemp(prefix="vbimagetotext-bench-")
+    past = read_history(history)
+    version = package_version()
+    crashed = regressed = False
+    try:
+        corpus = os.path.join(directory, "corpus")
+        os.makedirs(corpus)
+        images = make_corpus(corpus, pages, seed)
+        texts = make_texts(corpus, pages, seed)
+        click.echo(f"{pages} pages, concurrency {concurrency}, mock API at {base_url}")
+
+        for scenario in scenarios:
+            workdir = os.path.join(directory, scenario)
+            os.makedirs(workdir)
+            spec = {"scenario": scenario, "concurrency": concurrency, "images": images, "texts": texts,
+                    "result": os.path.join(workdir, "result.json")}
+            env = {**os.environ, "OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": base_url,
+                   "VBIMAGETOTEXT_CACHE_DIR": os.path.join(workdir, "cache"), "VBIMAGETOTEXT_TELEMETRY": "1"}
+            env.pop("VBIMAGETOTEXT_TELEMETRY_PATH", None)
+            result = subprocess.run(
+                [sys.executable, "-c", SCENARIO_SCRIPT, json.dumps(spec)],
+                cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0 or not os.path.exists(spec["result"]):
+                click.echo(f"{scenario:<15} crashed:\n{result.stderr[-2000:]}", err=True)
+                crashed = True
+                continue
+            with open(spec["result"], "r") as file:
+                metrics = json.load(file)
+
+            status = "no baseline"
+            baseline = next((r for r in reversed(past) if r["scenario"] == scenario and r["config"] == config), None)
+            if baseline is not None:
+                old = baseline["metrics"]
+                regressions = compare(metrics, old, tolerance)
+                status = (f"vs {baseline['version']}: {change(metrics['requests_per_second'], old['requests_per_second'])} req/s, "
+                          f"p99 {change(metrics['p99_ms'], old['p99_ms'])}, RSS {change(metrics['peak_rss_mb'], old['peak_rss_mb'])}")
+                if regressions:
+                    status += f"  regressed: {', '.join(regressions)}"
+                    regressed = True
+            click.echo(
+                f"{scenario:<15} {metrics['requests_per_second']:7.1f} req/s  p50 {metrics['p50_ms']:7.1f} ms  "
+                f"p99 {metrics['p99_ms']:7.1f} ms  peak RSS {metrics['peak_rss_mb']:6.1f} MB  "
+                f"sent {metrics['bytes_sent'] / 1e6:6.2f} MB  {metrics['failed']} failed  {status}")
+            if save:
+                os.makedirs(os.path.dirname(history) or ".", exist_ok=True)
+                with open(history, "a") as file:
+                    file.write(json.dumps({"time": time.time(), "version": version, "scenario": scenario,
+                                           "config": config, "metrics": metrics}) + "\n")
+        state = server.state
+        click.echo(f"Mock API: {state.requests} requests, {state.errors} errors, {state.rate_limited} rate limited")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory, ignore_errors=True)
+    if crashed or regressed:
+        click.echo("Throughput regressed." if regressed else "A scenario crashed.", err=True)
+        sys.exit(1)
@@ -0,0 +1,83 @@
+import click
+from datetime import datetime
+
+from rich.console import Console
+
+from .response_cache import ResponseCache, DEFAULT_CACHE_DIR
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+@click.group(
+    help="Inspect and prune the on-disk response cache."
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=DEFAULT_CACHE_DIR,
+    show_default=True,
+    help="Directory of the cache",
+)
+@click.pass_context
+def cache(ctx, cache_dir):
+    """
+    Inspect and prune the on-disk response cache.
+    """
+    ctx.obj = ResponseCache(cache_dir)
+
+
+@cache.command(
+    help="Show the number of entries and the size of the cache."
+)
+@click.pass_obj
+def stats(response_cache):
+    """
+    Show the number of entries and the size of the cache.
+    """
+    stats = response_cache.stats()
+    console = Console()
+    console.print(f"Directory: {stats['directory']}")
+    console.print(f"Entries: {stats['entries']}")
+    console.print(
+        f"Size: {format_size(stats['size'])} of {format_size(stats['max_size'])}")
+    if stats["entries"]:
+        console.print(
+            f"Least recently used: {datetime.fromtimestamp(stats['oldest']):%Y-%m-%d %H:%M}")
+        console.print(
+            f"Most recently used: {datetime.fromtimestamp(stats['newest']):%Y-%m-%d %H:%M}")
+
+
+@cache.command(
+    help="Evict least recently used entries until the cache fits the size limit."
+)
+@click.option(
+    "--max-size",
+    type=float,
+    default=None,
+    help="Size limit in MB. Defaults to the configured cache size.",
+)
+@click.option(
+    "--all",
+    "clear",
+    is_flag=True,
+    help="Remove every entry.",
+)
+@click.pass_obj
+def prune(response_cache, max_size, clear):
+    """
+    Evict least recently used entries until the cache fits the size limit.
+    """
+    if clear:
+        limit = 0
+    elif max_size is not None:
+        limit = int(max_size * 1024 * 1024)
+    else:
+        limit = None
+    removed = response_cache.prune(limit)
+    Console().print(f"Removed {removed} entries.", style="deep_pink3")
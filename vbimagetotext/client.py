@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .payload import StreamingBody
+from .ratelimit import get_executor
+from .telemetry import Trace
+
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+_settings = {
+    "base_url": os.getenv("OPENAI_BASE_URL", DEFAULT_BASE_URL),
+    "pool_size": int(os.getenv("VBIMAGETOTEXT_POOL_SIZE", "10")),
+    "connect_timeout": float(os.getenv("VBIMAGETOTEXT_CONNECT_TIMEOUT", "10")),
+    "read_timeout": float(os.getenv("VBIMAGETOTEXT_READ_TIMEOUT", "300")),
+}
+_session = None
+_lock = threading.Lock()
+# Seconds spent opening connections on this thread, see `connect_seconds`.
+_connect_time = threading.local()
+
+
+def _timed_connect(connect):
+    def timed(self):
+        start = time.perf_counter()
+        try:
+            connect(self)
+        finally:
+            _connect_time.seconds = getattr(_connect_time, "seconds", 0.0) + time.perf_counter() - start
+    return timed
+
+
+class TimedHTTPConnection(HTTPConnection):
+    connect = _timed_connect(HTTPConnection.connect)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    connect = _timed_connect(HTTPSConnection.connect)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def connect_seconds() -> float:
+    """
+    Returns the seconds the current thread has spent opening connections, TLS
+    handshakes included. Reused keep-alive connections cost nothing.
+    """
+    return getattr(_connect_time, "seconds", 0.0)
+
+
+def configure_client(base_url: str = None, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None) -> None:
+    """
+    Updates the settings of the shared HTTP client.
+
+    The pooled session is rebuilt lazily on the next request, so this can be called
+    at any point before the requests are made. Arguments left as None keep their value,
+    and the session, with its open connections, is kept if nothing changed.
+
+    Args:
+        base_url (str, optional): Base URL of the API, e.g. a local mock server.
+        pool_size (int, optional): Maximum number of keep-alive connections per host.
+        connect_timeout (float, optional): Seconds to wait for a connection.
+        read_timeout (float, optional): Seconds to wait for the response.
+    """
+    global _session
+    updates = {
+        "base_url": base_url,
+        "pool_size": pool_size,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout,
+    }
+    with _lock:
+        updates = {k: v for k, v in updates.items() if v is not None and v != _settings[k]}
+        if not updates:
+            return
+        _settings.update(updates)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the shared session, creating it on first use.
+
+    The session keeps connections alive between requests, so only the first request
+    to a host pays for the TCP and TLS handshake.
+
+    Returns:
+        requests.Session: The pooled session.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=_settings["pool_size"],
+                pool_maxsize=_settings["pool_size"],
+            )
+            # Connections are opened lazily on the requesting thread, where they are timed.
+            adapter.poolmanager.pool_classes_by_scheme = {
+                "http": TimedHTTPConnectionPool,
+                "https": TimedHTTPSConnectionPool,
+            }
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def api_url(path: str) -> str:
+    """
+    Joins a path like `/chat/completions` to the configured base URL.
+
+    Args:
+        path (str): The API path.
+
+    Returns:
+        str: The full URL.
+    """
+    return _settings["base_url"].rstrip("/") + "/" + path.lstrip("/")
+
+
+def api_request(method: str, path: str, api_key: str, **kwargs) -> requests.Response:
+    """
+    Sends a request to the API over the pooled session.
+
+    Args:
+        method (str): The HTTP method.
+        path (str): The API path, e.g. `/batches`.
+        api_key (str): OpenAI API key.
+        **kwargs: Passed on to `requests.Session.request`.
+
+    Returns:
+        requests.Response: The raw response.
+    """
+    headers = {"Authorization": f"Bearer {api_key}", **kwargs.pop("headers", {})}
+    kwargs.setdefault("timeout", (_settings["connect_timeout"], _settings["read_timeout"]))
+    return get_session().request(method, api_url(path), headers=headers, **kwargs)
+
+
+def post_chat_completion(payload: dict, api_key: str, stream: bool = False, tokens: float = 0, trace: Trace = None) -> requests.Response:
+    """
+    Sends a chat completion request over the pooled session.
+
+    The body is streamed, so images in the payload are encoded while they are sent.
+    Requests go through the shared rate limiter and are retried on 429 and 5xx errors.
+
+    Args:
+        payload (dict): The JSON payload of the request, which may contain `ImageData`.
+        api_key (str): OpenAI API key.
+        stream (bool, optional): Do not download the body up front, for server-sent events.
+        tokens (float, optional): Estimated tokens of the request, for the tokens per minute limit.
+        trace (Trace, optional): Collects the connect, encode and time to first byte
+            phases and the bytes sent, over all attempts.
+
+    Returns:
+        requests.Response: The raw response of the last attempt.
+    """
+    bodies = []
+
+    def send():
+        body = StreamingBody(payload)
+        bodies.append(body)
+        return api_request(
+            "POST",
+            "/chat/completions",
+            api_key,
+            headers={"Content-Type": "application/json"},
+            data=body,
+            stream=stream,
+        )
+
+    connect_start = connect_seconds()
+    response = get_executor().execute(send, tokens)
+    if trace is not None:
+        trace.add("connect", connect_seconds() - connect_start)
+        trace.add("encode", sum(body.encode_seconds for body in bodies))
+        trace.add("ttfb", response.elapsed.total_seconds())
+        trace.bytes_sent += sum(len(body) for body in bodies)
+    return response
+
+
+def received_bytes(response: requests.Response) -> int:
+    """
+    Returns the bytes of the response body read from the wire so far.
+    """
+    try:
+        return response.raw.tell()
+    except AttributeError:
+        return len(response.content)
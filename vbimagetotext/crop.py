@@ -0,0 +1,119 @@
+from array import array
+from typing import List, Tuple
+
+from .token_cost_calculations import image_tokens
+
+
+# Pixels darker than this (0-255, grayscale) count as content.
+INK_THRESHOLD = 220
+# Blank bands taller than this fraction of the page height separate two questions.
+QUESTION_GAP = 0.025
+# Margin kept around every box, in pixels.
+PADDING = 8
+
+Box = Tuple[int, int, int, int]
+
+
+def content_mask(img):
+    """
+    Returns a 1-bit mask of the pixels of an image that carry content.
+    """
+    return img.convert("L").point(lambda p: 255 if p < INK_THRESHOLD else 0, mode="1")
+
+
+def pad_box(box: Box, size: Tuple[int, int], padding: int = PADDING) -> Box:
+    left, top, right, bottom = box
+    width, height = size
+    return max(0, left - padding), max(0, top - padding), min(width, right + padding), min(height, bottom + padding)
+
+
+def content_bbox(img) -> Box:
+    """
+    Returns the box around everything on the page that is not background.
+
+    Args:
+        img (PIL.Image.Image): The page.
+
+    Returns:
+        Box: (left, top, right, bottom) with some padding, the whole image if it is blank.
+    """
+    box = content_mask(img).getbbox()
+    if box is None:
+        return 0, 0, img.width, img.height
+    return pad_box(box, img.size)
+
+
+def question_boxes(img, gap: float = QUESTION_GAP) -> List[Box]:
+    """
+    Splits a page into horizontal bands of content separated by tall blank gaps,
+    which on a question paper are usually the individual questions.
+
+    Args:
+        img (PIL.Image.Image): The page.
+        gap (float, optional): Minimum blank height between bands, as a fraction of the page height.
+
+    Returns:
+        List[Box]: The boxes from top to bottom, each trimmed to its content.
+    """
+    from PIL import Image
+
+    mask = content_mask(img)
+    # Averages every row down to one pixel: non-zero rows have content. Done in
+    # floating point, so a row with a single ink pixel does not round to zero.
+    rows = array("f", mask.convert("F").resize((1, mask.height), Image.Resampling.BOX).tobytes())
+    min_gap = max(1, int(gap * img.height))
+
+    bands = []
+    start = None
+    blank = 0
+    for y, value in enumerate(rows):
+        if value > 0:
+            if start is None:
+                start = y
+            blank = 0
+        elif start is not None:
+            blank += 1
+            if blank >= min_gap:
+                bands.append((start, y - blank + 1))
+                start = None
+                blank = 0
+    if start is not None:
+        bands.append((start, mask.height - blank))
+
+    boxes = []
+    for top, bottom in bands:
+        box = mask.crop((0, top, mask.width, bottom)).getbbox()
+        if box is not None:
+            left, band_top, right, band_bottom = box
+            boxes.append(pad_box((left, top + band_top, right, top + band_bottom), img.size))
+    return boxes
+
+
+def boxes_tokens(boxes: List[Box]) -> int:
+    return sum(image_tokens(right - left, bottom - top) for left, top, right, bottom in boxes)
+
+
+def choose_regions(img, mode: str) -> List[Box]:
+    """
+    Picks the regions of a page to upload, whichever costs the fewest image tokens.
+
+    With `trim`, the page is cut down to its content. With `questions`, the page is
+    also split into per-question crops, which are used when their tokens add up to
+    less than the trimmed page: each crop pays the 85 token base, but the tiles over
+    the whitespace between questions are saved. The crops go into one request, as
+    separate requests would each pay for the prompt again.
+
+    Args:
+        img (PIL.Image.Image): The page.
+        mode (str): `trim` or `questions`.
+
+    Returns:
+        List[Box]: The regions, from top to bottom.
+    """
+    page = [content_bbox(img)]
+    if mode != "questions":
+        return page
+    crops = question_boxes(img)
+    if len(crops) > 1 and boxes_tokens(crops) < boxes_tokens(page):
+        return crops
+    return page
@@ -0,0 +1,289 @@
+import io
+import json
+import os
+import socket
+import sys
+import time
+
+import click
+
+from .response_cache import DEFAULT_CACHE_DIR
+
+
+DEFAULT_SOCKET = os.path.join(DEFAULT_CACHE_DIR, "daemon.sock")
+
+# Environment variables the client passes on, so a command sees the caller's settings.
+FORWARDED_ENV_PREFIXES = ("VBIMAGETOTEXT_", "OPENAI_", "GOOGLE_")
+FORWARDED_ENV = ("COLUMNS", "TERM", "NO_COLOR", "FORCE_COLOR")
+# Settings read once when the modules are imported, so the daemon keeps the values
+# it started with whatever the client sends.
+IMPORT_TIME_ENV = (
+    "OPENAI_BASE_URL", "VBIMAGETOTEXT_POOL_SIZE", "VBIMAGETOTEXT_CONNECT_TIMEOUT", "VBIMAGETOTEXT_READ_TIMEOUT",
+    "VBIMAGETOTEXT_CACHE_DIR", "VBIMAGETOTEXT_CACHE_SIZE_MB", "VBIMAGETOTEXT_TELEMETRY", "VBIMAGETOTEXT_TELEMETRY_PATH",
+)
+
+# Commands that make no sense inside the daemon.
+LOCAL_COMMANDS = ("serve", "client", "mockserver")
+
+socket_option = click.option(
+    "-s",
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    envvar="VBIMAGETOTEXT_SOCKET",
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="Unix socket the daemon listens on",
+)
+
+
+def send_message(connection: socket.socket, message: dict) -> None:
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+class SocketWriter(io.TextIOBase):
+    """
+    Text stream that forwards everything written to it to the client, tagged with the
+    name of the stream (`stdout` or `stderr`).
+    """
+
+    def __init__(self, connection: socket.socket, name: str, isatty: bool = False):
+        self.connection = connection
+        self.name = name
+        self._isatty = isatty
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return self._isatty
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            # Tells click this is a text stream, not a binary one.
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        if text:
+            try:
+                send_message(self.connection, {"stream": self.name, "data": text})
+            except OSError:
+                # The client went away, the command still runs to completion.
+                pass
+        return len(text)
+
+
+def differing_settings(env: dict) -> list:
+    """
+    Returns the import-time settings the client's environment sets differently from the daemon's.
+    """
+    return [name for name in IMPORT_TIME_ENV if env.get(name) != os.environ.get(name)]
+
+
+def forwarded(name: str) -> bool:
+    return name.startswith(FORWARDED_ENV_PREFIXES) or name in FORWARDED_ENV
+
+
+def run_request(request: dict) -> int:
+    """
+    Runs one CLI invocation in this process, with the caller's working directory and
+    environment, and its output sent back over the connection.
+
+    Forwarded variables the client did not send, e.g. an API key the daemon was
+    started with, are unset while the command runs.
+
+    Requests whose environment changes a setting in `IMPORT_TIME_ENV` are refused,
+    as the daemon could not honour it.
+
+    Returns:
+        int: The exit code of the command.
+    """
+    from .main import main
+
+    argv = request["argv"]
+    if argv and argv[0] in LOCAL_COMMANDS:
+        print(f"Error: {argv[0]} cannot run inside the daemon.", file=sys.stderr)
+        return 2
+    differing = differing_settings(request["env"])
+    if differing:
+        print(f"Error: the daemon was started with other values of {', '.join(differing)}. "
+              "Restart `vbimagetotext serve` with this environment, or run the command without the client.",
+              file=sys.stderr)
+        return 2
+
+    saved_cwd = os.getcwd()
+    names = set(request["env"]) | {name for name in os.environ if forwarded(name)}
+    saved_env = {name: os.environ.get(name) for name in names}
+    try:
+        os.chdir(request["cwd"])
+        for name in names - set(request["env"]):
+            del os.environ[name]
+        os.environ.update(request["env"])
+        main.main(argv, prog_name="vbimagetotext", standalone_mode=False)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except click.exceptions.Abort:
+        print("Aborted!", file=sys.stderr)
+        return 1
+    except click.ClickException as e:
+        e.show()
+        return e.exit_code
+    finally:
+        os.chdir(saved_cwd)
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def handle_connection(connection: socket.socket) -> list:
+    """
+    Reads a request from a client, runs it and sends back its output and exit code.
+
+    Returns:
+        list: The argv of the request, for the log.
+    """
+    with connection, connection.makefile("rb") as reader:
+        line = reader.readline()
+        if not line:
+            return []
+        request = json.loads(line)
+        saved = sys.stdin, sys.stdout, sys.stderr
+        # Options left out on the command line would prompt, which the daemon cannot do.
+        sys.stdin = io.StringIO("")
+        sys.stdout = SocketWriter(connection, "stdout", request.get("isatty", False))
+        sys.stderr = SocketWriter(connection, "stderr", request.get("isatty", False))
+        try:
+            code = run_request(request)
+        except Exception as e:
+            print(f"Error: {type(e).__name__}: {e}", file=sys.stderr)
+            code = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved
+        try:
+            send_message(connection, {"exit": code})
+        except OSError:
+            pass
+        return request["argv"]
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """
+    Removes a socket file left behind by a daemon that died, refusing to touch a live one.
+    """
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise click.ClickException(f"A daemon is already listening on {socket_path}.")
+
+
+@click.command(
+    help="Keep a warm process that runs commands sent by `vbimagetotext client`."
+)
+@socket_option
+def serve(socket_path):
+    """
+    Keep a warm process that runs commands sent by `vbimagetotext client`.
+
+    The daemon imports every command once and keeps the pooled HTTP session, the
+    metadata caches and the rate limiter alive between requests, so a client call
+    only pays for the model round-trip. Requests are run one at a time, in the
+    working directory and environment of the client; a client that changes a
+    setting read at import time, like the cache directory, is refused. Results are
+    still copied to the clipboard, but not previewed with bat.
+    """
+    from rich.console import Console
+
+    from .functions import set_preview
+    from .main import COMMANDS, main
+
+    console = Console()
+    set_preview(False)
+    for name in COMMANDS:
+        if name not in LOCAL_COMMANDS:
+            main.get_command(None, name)
+
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+    remove_stale_socket(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        # The socket runs commands with the API keys of the client: owner only.
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    console.print(f"Listening on {socket_path}", style="deep_pink3")
+    try:
+        while True:
+            connection, _ = server.accept()
+            start = time.perf_counter()
+            argv = handle_connection(connection)
+            console.print(f"{' '.join(argv)} ({time.perf_counter() - start:.2f}s)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+@click.command(
+    help="Run a command through the `serve` daemon, e.g. `vbimagetotext client gptvision -i page.png`.",
+    context_settings=dict(ignore_unknown_options=True, allow_interspersed_args=False),
+)
+@socket_option
+@click.option(
+    "--fallback/--no-fallback",
+    default=True,
+    show_default=True,
+    help="Run the command in this process when no daemon is listening",
+)
+@click.argument("argv", nargs=-1, type=click.UNPROCESSED)
+def client(socket_path, fallback, argv):
+    """
+    Run a command through the `serve` daemon, e.g. `vbimagetotext client gptvision -i page.png`.
+
+    Only the standard library is imported, the daemon does the rest.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        connection.close()
+        if not fallback:
+            click.echo(f"Error: No daemon listening on {socket_path}, start one with `vbimagetotext serve`.", err=True)
+            sys.exit(1)
+        from .main import main
+
+        main.main(list(argv), prog_name="vbimagetotext")
+        return
+
+    env = {name: value for name, value in os.environ.items() if forwarded(name)}
+    isatty = sys.stdout.isatty()
+    if isatty:
+        env.setdefault("COLUMNS", str(os.get_terminal_size().columns))
+    with connection, connection.makefile("rb") as reader:
+        send_message(connection, {"argv": list(argv), "cwd": os.getcwd(), "env": env, "isatty": isatty})
+        code = 1
+        for line in reader:
+            message = json.loads(line)
+            if "exit" in message:
+                code = message["exit"]
+                break
+            stream = sys.stdout if message["stream"] == "stdout" else sys.stderr
+            stream.write(message["data"])
+            stream.flush()
+    sys.exit(code)
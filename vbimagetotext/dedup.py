@@ -0,0 +1,175 @@
+import json
+import os
+import sys
+import threading
+from typing import List, Optional
+
+from rich.console import Console
+
+from .response_cache import DEFAULT_CACHE_DIR
+
+
+DEFAULT_INDEX_PATH = os.path.join(DEFAULT_CACHE_DIR, "phash.json")
+# Size of the grayscale thumbnail the DCT is taken of, and of the low-frequency
+# block that is kept: 8 x 8 = 64 bits.
+HASH_SIZE = 8
+HIGHFREQ_FACTOR = 4
+
+
+def load_numpy():
+    """
+    Imports NumPy, which is only needed for deduplication.
+    """
+    try:
+        import numpy
+    except ImportError:
+        Console().print(
+            "Deduplication needs NumPy, install the `dedup` extra with `pip install 'vbimagetotext[dedup]'`.",
+            style="bold red", markup=False)
+        sys.exit(1)
+    return numpy
+
+
+def dct_matrix(n: int):
+    """
+    Returns the orthonormal DCT-II matrix of size n, so that `D @ x @ D.T` is the 2D DCT of x.
+    """
+    np = load_numpy()
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_dct = {}
+
+
+def perceptual_hash(image_path: str) -> int:
+    """
+    Computes the 64-bit DCT perceptual hash (pHash) of an image.
+
+    The image is reduced to a 32 x 32 grayscale thumbnail and transformed with a
+    2D DCT. Each bit of the hash tells whether one of the 64 lowest frequencies is
+    above their median, so noise, compression and small shifts barely change it.
+
+    Args:
+        image_path (str): The path to the image file.
+
+    Returns:
+        int: The hash. Similar images have hashes a small Hamming distance apart.
+    """
+    from PIL import Image
+
+    np = load_numpy()
+    size = HASH_SIZE * HIGHFREQ_FACTOR
+    if size not in _dct:
+        _dct[size] = dct_matrix(size)
+    matrix = _dct[size]
+
+    with Image.open(image_path) as img:
+        img.draft("L", (size, size))
+        pixels = np.asarray(img.convert("L").resize((size, size), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (matrix @ pixels @ matrix.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def popcount(values):
+    np = load_numpy()
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(*values.shape, -1).sum(axis=-1)
+
+
+class DedupIndex:
+    """
+    Index of the perceptual hashes of pages that already have a response in the cache.
+
+    Entries are grouped by request signature (prompt, model, max tokens and
+    preprocessing), so a near-duplicate page only reuses a response made with the
+    same settings. The hashes of a group are kept in a NumPy array and compared
+    all at once.
+    """
+
+    def __init__(self, max_distance: int, path: str = DEFAULT_INDEX_PATH):
+        self.np = load_numpy()
+        self.max_distance = max_distance
+        self.path = path
+        self.groups = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.checked = 0
+        # Image path: the name of the image whose response it reused.
+        self.hits = {}
+        try:
+            with open(path, "r") as file:
+                entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = {}
+        for signature, rows in entries.items():
+            for hashes, key, name in rows:
+                self._append(signature, [int(h, 16) for h in hashes], key, name)
+
+    def _append(self, signature: str, hashes: List[int], key: str, name: str) -> None:
+        group = self.groups.setdefault((signature, len(hashes)), {"hashes": [], "keys": [], "names": [], "array": None})
+        group["hashes"].append(hashes)
+        group["keys"].append(key)
+        group["names"].append(name)
+        group["array"] = None
+
+    def find(self, signature: str, hashes: List[int]) -> Optional[tuple]:
+        """
+        Returns the (cache key, image name) of the closest indexed request whose images
+        are all within `max_distance` bits of `hashes`, or None.
+        """
+        np = self.np
+        with self.lock:
+            self.checked += 1
+            group = self.groups.get((signature, len(hashes)))
+            if group is None:
+                return None
+            if group["array"] is None:
+                group["array"] = np.array(group["hashes"], dtype=np.uint64)
+            array, keys, names = group["array"], group["keys"], group["names"]
+        distances = popcount(array ^ np.array(hashes, dtype=np.uint64)).max(axis=1)
+        best = int(distances.argmin())
+        if distances[best] > self.max_distance:
+            return None
+        return keys[best], names[best]
+
+    def add(self, signature: str, hashes: List[int], key: str, name: str) -> None:
+        with self.lock:
+            self._append(signature, hashes, key, name)
+            self.dirty = True
+
+    def record_hit(self, image_path: str, original: str) -> None:
+        with self.lock:
+            self.hits[image_path] = original
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        entries = {}
+        for (signature, _), group in self.groups.items():
+            rows = entries.setdefault(signature, [])
+            for hashes, key, name in zip(group["hashes"], group["keys"], group["names"]):
+                rows.append([[f"{h:016x}" for h in hashes], key, name])
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def print_report(self) -> None:
+        """
+        Prints how many requests were answered from a near-duplicate page.
+        """
+        saved = len(self.hits)
+        console = Console()
+        console.print(
+            f"Deduplication: {saved} of {self.checked} requests reused the response of a near-duplicate, "
+            f"{saved} API calls saved.", style="deep_pink3")
+        for image_path, original in sorted(self.hits.items()):
+            print(f"  {os.path.basename(image_path)} ~ {original}")
@@ -1,13 +1,43 @@
 
 import re
-import requests
 from rich.console import Console
 import pyperclip
-from typing import List
+from typing import Callable, Iterator, List, Tuple, Union
 import base64
 import subprocess
 import os
-from .token_cost_calculations import calculate_image_cost, calculate_input_cost, calculate_output_cost
+import tempfile
+import time
+from contextlib import contextmanager
+from .backends import Backend, GenerateOptions, Generation, backend_name, make_backend, text_parts
+from .response_cache import ResponseCache, cache_key
+from .dedup import DedupIndex, perceptual_hash
+from .preprocess import Preprocessing
+from .ratelimit import APIError
+from .telemetry import Trace, get_telemetry, prompt_key
+from .token_cost_calculations import CostLedger, cache_savings, calculate_image_cost, calculate_input_cost, calculate_output_cost, count_text_tokens, count_total_image_tokens, model_pricing, tokens_cost
+
+
+# Whether copied results are previewed with bat, see `set_preview`.
+_preview = True
+
+
+def set_preview(enabled: bool) -> None:
+    """
+    Turns the bat preview of copied results on or off. The `serve` daemon turns it
+    off, as its terminal is not the caller's.
+    """
+    global _preview
+    _preview = enabled
+
+
+def preview(title: str) -> None:
+    """
+    Shows the clipboard with bat, highlighted as LaTeX.
+    """
+    if _preview:
+        subprocess.Popen(
+            f'pbpaste | bat -l latex --file-name "{title}"', shell=True)
 
 
 def encode_image(image_path):
@@ -24,170 +54,309 @@ def encode_image(image_path):
         return base64.b64encode(image_file.read()).decode('utf-8')
 
 
-def create_image_dicts(image_names: List[str]) -> List[dict]:
+def usage_tokens(model: str, usage: dict, image_names: List[str], input_text: str, message: str) -> Tuple[int, int, bool]:
     """
-    Encodes images to base64 and creates a list of dictionaries with image data.
+    Returns the input and output tokens of a request, and whether they are exact.
 
-    Args:
-        image_names (List[str]): List of image file names.
+    The counts of the `usage` block are used when the API returned one, otherwise
+    the tokens are estimated from the images and the text.
+    """
+    if usage:
+        return usage["prompt_tokens"], usage["completion_tokens"], True
+    return (count_total_image_tokens(image_names) + count_text_tokens(input_text, model),
+            count_text_tokens(message, model), False)
 
-    Returns:
-        List[dict]: List of dictionaries containing base64 encoded image data.
+
+def cached_tokens(usage: dict) -> int:
+    """
+    Returns the prompt tokens of a request that were read from the provider's prompt cache.
     """
-    image_dicts = []
-    for image_name in image_names:
-        base64_image = encode_image(image_name)
-        image_dict = {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/png;base64,{base64_image}"
-            }
-        }
-        image_dicts.append(image_dict)
-    return image_dicts
+    return (usage or {}).get("cached_tokens") or 0
 
 
-def process_images(image_names: List[str], prompt: str, model: str, api_key: str, max_tokens: int) -> str:
+def report_cost(model: str, usage: dict, image_names: List[str], input_text: str, message: str, ledger: CostLedger = None) -> None:
     """
-    Processes images using OpenAI's GPT-4 Vision, extracts LaTeX code from the response,
-    copies the first match to the clipboard, and prints the message in deep pink color.
+    Prints the cost of a request, or adds it to the ledger of the run.
 
-    Args:
-        image_names (List[str]): List of image file names.
-        prompt (str): Prompt for the GPT-4 Vision model.
-        api_key (str): OpenAI API key.
+    The exact token counts of the `usage` block are used when the API returned one,
+    otherwise the tokens are estimated from the images and the text. Cached prompt
+    tokens are charged at the model's cached input price.
 
-    Returns:
-        str: First match of the LaTeX code in the response.
+    Args:
+        model (str): The model name.
+        usage (dict): The `usage` block of the response, or None.
+        image_names (List[str]): The images sent with the request.
+        input_text (str): The text sent with the request.
+        message (str): The response text.
+        ledger (CostLedger, optional): Collects the usage instead of printing it.
     """
-    image_dicts = create_image_dicts(image_names)
-    title = os.path.basename(image_names[0]).split('.')[0] + ".tex"
+    if ledger is not None:
+        ledger.add(model, *usage_tokens(model, usage, image_names, input_text, message), cached_tokens=cached_tokens(usage))
+        return
+
+    if usage:
+        cost = calculate_input_cost(input_text, model, tokens=usage["prompt_tokens"]) + \
+            calculate_output_cost(message, model, tokens=usage["completion_tokens"])
+        if cached_tokens(usage):
+            savings = cache_savings(model, cached_tokens(usage))
+            print(f"Cached input tokens: {cached_tokens(usage)}, saving ₹{savings:.2f}")
+            cost -= savings
+    else:
+        cost = calculate_input_cost(input_text, model) + calculate_output_cost(message, model)
+        if image_names:
+            cost += calculate_image_cost(image_names, model)
+    print(f'\n\tTotal cost: {cost:.2f}\n')
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
 
-    payload = {
-        "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    *image_dicts
-                ]
-            }
-        ],
-        "max_tokens": max_tokens
-    }
+def extract_latex(message: str) -> str:
+    """
+    Returns the first ```latex block of the message, or the whole message if there is none.
+    """
+    pattern = r"```latex(.*?)```"
+    matches = re.findall(pattern, message, re.DOTALL)
+    return matches[0] if matches else message
 
-    message = ""
 
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+def write_atomic(path: str, text: str) -> None:
+    """
+    Writes text to a file through a temporary file, so readers never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as file:
+        file.write(text)
+    os.replace(file.name, path)
 
-    if response.status_code == 200:
-        response_json = response.json()
 
-        if 'choices' in response_json and 'message' in response_json["choices"][0]:
-            message = response_json["choices"][0]["message"]["content"]
+@contextmanager
+def stream_to(output_path: str) -> Iterator[Callable[[str], None]]:
+    """
+    Yields a callback that prints streamed text as it arrives and appends it to a file.
+    """
+    console = Console()
+    with open(output_path, "w") as output:
+        def on_text(text: str) -> None:
+            output.write(text)
+            output.flush()
+            console.print(text, end="", style="deep_pink3",
+                          markup=False, highlight=False)
 
-            print(f'\n\tTotal cost: {calculate_image_cost(
-                image_names) + calculate_input_cost(prompt) + calculate_output_cost(message):.2f}\n')
+        yield on_text
+    console.print()
 
-        else:
-            console = Console()
-            console.print(
-                "Error: 'choices' or 'message' not found in the API response.", style="bold red")
-            return "Error: 'choices' or 'message' not found in the API response."
-    else:
-        console = Console()
-        console.print(
-            f"Error: API request failed with status code {response.status_code}.", style="bold red")
-        return f"Error: API request failed with status code {response.status_code}."
 
-    pattern = r"```latex(.*?)```"
-    matches = re.findall(pattern, message, re.DOTALL)
+def generate(backend: Backend, images: List[str], prompt, options: GenerateOptions, output_path: str = None) -> Generation:
+    """
+    Runs a generation, streaming it to `output_path` when `options.stream` is set.
+    """
+    if not options.stream:
+        return backend.generate_sync(images, prompt, options)
+    with stream_to(output_path) as on_text:
+        options.on_text = on_text
+        generation = backend.generate_sync(images, prompt, options)
+    if generation.timings.get("first_token") is not None:
+        Console().print(
+            f"First chunk: {generation.timings['first_token']:.2f}s, total: {generation.timings['total']:.2f}s", style="dim")
+    return generation
+
+
+def log_request(start: float, model: str, prompt: Union[str, List[str]], image_names: List[str], input_text: str, cache: str,
+                trace: Trace, generation: Generation = None, error: Exception = None) -> None:
+    """
+    Writes the telemetry record of a request.
 
-    if matches:
-        pyperclip.copy(matches[0])
-        subprocess.Popen(
-            f'pbpaste | bat -l latex --file-name "{title}"', shell=True)
-        return matches[0]
-    else:
-        pyperclip.copy(message)
-        subprocess.Popen(
-            f'pbpaste | bat -l latex --file-name "{title}"', shell=True)
-        return message
+    Args:
+        start (float): Unix time the request started at.
+        model (str): The model asked for.
+        prompt (Union[str, List[str]]): The prompt, recorded by the name of its template.
+        image_names (List[str]): The images sent with the request.
+        input_text (str): All text sent with the request, for estimating tokens.
+        cache (str): `hit`, `dedup`, `miss` or `off`.
+        trace (Trace): The phase timings and sizes.
+        generation (Generation, optional): The response, None for cache hits and errors.
+        error (Exception, optional): Why the request failed.
+    """
+    record = {
+        "time": start,
+        "model": model,
+        "prompt": prompt_key(text_parts(prompt)[0]),
+        "images": len(image_names),
+        "cache": cache,
+        "status": "error" if error is not None else "ok",
+        "phases": {name: round(seconds, 4) for name, seconds in trace.phases.items()},
+        "bytes_sent": trace.bytes_sent,
+        "bytes_received": trace.bytes_received,
+    }
+    if error is not None:
+        record["error"] = str(error)
+    if generation is not None:
+        answered_by = generation.model or model
+        input_tokens, output_tokens, exact = usage_tokens(answered_by, generation.usage, image_names, input_text, generation.text)
+        input_price, output_price = model_pricing(answered_by)
+        savings = cache_savings(answered_by, cached_tokens(generation.usage))
+        record.update({
+            "model": answered_by,
+            "backend": backend_name(answered_by),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens(generation.usage),
+            "tokens_exact": exact,
+            "cost": round(tokens_cost(input_tokens, input_price) + tokens_cost(output_tokens, output_price) - savings, 6),
+            "cache_savings": round(savings, 6),
+        })
+    get_telemetry().write(record)
+
+
+def process_images(image_names: List[str], prompt: Union[str, List[str]], model: str, api_key: str, max_tokens: int, copy: bool = True, cache: ResponseCache = None, refresh: bool = False, preprocessing: Preprocessing = None, stream: bool = False, output: str = None, ledger: CostLedger = None, dedup: DedupIndex = None, backend: Backend = None, pages: List[int] = None) -> str:
+    """
+    Processes images using a vision model, extracts LaTeX code from the response,
+    copies the first match to the clipboard, and prints the message in deep pink color.
 
+    Args:
+        image_names (List[str]): List of image file names.
+        prompt (Union[str, List[str]]): Prompt for the vision model, or the prompt followed
+            by text that varies per request, see `backends.image_payload`.
+        model (str): The model name, which also picks the backend unless one is given.
+        api_key (str): API key of the provider.
+        copy (bool, optional): Copy the result to the clipboard and preview it with bat.
+            Disable when several requests are in flight, since the clipboard is shared.
+        cache (ResponseCache, optional): Cache to look the response up in and store it to.
+        refresh (bool, optional): Skip the cache lookup but still store the new response.
+        preprocessing (Preprocessing, optional): Downscale and re-encode the images before upload.
+        stream (bool, optional): Print the response and write it to the output file as it arrives.
+            Once complete, the file is overwritten with the extracted LaTeX code.
+        output (str, optional): File to stream to. Defaults to the image name with a .tex extension.
+        ledger (CostLedger, optional): Collects the cost of the run instead of printing it per call.
+        dedup (DedupIndex, optional): Reuse the cached response of a near-identical page. Needs `cache`.
+        backend (Backend, optional): The provider to send the request to. Defaults to
+            the one serving `model`.
+        pages (List[int], optional): Page numbers of the images of a packed request.
+
+    Returns:
+        str: First match of the LaTeX code in the response.
 
-def process_text(input_file: str, prompt: str, model: str, api_key: str, max_tokens: int) -> str:
+    Raises:
+        APIError: If the request failed after all retries.
+    """
+    title = os.path.basename(image_names[0]).split('.')[0] + ".tex"
+    start = time.time()
+    trace = Trace()
+    status = "off" if cache is None else "miss"
+    generation = None
+
+    message = None
+    if cache is not None:
+        with trace.phase("cache"):
+            key = cache_key(image_names, prompt, model, max_tokens, preprocessing)
+            if not refresh:
+                message = cache.get(key)
+        if message is not None:
+            status = "hit"
+            Console().print(f"Cache hit for {title}", style="deep_pink3")
+
+    if message is None and cache is not None and dedup is not None:
+        signature = cache_key([], prompt, model, max_tokens, preprocessing)
+        hashes = [perceptual_hash(image_name) for image_name in image_names]
+        match = None if refresh else dedup.find(signature, hashes)
+        if match is not None:
+            # The response may have been evicted from the cache since.
+            message = cache.get(match[0])
+            if message is not None:
+                status = "dedup"
+                dedup.record_hit(image_names[0], match[1])
+                Console().print(f"{title} is a near-duplicate of {match[1]}, reusing its response", style="deep_pink3")
+
+    if message is None:
+        backend = backend or make_backend(model, api_key)
+        options = GenerateOptions(model, max_tokens, preprocessing, stream, trace=trace, pages=pages)
+        try:
+            generation = generate(backend, image_names, prompt, options, output or title)
+        except APIError as e:
+            log_request(start, model, prompt, image_names, "".join(text_parts(prompt)), status, trace, error=e)
+            raise
+        trace.add("first_token", generation.timings.get("first_token"))
+        trace.add("total", generation.timings.get("total"))
+        message, usage = generation.text, generation.usage
+
+        report_cost(generation.model or model, usage, image_names, "".join(text_parts(prompt)), message, ledger)
+
+        # A hedge answered by another model is not cached as the model asked for.
+        if cache is not None and (generation.model or model) == model:
+            cache.put(key, message, model=model, max_tokens=max_tokens)
+            if dedup is not None:
+                dedup.add(signature, hashes, key, os.path.basename(image_names[0]))
+
+    with trace.phase("postprocess"):
+        result = extract_latex(message)
+
+        if stream:
+            with open(output or title, "w") as file:
+                file.write(result)
+    log_request(start, model, prompt, image_names, "".join(text_parts(prompt)), status, trace, generation)
+
+    if stream and generation is None:
+        # A cached response was not streamed, so it is printed here instead.
+        Console().print(result, style="deep_pink3", markup=False, highlight=False)
+
+    if copy:
+        pyperclip.copy(result)
+        # A streamed or cached response has already been printed.
+        if not stream:
+            preview(title)
+
+    return result
+
+
+def process_text(input_file: str, prompt: str, model: str, api_key: str, max_tokens: int, stream: bool = False, output: str = None, backend: Backend = None, copy: bool = True) -> str:
     """
-    Processes text using OpenAI's GPT-4, extracts LaTeX code from the response,
+    Processes text using a language model, extracts LaTeX code from the response,
     copies the first match to the clipboard, and prints the message in deep pink color.
 
     Args:
         input_file (str): Path to the input file to be processed.
-        prompt (str): Prompt for the GPT-4 model.
-        api_key (str): OpenAI API key.
+        prompt (str): Prompt for the model.
+        model (str): The model name, which also picks the backend unless one is given.
+        api_key (str): API key of the provider.
         max_tokens (int): Maximum number of tokens to generate.
+        stream (bool, optional): Print the response and write it to the output file as it arrives.
+        output (str, optional): File to stream to. Defaults to the input name with a _solution.tex suffix.
+        backend (Backend, optional): The provider to send the request to.
+        copy (bool, optional): Copy the result to the clipboard and preview it with bat.
 
     Returns:
         str: First match of the LaTeX code in the response.
+
+    Raises:
+        APIError: If the request failed after all retries.
     """
     with open(input_file, 'r') as file:
         input_text = file.read()
 
     title = os.path.basename(input_file).split('.')[0] + ".tex"
 
-    # calculate_input_cost(input_text)
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-
-    payload = {
-        "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "text",
-                        "text": input_text
-                    }
-                ]
-            }
-        ],
-        "max_tokens": max_tokens
-    }
-
-    message = ""
-
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-
-    if response.status_code == 200:
-        response_json = response.json()
-
-        if 'choices' in response_json and 'message' in response_json["choices"][0]:
-            message = response_json["choices"][0]["message"]["content"]
-
-            # calculate_output_cost(message)
-            print(f'\n\tTotal cost: {calculate_input_cost(
-                input_text) + calculate_output_cost(message):.2f}\n')
+    backend = backend or make_backend(model, api_key)
+    start = time.time()
+    trace = Trace()
+    options = GenerateOptions(model, max_tokens, stream=stream, trace=trace)
+    default_output = os.path.basename(input_file).split('.')[0] + "_solution.tex"
+    try:
+        generation = generate(backend, [], [prompt, input_text], options, output or default_output)
+    except APIError as e:
+        log_request(start, model, prompt, [], prompt + input_text, "off", trace, error=e)
+        raise
+    trace.add("first_token", generation.timings.get("first_token"))
+    trace.add("total", generation.timings.get("total"))
+    log_request(start, model, prompt, [], prompt + input_text, "off", trace, generation)
+    message = generation.text
+    report_cost(generation.model or model, generation.usage, [], prompt + input_text, message)
+
+    if not copy:
+        return message
 
+    if stream:
         pyperclip.copy(message)
-        subprocess.Popen(
-            f'pbpaste | bat -l latex --file-name "{title}"', shell=True)
-
         return message
+
+    pyperclip.copy(message)
+    preview(title)
+
+    return message
@@ -0,0 +1,72 @@
+import os
+import time
+from typing import Iterator, List
+
+from .backends import supports_system_instruction
+
+
+class StubChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubUsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+        self.cached_content_token_count = 0
+
+
+class StubResponse:
+    """
+    Mimics a `GenerateContentResponse`: iterate it for the chunks of a streamed
+    response, or read `text` for the whole of it.
+    """
+
+    def __init__(self, chunks: List[str], delay: float, usage_metadata: StubUsageMetadata):
+        self.chunks = chunks
+        self.delay = delay
+        self.usage_metadata = usage_metadata
+
+    def __iter__(self) -> Iterator[StubChunk]:
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield StubChunk(chunk)
+
+    @property
+    def text(self) -> str:
+        time.sleep(self.delay * len(self.chunks))
+        return "".join(self.chunks)
+
+
+class StubGenerativeModel:
+    """
+    Offline stand-in for `genai.GenerativeModel`.
+
+    `generate_content` answers with a short LaTeX answer describing the request, one
+    word per chunk, waiting `VBIMAGETOTEXT_STUB_DELAY` seconds (default 0.05)
+    between chunks. Use it with `geminivision --transport stub`.
+    """
+
+    def __init__(self, model_name: str, delay: float = None, system_instruction: str = None):
+        if system_instruction and not supports_system_instruction(model_name):
+            # Like the API, which answers 400 for models without system instructions.
+            raise ValueError(f"400 Developer instruction is not enabled for models/{model_name}")
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        if delay is None:
+            delay = float(os.getenv("VBIMAGETOTEXT_STUB_DELAY", "0.05"))
+        self.delay = delay
+
+    def generate_content(self, contents: List, stream: bool = False, generation_config: dict = None) -> StubResponse:
+        texts = [part for part in contents if isinstance(part, str)]
+        images = len(contents) - len(texts)
+        if self.system_instruction:
+            texts.append(self.system_instruction)
+        text = f"```latex\n\\item Stub response from {self.model_name} for {images} image(s).\n```"
+        words = text.split(" ")
+        chunks = [word + " " for word in words[:-1]] + [words[-1]]
+        # Gemini counts 258 tokens per image and about 4 characters per text token.
+        usage = StubUsageMetadata(258 * images + sum(len(t) for t in texts) // 4, len(words))
+        return StubResponse(chunks, self.delay, usage)
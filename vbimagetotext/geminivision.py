@@ -1,12 +1,13 @@
-import PIL.Image
-import os
-import google.generativeai as genai
 import click
+import os
 import sys
 from rich.console import Console
+from .backends import GeminiBackend, require_api_key
+from .functions import process_images
+from .ratelimit import APIError
+from .response_cache import ResponseCache
 from .prompts import switch_prompt
 from .choice_option import ChoiceOption
-import pyperclip
 
 
 @click.command(
@@ -42,13 +43,63 @@ import pyperclip
     show_default=True,
     help="Prompt to use for the completion",
 )
-def geminivision(image, prompt):
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="File to write the response to as it arrives. Defaults to the first image name with a .tex extension.",
+)
+@click.option(
+    "-m",
+    "--model",
+    type=click.Choice(["gemini-pro-vision", "gemini-1.5-flash", "gemini-1.5-pro"], case_sensitive=False),
+    default="gemini-pro-vision",
+    show_default=True,
+    help="Gemini model to use",
+)
+@click.option(
+    "--max-tokens",
+    type=int,
+    default=2000,
+    show_default=True,
+    help="The maximum number of tokens to generate.",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or write the response cache.",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ignore cached responses and overwrite them with fresh ones.",
+)
+@click.option(
+    "--transport",
+    type=click.Choice(["grpc", "rest", "stub"], case_sensitive=False),
+    default="grpc",
+    show_default=True,
+    help="Transport to reach the API with. 'stub' answers offline without an API key.",
+)
+def geminivision(image, prompt, output, model, max_tokens, no_cache, refresh, transport):
     """
-    Generates text content based on an image and a prompt using the Gemini Pro Vision model.
+    Generates text content based on an image and a prompt using a Gemini vision model.
+
+    The response is streamed: chunks are printed and written to the output file as
+    they arrive, and the latency of the first chunk and of the whole response is reported.
+    The request goes through the same backend path as `gptvision`, with its response
+    cache, rate limiting, retries and cost tracking.
 
     Args:
         image (list): A list of image file paths.
         prompt (str): The prompt to be used for generating the text content.
+        output (str): The file to write the response to.
+        model (str): The Gemini model.
+        max_tokens (int): The maximum number of tokens to generate.
+        no_cache (bool): Do not use the response cache.
+        refresh (bool): Ignore cached responses.
+        transport (str): The transport to use, or 'stub' for an offline model.
 
     Returns:
         None
@@ -57,48 +108,22 @@ def geminivision(image, prompt):
         SystemExit: If the GOOGLE_API_KEY environment variable is not set.
 
     """
-    GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-    genai.configure(api_key=GOOGLE_API_KEY)
-    if GOOGLE_API_KEY is None:
-        console = Console()
-        console.print(
-            "Google_api_key error.", style="bold red")
-        sys.exit(1)
+    api_key = None if transport == "stub" else require_api_key(model)
 
     if prompt == "prompt":
         prompt = click.prompt("Please enter your custom prompt", type=str)
 
     prompt = switch_prompt(prompt)
-
-    model = genai.GenerativeModel('gemini-pro-vision')
+    # Stub answers must not end up in the cache under a real model name.
+    cache = None if no_cache or transport == "stub" else ResponseCache()
+    if output is None:
+        output = os.path.basename(image[0]).split('.')[0] + ".tex"
 
     try:
-        images = [PIL.Image.open(image_name) for image_name in image]
-    except FileNotFoundError as e:
+        process_images(list(image), prompt, model, api_key, max_tokens,
+                       cache=cache, refresh=refresh, stream=True, output=output,
+                       backend=GeminiBackend(api_key, transport))
+    except APIError as e:
         console = Console()
-        console.print(
-            f"Error: Image file not found: {str(e)}", style="bold red")
-        return
-
-    try:
-        response = model.generate_content(
-            [prompt, *images], stream=True)
-        response.resolve()
-    except Exception as e:
-        console = Console()
-        console.print(
-            f"Error: Failed to generate content: {str(e)}", style="bold red")
-        return
-
-    try:
-        if hasattr(response, 'text'):
-            pyperclip.copy(response.text)
-            Console().print(response.text, style="deep_pink3")
-        else:
-            console = Console()
-            console.print(
-                "Error: 'text' not found in the response.", style="bold red")
-    except Exception as e:
-        console = Console()
-        console.print(
-            f"An error occurred while copying the text to clipboard: {str(e)}", style="bold red")
+        console.print(f"Error: Failed to generate content: {e}", style="bold red")
+        sys.exit(1)
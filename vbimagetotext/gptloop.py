@@ -1,11 +1,63 @@
 import click
 import os
-import subprocess
+import sys
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
 
-from .gptvision import gptvision
+from rich.console import Console
+
+from .functions import process_images, write_atomic
+from .backends import require_api_key
+from .client import configure_client
+from .ratelimit import APIError, configure_limits, rate_limit_options
+from .prompts import switch_prompt
+from .response_cache import ResponseCache
+from .dedup import DedupIndex
+from .hedge import hedging_options, make_hedged_backend
+from .journal import RunJournal, run_key
+from .packing import DEFAULT_PACK_TOKENS, pack_pages, packed_max_tokens, packing_prompt, split_pages
+from .token_cost_calculations import CostLedger
+from .preprocess import make_preprocessing, preprocessing_options
+from .pdf import DEFAULT_PREFETCH, PdfPages, is_pdf, pdf_page_count
 from .choice_option import ChoiceOption
 
 
+def page_image_path(image: str, page: int) -> str:
+    """
+    Builds the path of a page image from a sample path like `name_1.png`.
+
+    Args:
+        image (str): Path to any page image of the book.
+        page (int): The page number.
+
+    Returns:
+        str: Path to the image of the given page.
+    """
+    dirname = os.path.dirname(image)
+    filename = os.path.basename(image)
+    extension = os.path.splitext(filename)[1]
+    basename = filename.split('_')[0]
+    return os.path.join(dirname, f"{basename}_{page}{extension}")
+
+
+def bounded_map(executor: Executor, fn: Callable, items: Iterable, limit: int) -> Iterator:
+    """
+    Like `executor.map`, but pulls items lazily and keeps at most `limit` calls in flight.
+
+    Results are yielded in the order of the items. Unlike `executor.map`, which
+    submits everything up front, a generator of items is only advanced as calls
+    complete, so a slow producer (like PDF rendering) runs just ahead of the workers.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
 @click.command(
     help="Process images using OpenAI's GPT-4 Vision model and extract the response."
 )
@@ -14,16 +66,15 @@ from .choice_option import ChoiceOption
     "--image",
     type=click.Path(exists=True),
     required=True,
-    help="Path to the image file",
+    help="Path to the image file, or to a PDF",
 )
 @click.option(
     '-r',
     '--ranges',
     nargs=2,
-    default=([1, 1]),
+    default=None,
     type=click.Tuple([int, int]),
-    show_default=True,
-    help="Range of pages to extract text from",
+    help="Range of pages to extract text from  [default: 1 1, or every page of a PDF]",
 )
 @click.option(
     "-p",
@@ -61,6 +112,9 @@ from .choice_option import ChoiceOption
             "gpt-4-turbo",
             "gpt-4-turbo-preview",
             "gpt-4-vision-preview",
+            "gemini-1.5-flash",
+            "gemini-1.5-pro",
+            "mock",
         ],
         case_sensitive=False),
     prompt=True,
@@ -68,17 +122,225 @@ from .choice_option import ChoiceOption
     show_default=True,
     help="Prompt to use for the completion",
 )
-@click.pass_context
-def gptloop(ctx, image, ranges, prompt, model):
+@click.option(
+    "-c",
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of pages to send to the API at the same time",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or write the response cache.",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ignore cached responses and overwrite them with fresh ones.",
+)
+@click.option(
+    "--prefetch",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PREFETCH,
+    show_default=True,
+    help="Number of PDF pages rendered ahead of the API calls",
+)
+@click.option(
+    "--dpi",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Resolution to render PDF pages at. By default, the resolution the model works at.",
+)
+@click.option(
+    "--dedup",
+    type=click.IntRange(0, 64),
+    default=None,
+    help="Reuse the cached response of a page whose perceptual hash is within this many bits (0-64, e.g. 6).",
+)
+@click.option(
+    "--skip-duplicates",
+    is_flag=True,
+    help="With --dedup, do not write pages that are near-duplicates of an earlier page.",
+)
+@click.option(
+    "--pack",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Send up to this many consecutive pages per request, so the prompt is paid for once per pack",
+)
+@click.option(
+    "--pack-tokens",
+    type=click.IntRange(min=1),
+    default=DEFAULT_PACK_TOKENS,
+    show_default=True,
+    help="Maximum image tokens of a packed request",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip the pages an interrupted run with the same settings already finished.",
+)
+@rate_limit_options
+@hedging_options
+@preprocessing_options
+def gptloop(image, ranges, prompt, model, concurrency, no_cache, refresh, prefetch, dpi, dedup, skip_duplicates, pack, pack_tokens, resume, rpm, tpm, max_retries,
+            hedge, hedge_model, hedge_percentile, hedge_after, hedge_budget, downscale, grayscale, image_format, quality, crop):
     """
     Process images using OpenAI's GPT-4 Vision model and extract the response.
+
+    Pages are sent through a pool of `concurrency` workers, and each response is
+    written atomically to `./src/src_tex/problem_{i}.tex` in page order. Pages that
+    fail, after all retries or e.g. on a missing image, are reported and left
+    unwritten, and the other pages carry on.
+
+    Finished pages are recorded in a journal in `./src`, so with `resume` a run
+    that was interrupted only does the pages it had not finished.
+
+    With `pack`, consecutive pages are grouped, up to `pack_tokens` image tokens,
+    into one request whose response marks where each page starts, see `packing`.
+    Pages missing from a packed response are sent again on their own.
+
+    A PDF is rasterized page by page in the background, `prefetch` pages ahead of the
+    requests in flight, and each rendered page is deleted once it has been sent.
+
+    With `hedge`, a page that is slower than usual to start answering is sent again,
+    see `hedge.HedgedBackend`.
     """
-    for i in range(ranges[0], ranges[1] + 1):
-        dirname = os.path.dirname(image)
-        filename = os.path.basename(image)
-        extension = os.path.splitext(filename)[1]
-        basename = filename.split('_')[0]
-        image_path = os.path.join(dirname, f"{basename}_{i}{extension}")
-        ctx.invoke(gptvision, image=[image_path],
-                   prompt=prompt, model=model, max_tokens=2000)
-        subprocess.run(f"pbpaste >> ./src/src_tex/problem_{i}.tex", shell=True)
+    api_key = require_api_key(model)
+
+    if prompt == "prompt":
+        prompt = click.prompt("Please enter your custom prompt", type=str)
+
+    prompt = switch_prompt(prompt)
+    pdf = is_pdf(image)
+    if pdf:
+        page_count = pdf_page_count(image)
+        ranges = ranges or (1, page_count)
+        if ranges[0] < 1 or ranges[1] > page_count:
+            console = Console()
+            console.print(
+                f"Error: {image} has {page_count} pages, cannot extract {ranges[0]} to {ranges[1]}.", style="bold red")
+            sys.exit(1)
+    else:
+        ranges = ranges or (1, 1)
+    pages = range(ranges[0], ranges[1] + 1)
+    cache = None if no_cache else ResponseCache()
+    preprocessing = make_preprocessing(downscale, grayscale, image_format, quality, crop)
+    ledger = CostLedger()
+    output_directory = "./src/src_tex"
+    # Any page of a book may be given with -i, so images are keyed on their name pattern.
+    source = image if pdf else page_image_path(image, "{page}")
+    journal = RunJournal(f"./src/.journal-{run_key(source, prompt, model, 2000, preprocessing)}.jsonl", resume)
+    all_pages = pages
+    pages = journal.pending(all_pages, output_directory)
+    if resume:
+        done = [page for page in all_pages if page not in pages]
+        Console().print(
+            f"Resuming: {len(done)} of {len(all_pages)} pages already done, "
+            f"₹{journal.cost(done):.2f} not spent again", style="deep_pink3")
+    index = DedupIndex(dedup) if dedup is not None and cache is not None else None
+    backend = None
+    if hedge:
+        backend = make_hedged_backend(model, api_key, hedge_model, hedge_percentile, hedge_after, hedge_budget)
+
+    duplicates = {}
+
+    def process_page(page, image_path):
+        page_ledger = CostLedger()
+        try:
+            result = process_images([image_path], prompt, model, api_key, 2000,
+                                    copy=False, cache=cache, refresh=refresh, preprocessing=preprocessing,
+                                    ledger=page_ledger, dedup=index, backend=backend)
+        except Exception as e:
+            # A missing or unreadable image fails its page only, not the run.
+            return e
+        if index is not None and image_path in index.hits:
+            duplicates[page] = index.hits[image_path]
+        ledger.merge(page_ledger)
+        return result, page_ledger.total_cost()
+
+    def process_pack(items):
+        """
+        Returns (page, result) for every page of a pack, where a result is the
+        LaTeX and cost of the page, or the exception it failed with.
+        """
+        try:
+            if len(items) == 1:
+                return [(page, process_page(page, image_path)) for page, image_path in items]
+            pack_numbers = [page for page, _ in items]
+            pack_ledger = CostLedger()
+            try:
+                result = process_images([image_path for _, image_path in items], packing_prompt(prompt, pack_numbers),
+                                        model, api_key, packed_max_tokens(len(items)),
+                                        copy=False, cache=cache, refresh=refresh, preprocessing=preprocessing,
+                                        ledger=pack_ledger, dedup=index, backend=backend, pages=pack_numbers)
+            except Exception as e:
+                return [(page, e) for page in pack_numbers]
+            ledger.merge(pack_ledger)
+            parts = split_pages(result, pack_numbers)
+            cost = pack_ledger.total_cost() / max(len(parts), 1)
+            results = []
+            for page, image_path in items:
+                if page in parts:
+                    results.append((page, (parts[page], cost)))
+                else:
+                    Console().print(f"Page {page} is missing from the packed response, sending it alone", style="deep_pink3")
+                    results.append((page, process_page(page, image_path)))
+            return results
+        finally:
+            if pdf:
+                for _, image_path in items:
+                    os.remove(image_path)
+
+    configure_client(pool_size=max(concurrency, 10))
+    configure_limits(rpm, tpm, max_retries)
+    os.makedirs(output_directory, exist_ok=True)
+    console = Console()
+    failed = []
+    if pdf:
+        source = PdfPages(image, pages, prefetch, dpi)
+    else:
+        source = [(page, page_image_path(image, page)) for page in pages]
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Results come back in page order, so files are written page by page.
+            packs = pack_pages(source, pack, pack_tokens)
+            results = (item for pack_results in bounded_map(executor, process_pack, packs, 2 * concurrency)
+                       for item in pack_results)
+            for page, result in results:
+                if isinstance(result, Exception):
+                    failed.append(page)
+                    reason = result if isinstance(result, APIError) else f"{type(result).__name__}: {result}"
+                    console.print(f"Error: page {page} failed: {reason}", style="bold red", markup=False)
+                    continue
+                text, cost = result
+                if skip_duplicates and page in duplicates:
+                    journal.record(page, None, text, cost)
+                    console.print(f"Page {page} skipped, a near-duplicate of {duplicates[page]}", style="deep_pink3")
+                    continue
+                output_path = os.path.join(output_directory, f"problem_{page}.tex")
+                write_atomic(output_path, text)
+                journal.record(page, output_path, text, cost)
+                console.print(f"Page {page} written to problem_{page}.tex", style="deep_pink3")
+    finally:
+        journal.close()
+        if pdf:
+            source.close()
+        if index is not None:
+            index.save()
+        if backend is not None:
+            backend.save()
+
+    ledger.print_summary()
+    if index is not None:
+        index.print_report()
+    if backend is not None:
+        backend.print_report()
+
+    if failed:
+        console.print(
+            f"{len(failed)} pages failed: {', '.join(map(str, failed))}", style="bold red")
+        sys.exit(1)
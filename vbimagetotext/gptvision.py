@@ -1,11 +1,16 @@
 import click
-import os
 import sys
 
 from rich.console import Console
 
 from .functions import process_images
+from .backends import require_api_key
+from .ratelimit import APIError
 from .prompts import switch_prompt
+from .response_cache import ResponseCache
+from .dedup import DedupIndex
+from .hedge import hedging_options, make_hedged_backend
+from .preprocess import make_preprocessing, preprocessing_options
 from .choice_option import ChoiceOption
 
 
@@ -56,7 +61,10 @@ from .choice_option import ChoiceOption
             "gpt-4-turbo",
             "gpt-4-turbo-preview",
             "gpt-4-vision-preview",
-            "gpt-4o-mini"
+            "gpt-4o-mini",
+            "gemini-1.5-flash",
+            "gemini-1.5-pro",
+            "mock",
         ],
         case_sensitive=False),
     prompt=True,
@@ -71,19 +79,63 @@ from .choice_option import ChoiceOption
     show_default=True,
     help="The maximum number of tokens to generate.",
 )
-def gptvision(image, prompt, model, max_tokens):
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or write the response cache.",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ignore cached responses and overwrite them with fresh ones.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Print the response and write it to the output file as it arrives.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="File to stream the response to. Defaults to the first image name with a .tex extension.",
+)
+@click.option(
+    "--dedup",
+    type=click.IntRange(0, 64),
+    default=None,
+    help="Reuse the cached response of a page whose perceptual hash is within this many bits (0-64, e.g. 6).",
+)
+@hedging_options
+@preprocessing_options
+def gptvision(image, prompt, model, max_tokens, no_cache, refresh, stream, output, dedup,
+              hedge, hedge_model, hedge_percentile, hedge_after, hedge_budget, downscale, grayscale, image_format, quality, crop):
     """
     Process images using OpenAI's GPT-4 Vision and extract LaTeX code from the response.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if api_key is None:
-        console = Console()
-        console.print(
-            "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.", style="bold red")
-        sys.exit(1)
+    api_key = require_api_key(model)
 
     if prompt == "prompt":
         prompt = click.prompt("Please enter your custom prompt", type=str)
 
     prompt = switch_prompt(prompt)
-    process_images(image, prompt, model, api_key, max_tokens)
+    cache = None if no_cache else ResponseCache()
+    preprocessing = make_preprocessing(downscale, grayscale, image_format, quality, crop)
+    index = DedupIndex(dedup) if dedup is not None and cache is not None else None
+    backend = None
+    if hedge:
+        backend = make_hedged_backend(model, api_key, hedge_model, hedge_percentile, hedge_after, hedge_budget)
+    try:
+        process_images(image, prompt, model, api_key, max_tokens,
+                       cache=cache, refresh=refresh, preprocessing=preprocessing,
+                       stream=stream, output=output, dedup=index, backend=backend)
+    except APIError as e:
+        console = Console()
+        console.print(f"Error: {e}", style="bold red")
+        sys.exit(1)
+    finally:
+        if index is not None:
+            index.save()
+        if backend is not None:
+            backend.save()
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional, Union
+
+import click
+from rich.console import Console
+
+from .backends import Backend, Cancelled, GenerateOptions, Generation, backend_name, estimate_request_tokens, make_backend, require_api_key, text_parts
+from .response_cache import DEFAULT_CACHE_DIR
+from .telemetry import Trace
+from .token_cost_calculations import model_pricing, tokens_cost
+
+
+DEFAULT_LATENCY_PATH = os.path.join(DEFAULT_CACHE_DIR, "latency.json")
+# Upper bounds of the histogram buckets, in seconds: 50 ms growing by 25% per
+# bucket up to about 7 minutes, so every bucket is a fixed fraction wide.
+BUCKET_BOUNDS = [0.05 * 1.25 ** i for i in range(41)]
+# Samples needed before the percentile deadline is trusted over `--hedge-after`.
+MIN_SAMPLES = 20
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram of the seconds a provider takes to its first token.
+    """
+
+    def __init__(self, counts: List[int] = None):
+        self.counts = list(counts) if counts and len(counts) == len(BUCKET_BOUNDS) else [0] * len(BUCKET_BOUNDS)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def add(self, seconds: float) -> None:
+        for index, bound in enumerate(BUCKET_BOUNDS):
+            if seconds <= bound:
+                break
+        self.counts[index] += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Returns the upper bound of the bucket holding the p-th percentile (0-100), or None if empty.
+        """
+        total = self.total
+        if not total:
+            return None
+        rank = p / 100 * total
+        seen = 0
+        for count, bound in zip(self.counts, BUCKET_BOUNDS):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKET_BOUNDS[-1]
+
+
+class LatencyStore:
+    """
+    Latency histograms per provider and model, kept across runs in the cache
+    directory so the hedging deadline starts out tuned.
+    """
+
+    def __init__(self, path: str = DEFAULT_LATENCY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.dirty = False
+        try:
+            with open(path, "r") as file:
+                entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = {}
+        for key, counts in entries.items():
+            self.histograms[key] = LatencyHistogram(counts)
+
+    def get(self, model: str) -> LatencyHistogram:
+        key = f"{backend_name(model)}/{model}"
+        with self.lock:
+            return self.histograms.setdefault(key, LatencyHistogram())
+
+    def add(self, model: str, seconds: float) -> None:
+        histogram = self.get(model)
+        with self.lock:
+            histogram.add(seconds)
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({key: h.counts for key, h in self.histograms.items()}, file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class HedgeBudget:
+    """
+    Caps the estimated extra spend of hedge requests over a run, in rupees.
+    """
+
+    def __init__(self, max_cost: float):
+        self.max_cost = max_cost
+        self.spent = 0.0
+        self.lock = threading.Lock()
+
+    def take(self, cost: float) -> bool:
+        with self.lock:
+            if self.spent + cost > self.max_cost:
+                return False
+            self.spent += cost
+            return True
+
+
+class Race:
+    """
+    Decides which attempt of a hedged request wins: the first to stream any text.
+
+    Only the winner's chunks are passed on; the loser's next chunk raises
+    `Cancelled`, which closes its connection.
+    """
+
+    def __init__(self, on_text=None):
+        self.loop = asyncio.get_running_loop()
+        self.on_text = on_text
+        self.lock = threading.Lock()
+        self.winner = None
+        self.decided = asyncio.Event()
+        self.first_token = {}
+
+    def claim(self, index: int) -> bool:
+        with self.lock:
+            if self.winner is None:
+                self.winner = index
+                # Chunks of threaded backends arrive on worker threads.
+                self.loop.call_soon_threadsafe(self.decided.set)
+            return self.winner == index
+
+    def callback(self, index: int, start: float):
+        def on_text(text: str) -> None:
+            self.first_token.setdefault(index, time.perf_counter() - start)
+            if not self.claim(index):
+                raise Cancelled()
+            if self.on_text is not None:
+                self.on_text(text)
+        return on_text
+
+
+class HedgedBackend(Backend):
+    """
+    Sends a second, hedge request when the first has not started answering by a
+    deadline, and keeps whichever streams text first.
+
+    The deadline is the `percentile` of the primary model's time to first token,
+    from the latency histograms, or `after` seconds until `MIN_SAMPLES` requests
+    have been seen. The hedge goes to `hedge_model`, which may be the same model or
+    another provider's. Each hedge is charged its estimated input cost against the
+    budget, as a cancelled request still pays for its prompt, and no hedge is sent
+    once the budget is spent.
+
+    A loser that is already streaming is cut off at its next chunk. One still
+    waiting for its first chunk cannot be interrupted: it is abandoned on its
+    worker thread and only closed once its first chunk arrives. Until then it
+    holds a connection and keeps using the provider's quota.
+    """
+    name = "hedged"
+
+    def __init__(self, primary: Backend, hedge: Backend, hedge_model: str = None, percentile: float = 95,
+                 after: float = 8.0, budget: HedgeBudget = None, latencies: LatencyStore = None):
+        self.primary = primary
+        self.hedge = hedge
+        self.hedge_model = hedge_model
+        self.percentile = percentile
+        self.after = after
+        self.budget = budget or HedgeBudget(float("inf"))
+        self.latencies = latencies or LatencyStore()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+
+    def deadline(self, model: str) -> float:
+        histogram = self.latencies.get(model)
+        if histogram.total < MIN_SAMPLES:
+            return self.after
+        return histogram.percentile(self.percentile)
+
+    def hedge_cost(self, images: List[str], prompt: Union[str, List[str]], model: str) -> float:
+        tokens = estimate_request_tokens(images, "".join(text_parts(prompt)), 0)
+        return tokens_cost(tokens, model_pricing(model)[0])
+
+    async def attempt(self, race: Race, index: int, backend: Backend, images: List[str],
+                      prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        start = time.perf_counter()
+        trace = Trace()
+        # Every attempt streams, so the race is decided on the first chunk and the
+        # loser can be cut off mid-response.
+        generation = await backend.generate(images, prompt, replace(
+            options, stream=True, on_text=race.callback(index, start), trace=trace))
+        # An empty response never calls `on_text`.
+        if race.claim(index) and options.trace is not None:
+            options.trace.merge(trace)
+        generation.model = options.model
+        return generation
+
+    async def generate(self, images: List[str], prompt: Union[str, List[str]], options: GenerateOptions) -> Generation:
+        race = Race(options.on_text)
+        start = time.perf_counter()
+        models = [options.model]
+        tasks = [asyncio.create_task(self.attempt(race, 0, self.primary, images, prompt, options))]
+        decided = asyncio.create_task(race.decided.wait())
+        with self.lock:
+            self.requests += 1
+
+        done, _ = await asyncio.wait({decided, tasks[0]}, timeout=self.deadline(options.model), return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            hedge_model = self.hedge_model or options.model
+            if self.budget.take(self.hedge_cost(images, prompt, hedge_model)):
+                models.append(hedge_model)
+                tasks.append(asyncio.create_task(self.attempt(
+                    race, 1, self.hedge, images, prompt, replace(options, model=hedge_model))))
+                with self.lock:
+                    self.hedges += 1
+            else:
+                with self.lock:
+                    self.skipped += 1
+
+        waiting = set(tasks)
+        while race.winner is None and waiting:
+            done, _ = await asyncio.wait(waiting | {decided}, return_when=asyncio.FIRST_COMPLETED)
+            waiting -= done
+        decided.cancel()
+        for task in tasks:
+            # The loser stops at its next chunk; its outcome is of no interest.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        if race.winner is None:
+            # Every attempt failed before answering.
+            raise tasks[0].exception()
+
+        for index, model in enumerate(models):
+            if index in race.first_token:
+                self.latencies.add(model, race.first_token[index])
+            elif index == 0:
+                # Censored: the primary was still silent when the hedge won.
+                self.latencies.add(model, time.perf_counter() - start)
+        if race.winner == 1:
+            with self.lock:
+                self.hedge_wins += 1
+        generation = await tasks[race.winner]
+        if not options.stream:
+            generation.timings["first_token"] = None
+        return generation
+
+    def print_report(self) -> None:
+        """
+        Prints how often hedges were sent and won, and the latency percentiles of each provider.
+        """
+        console = Console()
+        console.print(
+            f"Hedging: {self.hedges} of {self.requests} requests hedged, {self.hedge_wins} won by the hedge, "
+            f"{self.skipped} skipped over budget, estimated extra spend ₹{self.budget.spent:.4f}.",
+            style="deep_pink3")
+        for key, histogram in sorted(self.latencies.histograms.items()):
+            if histogram.total:
+                p50, p95, p99 = (histogram.percentile(p) for p in (50, 95, 99))
+                print(f"  {key}: {histogram.total} samples, first token p50 {p50:.2f}s, p95 {p95:.2f}s, p99 {p99:.2f}s")
+
+    def save(self) -> None:
+        self.latencies.save()
+
+
+def make_hedged_backend(model: str, api_key: str, hedge_model: str = None, percentile: float = 95,
+                        after: float = 8.0, budget: float = 20.0) -> HedgedBackend:
+    """
+    Creates a hedged backend for a model.
+
+    Args:
+        model (str): The primary model.
+        api_key (str): API key of the primary model's provider.
+        hedge_model (str, optional): Model of the hedge requests, the primary model if not given.
+        percentile (float, optional): Percentile of the first token latency to hedge after.
+        after (float, optional): Seconds to hedge after until enough latencies are known.
+        budget (float, optional): Estimated extra spend allowed for hedges, in rupees.
+
+    Returns:
+        HedgedBackend: The backend.
+    """
+    hedge_model = hedge_model or model
+    if backend_name(hedge_model) == backend_name(model):
+        hedge_key = api_key
+    else:
+        hedge_key = require_api_key(hedge_model)
+    return HedgedBackend(
+        make_backend(model, api_key), make_backend(hedge_model, hedge_key), hedge_model,
+        percentile, after, HedgeBudget(budget))
+
+
+def hedging_options(command):
+    """
+    Adds the `--hedge`, `--hedge-model`, `--hedge-percentile`, `--hedge-after` and
+    `--hedge-budget` options to a click command.
+    """
+    options = [
+        click.option(
+            "--hedge",
+            is_flag=True,
+            help="Send a second request when the first is slower than usual, keeping whichever answers first.",
+        ),
+        click.option(
+            "--hedge-model",
+            default=None,
+            help="Model for the hedge requests, e.g. gemini-1.5-flash. Defaults to the same model.",
+        ),
+        click.option(
+            "--hedge-percentile",
+            type=click.FloatRange(min=50, max=100, max_open=True),
+            default=95,
+            show_default=True,
+            help="Hedge once a request is slower to its first token than this percentile of past requests.",
+        ),
+        click.option(
+            "--hedge-after",
+            type=click.FloatRange(min=0),
+            default=8.0,
+            show_default=True,
+            help=f"Seconds to hedge after until {MIN_SAMPLES} latencies have been recorded.",
+        ),
+        click.option(
+            "--hedge-budget",
+            type=click.FloatRange(min=0),
+            default=20.0,
+            show_default=True,
+            help="Estimated extra spend allowed for hedge requests over the run, in rupees.",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
@@ -0,0 +1,208 @@
+import glob
+import json
+import mimetypes
+import os
+import re
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+
+class ImageInfo(NamedTuple):
+    width: int
+    height: int
+    mime_type: str
+    size: int
+
+
+def natural_key(path: str) -> list:
+    """
+    Sort key that orders `name_2.png` before `name_10.png`.
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def find_images(source: str) -> List[str]:
+    """
+    Lists the images in a directory, or the files matching a glob pattern, in page order.
+
+    Args:
+        source (str): A directory or a glob pattern.
+
+    Returns:
+        List[str]: The image paths.
+    """
+    if os.path.isdir(source):
+        paths = [entry.path for entry in os.scandir(source)]
+    else:
+        paths = glob.glob(source)
+    paths = [p for p in paths if os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS]
+    return sorted(paths, key=natural_key)
+
+
+def detect_mime_type(header: bytes, filename: str = None) -> str:
+    """
+    Detects the MIME type of an image from the first bytes of the file.
+
+    Args:
+        header (bytes): At least the first 12 bytes of the file.
+        filename (str, optional): File name to fall back on when the header is unknown.
+
+    Returns:
+        str: The MIME type, `image/png` if it cannot be detected.
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if filename is not None:
+        mime_type, _ = mimetypes.guess_type(filename)
+        if mime_type is not None and mime_type.startswith("image/"):
+            return mime_type
+    return "image/png"
+
+
+def _jpeg_size(file: BinaryIO) -> Optional[Tuple[int, int]]:
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        while byte and byte != b"\xff":
+            byte = file.read(1)
+        while byte == b"\xff":
+            byte = file.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        # Markers without a length field.
+        if marker in (0x01, 0xd8) or 0xd0 <= marker <= 0xd7:
+            continue
+        if marker == 0xd9:
+            return None
+        length_bytes = file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        # Start of frame, except DHT (C4), JPG (C8) and DAC (CC).
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            data = file.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def _header_size(header: bytes, mime_type: str, file: BinaryIO) -> Optional[Tuple[int, int]]:
+    if mime_type == "image/png" and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+    if mime_type == "image/gif":
+        return struct.unpack("<HH", header[6:10])
+    if mime_type == "image/webp":
+        chunk = header[12:16]
+        if chunk == b"VP8 " and header[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack("<HH", header[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b"VP8L" and header[20] == 0x2f:
+            bits = struct.unpack("<I", header[21:25])[0]
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b"VP8X":
+            width = int.from_bytes(header[24:27], "little") + 1
+            height = int.from_bytes(header[27:30], "little") + 1
+            return width, height
+        return None
+    if mime_type == "image/jpeg":
+        return _jpeg_size(file)
+    return None
+
+
+@lru_cache(maxsize=65536)
+def _probe(path: str, mtime_ns: int, size: int) -> ImageInfo:
+    with open(path, "rb") as file:
+        header = file.read(32)
+        mime_type = detect_mime_type(header, path)
+        dimensions = _header_size(header, mime_type, file)
+    if dimensions is None:
+        # Unknown or unusual format: let Pillow work it out.
+        from PIL import Image
+        with Image.open(path) as img:
+            dimensions = img.size
+    return ImageInfo(dimensions[0], dimensions[1], mime_type, size)
+
+
+def probe_image(path: str) -> ImageInfo:
+    """
+    Reads the dimensions and MIME type of an image from its header, without decoding it.
+
+    PNG, JPEG, WebP and GIF headers are parsed directly; other formats fall back to
+    Pillow. Results are memoized by path, modification time and size, so each file is
+    only read once however many times it is probed.
+
+    Args:
+        path (str): The path to the image file.
+
+    Returns:
+        ImageInfo: The width, height, MIME type and file size.
+    """
+    stat = os.stat(path)
+    return _probe(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+class MetadataStore:
+    """
+    Persistent cache of image metadata, so repeated scans of a book skip the probing.
+
+    Entries are keyed by absolute path and revalidated against the modification time
+    and size of the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as file:
+                self.entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def probe(self, path: str) -> ImageInfo:
+        """
+        Returns the metadata of an image, from the store when the file is unchanged.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return ImageInfo(entry[2], entry[3], entry[4], stat.st_size)
+        info = _probe(path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            self.entries[path] = [stat.st_mtime_ns, stat.st_size, info.width, info.height, info.mime_type]
+            self.dirty = True
+        return info
+
+    def probe_many(self, paths: List[str], workers: int = 32) -> List[ImageInfo]:
+        """
+        Probes many images in parallel, returning the metadata in the order of the paths.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.probe, paths))
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
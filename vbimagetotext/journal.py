@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+from rich.console import Console
+
+
+def run_key(source: str, prompt: str, model: str, max_tokens: int, preprocessing=None) -> str:
+    """
+    Identifies a run by its input and settings, so `--resume` only trusts pages
+    done with the same prompt, model and preprocessing. `source` is the PDF, or the
+    name pattern of the page images, not the page passed on the command line. The
+    page range is left out, so a run can be resumed with a different range.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{os.path.abspath(source)}\0{prompt}\0{model}\0{max_tokens}\0{preprocessing!r}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class RunJournal:
+    """
+    Append-only log of the pages of a run that are finished.
+
+    A page is recorded once its output has been written, with the hash of the
+    output and the cost of its request. Every line is flushed and synced, so after
+    a crash the journal holds every finished page, and at worst one truncated line,
+    which is ignored.
+
+    Usage:
+        journal = RunJournal("./src/.journal-1234.jsonl", resume=True)
+        for page in journal.pending(pages, "./src/src_tex"):
+            ...
+            journal.record(page, path, text, cost)
+        journal.close()
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[int, dict] = {}
+        if resume:
+            try:
+                with open(path, "r") as file:
+                    for line in file:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        self.entries[entry["page"]] = entry
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A fresh run redoes every page, so it starts a fresh journal.
+        self.file = open(path, "a" if resume else "w")
+
+    def pending(self, pages: List[int], directory: str) -> List[int]:
+        """
+        Returns the pages that still have to be done: those not in the journal, or
+        whose output file has gone missing since.
+
+        Outputs that were edited after they were written are kept, with a note.
+        """
+        console = Console()
+        todo = []
+        for page in pages:
+            entry = self.entries.get(page)
+            if entry is None:
+                todo.append(page)
+                continue
+            if entry["file"] is None:
+                continue
+            path = os.path.join(directory, entry["file"])
+            try:
+                with open(path, "r") as file:
+                    text = file.read()
+            except FileNotFoundError:
+                todo.append(page)
+                continue
+            if text_hash(text) != entry["sha256"]:
+                console.print(f"Keeping {entry['file']}, it changed since it was written", style="deep_pink3")
+        return todo
+
+    def cost(self, pages: List[int]) -> float:
+        """
+        Returns the recorded cost in rupees of the given pages.
+        """
+        return sum(self.entries[page]["cost"] for page in pages if page in self.entries)
+
+    def record(self, page: int, path: str, text: str, cost: float) -> None:
+        """
+        Records a finished page.
+
+        Args:
+            page (int): The page number.
+            path (str): The output file, None if the page was deliberately not written.
+            text (str): What was written.
+            cost (float): Cost of the request in rupees, 0 for cached pages.
+        """
+        entry = {
+            "page": page,
+            "file": os.path.basename(path) if path is not None else None,
+            "sha256": text_hash(text),
+            "cost": round(cost, 6),
+            "time": time.time(),
+        }
+        with self.lock:
+            self.entries[page] = entry
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.file.close()
@@ -1,9 +1,8 @@
+import ast
+import importlib
+import os
+
 import click
-from .gptvision import gptvision
-from .geminivision import geminivision
-from .copyprompt import copyprompt
-from .solution import solution
-from .gptloop import gptloop
 
 
 CONTEXT_SETTINGS = dict(
@@ -14,14 +13,89 @@ CONTEXT_SETTINGS = dict(
     auto_envvar_prefix='VBIMAGETOTEXT',
 )
 
+# Command name: (module, attribute).
+COMMANDS = {
+    "gptvision": ("gptvision", "gptvision"),
+    "geminivision": ("geminivision", "geminivision"),
+    "copyprompt": ("copyprompt", "copyprompt"),
+    "solution": ("solution", "solution"),
+    "gptloop": ("gptloop", "gptloop"),
+    "cache": ("cache", "cache"),
+    "batch": ("batch", "batch"),
+    "mockserver": ("mockserver", "mockserver"),
+    "plan": ("plan", "plan"),
+    "serve": ("daemon", "serve"),
+    "client": ("daemon", "client"),
+    "bench": ("bench", "bench"),
+    "stats": ("stats", "stats"),
+    "watch": ("watch", "watch"),
+}
 
-@click.group(context_settings=CONTEXT_SETTINGS)
-def main():
-    pass
 
+def command_help(module_name: str, attribute: str) -> str:
+    """
+    Reads the `help=` of a command from the source of its module, without importing
+    it, so `vbimagetotext --help` lists the commands with the text they declare.
+
+    Returns:
+        str: The help, or "" if it is not a plain string in the decorator.
+    """
+    path = os.path.join(os.path.dirname(__file__), f"{module_name}.py")
+    with open(path, "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read(), path)
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or node.name != attribute:
+            continue
+        for decorator in node.decorator_list:
+            if isinstance(decorator, ast.Call):
+                for keyword in decorator.keywords:
+                    if keyword.arg == "help" and isinstance(keyword.value, ast.Constant):
+                        return keyword.value.value
+    return ""
+
+
+class LazyGroup(click.Group):
+    """
+    A click group that imports the module of a subcommand only when it is invoked.
+
+    Each command pulls in its own heavy dependencies (Pillow, requests, rich,
+    google.generativeai, ...), so importing all of them up front made every
+    invocation pay for every command.
+    """
 
-main.add_command(gptvision)
-main.add_command(geminivision)
-main.add_command(copyprompt)
-main.add_command(solution)
-main.add_command(gptloop)
+    def __init__(self, *args, lazy_commands: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.commands or cmd_name not in self.lazy_commands:
+            return super().get_command(ctx, cmd_name)
+        module_name, attribute = self.lazy_commands[cmd_name]
+        module = importlib.import_module(f"{__package__}.{module_name}")
+        command = getattr(module, attribute)
+        self.add_command(command, cmd_name)
+        return command
+
+    def format_commands(self, ctx, formatter):
+        rows = []
+        limit = formatter.width - 6 - max(map(len, self.list_commands(ctx)), default=0)
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                command = self.commands[name]
+                if command.hidden:
+                    continue
+                rows.append((name, command.get_short_help_str(limit)))
+            else:
+                placeholder = click.Command(name, help=command_help(*self.lazy_commands[name]))
+                rows.append((name, placeholder.get_short_help_str(limit)))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS, context_settings=CONTEXT_SETTINGS)
+def main():
+    pass
@@ -0,0 +1,23 @@
+from math import ceil
+from typing import Sequence
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """
+    Returns the value below which `fraction` of the sorted values fall (nearest rank),
+    0 if there are none.
+    """
+    if not values:
+        return 0
+    index = max(0, ceil(fraction * len(values)) - 1)
+    return values[index]
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
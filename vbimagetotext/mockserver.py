@@ -0,0 +1,441 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional, Tuple
+
+import click
+from rich.console import Console
+
+from .packing import PAGE_MARKER, PAGE_MARKER_PATTERN
+from .token_cost_calculations import count_text_tokens
+
+
+def marked_pages(text: str) -> List[int]:
+    """
+    Returns the pages whose marker lines appear in a text, in order. The mock server,
+    which only sees the request body, finds the pages of a packed request this way.
+    """
+    return [int(page) for page in PAGE_MARKER_PATTERN.findall(text)]
+
+
+def mock_packed_answer(pages: List[int], digests: List[str]) -> str:
+    """
+    Builds the answer of a mock model to a packed request, one item per page.
+    """
+    items = [f"{PAGE_MARKER.format(page=page)}\n\\item Mock response {digest}" for page, digest in zip(pages, digests)]
+    return "```latex\n" + "\n".join(items) + "\n```"
+
+
+def system_prompt(body: dict) -> str:
+    """
+    Returns the system messages a chat completion request starts with, the prefix
+    the prompt cache is keyed on.
+    """
+    parts = []
+    for message in body.get("messages", []):
+        if message.get("role") != "system":
+            break
+        parts.append(message["content"] if isinstance(message["content"], str) else json.dumps(message["content"]))
+    return "\n".join(parts)
+
+
+def fake_completion(body: dict, cached_tokens: int = 0) -> dict:
+    """
+    Builds a deterministic chat completion for a request body.
+
+    The answer names a hash of the request, so different pages get different answers
+    and the same page always gets the same one. A packed request gets one marked
+    answer per image. The prompt tokens are the tokens of the system prompt plus
+    100 for the rest, `cached_tokens` of them read from the prompt cache.
+    """
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    text = f"```latex\n\\item Mock response {digest}\n```"
+    parts = [part for message in body.get("messages", []) if isinstance(message.get("content"), list)
+             for part in message["content"]]
+    pages = marked_pages("\n".join(part["text"] for part in parts if part.get("type") == "text"))
+    if pages:
+        images = [part["image_url"]["url"] for part in parts if part.get("type") == "image_url"]
+        text = mock_packed_answer(pages, [hashlib.sha256(url.encode("utf-8")).hexdigest()[:12] for url in images])
+    prompt_tokens = 100 + count_text_tokens(system_prompt(body), body.get("model"))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(text.split()),
+            "total_tokens": prompt_tokens + len(text.split()),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        },
+    }
+
+
+def completion_chunks(completion: dict, include_usage: bool) -> Iterator[dict]:
+    """
+    Splits a chat completion into the `chat.completion.chunk` events of a streamed
+    response, one word per chunk.
+    """
+    words = completion["choices"][0]["message"]["content"].split(" ")
+    base = {"id": completion["id"], "object": "chat.completion.chunk",
+            "created": completion["created"], "model": completion["model"]}
+    for index, word in enumerate(words):
+        text = word if index == len(words) - 1 else word + " "
+        yield {**base, "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if include_usage:
+        yield {**base, "choices": [], "usage": completion["usage"]}
+
+
+@dataclass
+class MockConfig:
+    """
+    How the mock server behaves, for benchmarks and failure testing.
+    """
+    # Seconds before a chat completion is answered, plus up to `jitter` more at random.
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Pace of the generated tokens, 0 for all at once.
+    tokens_per_second: float = 0.0
+    # Fraction of chat completions, and of the requests of a batch, answered with a 500 error.
+    error_rate: float = 0.0
+    # Requests per minute before answering 429, None for no limit.
+    rpm: Optional[float] = None
+    seed: Optional[int] = None
+    # Shortest system prompt, in tokens, served from the prompt cache once seen.
+    cache_min_tokens: int = 1024
+
+
+def parse_multipart(body: bytes, content_type: str) -> dict:
+    """
+    Splits a multipart/form-data body into a dict of field name to bytes.
+    """
+    boundary = content_type.split("boundary=")[1].strip('"').encode("ascii")
+    fields = {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        headers, _, value = part.strip(b"\r\n").partition(b"\r\n\r\n")
+        for item in headers.decode("utf-8").split(";"):
+            item = item.strip()
+            if item.startswith("name="):
+                fields[item[len("name="):].strip('"')] = value
+    return fields
+
+
+class MockState:
+    """
+    Files and batches uploaded to the mock server, the rate limit window, and
+    counters of how chat completions were answered.
+    """
+
+    def __init__(self, config: MockConfig = None):
+        self.config = config or MockConfig()
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(self.config.seed)
+        # Times of the requests admitted in the last minute.
+        self.window = deque()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.bytes_received = 0
+        # Hashes of the system prompts seen, standing in for the prompt cache.
+        self.prefixes = set()
+
+    def admit(self, size: int) -> Tuple[int, dict]:
+        """
+        Decides how to answer a chat completion request.
+
+        Returns:
+            Tuple[int, dict]: The status code, 200, 429 or 500, and the rate limit headers.
+        """
+        config = self.config
+        with self.lock:
+            now = time.monotonic()
+            self.requests += 1
+            self.bytes_received += size
+            while self.window and now - self.window[0] >= 60:
+                self.window.popleft()
+            headers = {}
+            if config.rpm:
+                limit = int(config.rpm)
+                reset = 60 - (now - self.window[0]) if self.window else 0.0
+                headers = {
+                    "x-ratelimit-limit-requests": str(limit),
+                    "x-ratelimit-remaining-requests": str(max(0, limit - len(self.window) - 1)),
+                    "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                }
+                if len(self.window) >= limit:
+                    self.rate_limited += 1
+                    headers["retry-after-ms"] = str(int(reset * 1000))
+                    return 429, headers
+            self.window.append(now)
+            if self.random.random() < config.error_rate:
+                self.errors += 1
+                return 500, headers
+            return 200, headers
+
+    def cached_tokens(self, body: dict) -> int:
+        """
+        Returns the prompt tokens of a request served from the prompt cache.
+
+        Like OpenAI's automatic prompt caching, a system prompt of at least
+        `cache_min_tokens` tokens is cached once it has been seen, in steps of 128
+        tokens.
+        """
+        prefix = system_prompt(body)
+        tokens = count_text_tokens(prefix, body.get("model"))
+        key = hashlib.sha256(prefix.encode("utf-8")).digest()
+        with self.lock:
+            seen = key in self.prefixes
+            self.prefixes.add(key)
+        if not seen or tokens < self.config.cache_min_tokens:
+            return 0
+        return tokens // 128 * 128
+
+    def delay(self) -> float:
+        with self.lock:
+            return self.config.latency + self.random.uniform(0, self.config.jitter)
+
+    def add_file(self, content: bytes, purpose: str) -> dict:
+        file_id = f"file-{uuid.uuid4().hex}"
+        with self.lock:
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "purpose": purpose}
+
+    def add_batch(self, request: dict) -> dict:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        lines = self.files[request["input_file_id"]].decode("utf-8").splitlines()
+        results = []
+        errors = []
+        for line in filter(None, lines):
+            item = json.loads(line)
+            result = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": item["custom_id"], "error": None}
+            # Failed requests go to the error file, with the error response the API gave.
+            if self.random.random() < self.config.error_rate:
+                result["response"] = {"status_code": 500, "body": {
+                    "error": {"message": "The server had an error", "type": "server_error", "code": None}}}
+                errors.append(json.dumps(result))
+            else:
+                result["response"] = {"status_code": 200, "body": fake_completion(item["body"])}
+                results.append(json.dumps(result))
+        # Like the API, a file is only made when it has lines.
+        output = self.add_file("\n".join(results).encode("utf-8") + b"\n", "batch_output") if results else None
+        error = self.add_file("\n".join(errors).encode("utf-8") + b"\n", "batch_output") if errors else None
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "input_file_id": request["input_file_id"],
+            "completion_window": request["completion_window"],
+            "status": "completed",
+            "output_file_id": output and output["id"],
+            "error_file_id": error and error["id"],
+            "request_counts": {"total": len(results) + len(errors), "completed": len(results), "failed": len(errors)},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        return batch
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data: dict, status: int = 200, headers: dict = None) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self, events: Iterator[dict], pace: float, headers: dict) -> None:
+        """
+        Sends server-sent events with chunked transfer encoding, `pace` seconds apart.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for event in [*(f"data: {json.dumps(e)}" for e in events), "data: [DONE]"]:
+                data = (event + "\n\n").encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+                time.sleep(pace)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up, e.g. a cancelled hedge request.
+            self.close_connection = True
+
+    def chat_completion(self, body: bytes) -> None:
+        status, headers = self.state.admit(len(body))
+        if status == 429:
+            self.send_json({"error": {"message": "Rate limit reached", "type": "requests"}}, 429, headers)
+            return
+        time.sleep(self.state.delay())
+        if status != 200:
+            self.send_json({"error": {"message": "The server had an error", "type": "server_error"}}, status, headers)
+            return
+        request = json.loads(body)
+        completion = fake_completion(request, self.state.cached_tokens(request))
+        tokens_per_second = self.state.config.tokens_per_second
+        pace = 1 / tokens_per_second if tokens_per_second else 0.0
+        if request.get("stream"):
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            self.send_events(completion_chunks(completion, include_usage), pace, headers)
+            return
+        time.sleep(pace * completion["usage"]["completion_tokens"])
+        self.send_json(completion, headers=headers)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.endswith("/chat/completions"):
+            self.chat_completion(body)
+        elif self.path.endswith("/files"):
+            fields = parse_multipart(body, self.headers["Content-Type"])
+            self.send_json(self.state.add_file(fields["file"], fields["purpose"].decode("utf-8")))
+        elif self.path.endswith("/batches"):
+            self.send_json(self.state.add_batch(json.loads(body)))
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def do_GET(self):
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.state.batches:
+            self.send_json(self.state.batches[parts[-1]])
+        elif len(parts) >= 3 and parts[-1] == "content" and parts[-2] in self.state.files:
+            content = self.state.files[parts[-2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, config: MockConfig = None) -> ThreadingHTTPServer:
+    """
+    Creates a mock API server. Port 0 picks a free port.
+
+    Args:
+        host (str, optional): Host to listen on.
+        port (int, optional): Port to listen on.
+        config (MockConfig, optional): Latency, pacing, errors and rate limit.
+
+    Returns:
+        ThreadingHTTPServer: The server. Its base URL is
+        `http://{host}:{server.server_port}/v1`, and `server.state` holds its counters.
+    """
+    state = MockState(config)
+    handler = type("Handler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+@click.command(
+    help="Run a local stand-in for the OpenAI API, for offline testing."
+)
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Host to listen on",
+)
+@click.option(
+    "--port",
+    type=int,
+    default=8000,
+    show_default=True,
+    help="Port to listen on",
+)
+@click.option(
+    "--latency",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    show_default=True,
+    help="Seconds before each chat completion is answered",
+)
+@click.option(
+    "--jitter",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    show_default=True,
+    help="Up to this many extra seconds of latency, at random",
+)
+@click.option(
+    "--tokens-per-second",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    show_default=True,
+    help="Pace of the generated tokens, 0 for all at once",
+)
+@click.option(
+    "--error-rate",
+    type=click.FloatRange(0, 1),
+    default=0.0,
+    show_default=True,
+    help="Fraction of chat completions and batch requests answered with a 500 error",
+)
+@click.option(
+    "--rpm",
+    type=click.FloatRange(min=1),
+    default=None,
+    help="Requests per minute before answering 429 with Retry-After",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=None,
+    help="Seed for the random latency and errors",
+)
+@click.option(
+    "--cache-min-tokens",
+    type=click.IntRange(min=0),
+    default=1024,
+    show_default=True,
+    help="Shortest system prompt, in tokens, that is served from the prompt cache once seen",
+)
+def mockserver(host, port, latency, jitter, tokens_per_second, error_rate, rpm, seed, cache_min_tokens):
+    """
+    Run a local stand-in for the OpenAI API, for offline testing.
+
+    Chat completions, streamed or not, files and batches are supported. Latency,
+    token pacing, server errors, rate limiting and prompt caching can be simulated.
+    """
+    config = MockConfig(latency, jitter, tokens_per_second, error_rate, rpm, seed, cache_min_tokens)
+    server = make_server(host, port, config)
+    Console().print(
+        f"Mock API listening, set OPENAI_BASE_URL=http://{host}:{server.server_port}/v1",
+        style="deep_pink3")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
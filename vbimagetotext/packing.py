@@ -0,0 +1,84 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from .token_cost_calculations import count_image_tokens
+
+
+# Line the model writes before the LaTeX of each page of a packed request.
+PAGE_MARKER = "%%% page {page} %%%"
+PAGE_MARKER_PATTERN = re.compile(r"^[ \t]*%%% page (\d+) %%%[ \t]*$", re.MULTILINE)
+# Default image tokens per packed request, about five pages at the model's resolution.
+DEFAULT_PACK_TOKENS = 4000
+# Completion tokens asked for per page, as for single pages, capped at what the
+# models accept for `max_tokens`.
+PAGE_OUTPUT_TOKENS = 2000
+MAX_OUTPUT_TOKENS = 4096
+
+PACKING_INSTRUCTIONS = """The {count} images are consecutive pages, in order: pages {pages}. Apply the system instructions to every page. Put the LaTeX of all pages in a single ```latex block, and start the part of each page with its marker on a line of its own, even if the page is blank. The markers are:
+{markers}"""
+
+
+def packing_prompt(prompt: str, pages: List[int]) -> List[str]:
+    """
+    Returns the text parts of a packed request: the prompt, unchanged so it stays a
+    cacheable prefix, then the page marker instructions.
+    """
+    return [prompt, PACKING_INSTRUCTIONS.format(
+        count=len(pages), pages=", ".join(map(str, pages)),
+        markers="\n".join(PAGE_MARKER.format(page=page) for page in pages))]
+
+
+def packed_max_tokens(pages: int) -> int:
+    return min(PAGE_OUTPUT_TOKENS * pages, MAX_OUTPUT_TOKENS)
+
+
+def pack_pages(items: Iterable[Tuple[int, str]], max_pages: int, max_tokens: int = DEFAULT_PACK_TOKENS) -> Iterator[List[Tuple[int, str]]]:
+    """
+    Groups consecutive (page, image path) pairs into packs for one request each.
+
+    A pack holds at most `max_pages` pages whose image tokens, from
+    `count_image_tokens`, add up to at most `max_tokens`. A page over the budget on
+    its own goes alone. Items are pulled lazily, so rendering can run ahead.
+
+    Yields:
+        List[Tuple[int, str]]: The pages of a pack, in order.
+    """
+    pack = []
+    tokens = 0
+    for page, image_path in items:
+        # Without packing, nothing needs counting.
+        try:
+            page_tokens = count_image_tokens(image_path) if max_pages > 1 else 0
+        except OSError:
+            # Unreadable, so it goes alone and fails on its own.
+            page_tokens = max_tokens + 1
+        if pack and (len(pack) >= max_pages or tokens + page_tokens > max_tokens):
+            yield pack
+            pack, tokens = [], 0
+        pack.append((page, image_path))
+        tokens += page_tokens
+    if pack:
+        yield pack
+
+
+def split_pages(text: str, pages: List[int]) -> Dict[int, str]:
+    """
+    Splits the LaTeX of a packed response into the parts of each page.
+
+    Args:
+        text (str): The LaTeX, with a marker line before each page.
+        pages (List[int]): The pages that were sent.
+
+    Returns:
+        Dict[int, str]: The LaTeX of each page found. Pages whose marker is missing,
+        or that are not in `pages`, are left out; if a marker appears twice, the
+        first part is kept.
+    """
+    parts = {}
+    matches = list(PAGE_MARKER_PATTERN.finditer(text))
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        page = int(match.group(1))
+        end = next_match.start() if next_match is not None else len(text)
+        if page in pages and page not in parts:
+            parts[page] = "\n" + text[match.end():end].strip("\n") + "\n"
+    return parts
@@ -0,0 +1,128 @@
+import base64
+import json
+import re
+import time
+from typing import Iterator
+
+from .imagemeta import detect_mime_type, probe_image
+
+
+# Multiple of 3, so every chunk encodes to base64 without padding.
+CHUNK_SIZE = 3 * 64 * 1024
+MARKER = "@@vbimagetotext-image-"
+
+
+class ImageData:
+    """
+    An image to be embedded in a request as a base64 data URL.
+
+    The image is only read and encoded while the request body is being sent, one
+    chunk at a time, so the full base64 string never exists in memory.
+    """
+
+    def __init__(self, path: str = None, data: bytes = None, mime_type: str = None):
+        if (path is None) == (data is None):
+            raise ValueError("ImageData needs exactly one of path or data")
+        self.path = path
+        self.data = data
+        if data is not None:
+            self._size = len(data)
+            if mime_type is None:
+                mime_type = detect_mime_type(data[:12])
+        else:
+            info = probe_image(path)
+            self._size = info.size
+            if mime_type is None:
+                mime_type = info.mime_type
+        self.mime_type = mime_type
+
+    def size(self) -> int:
+        """
+        Returns the size of the raw image in bytes.
+        """
+        return self._size
+
+    def url_prefix(self) -> bytes:
+        return f"data:{self.mime_type};base64,".encode("ascii")
+
+    def url_length(self) -> int:
+        """
+        Returns the length of the data URL without building it.
+        """
+        return len(self.url_prefix()) + 4 * ((self.size() + 2) // 3)
+
+    def iter_url(self) -> Iterator[bytes]:
+        """
+        Yields the data URL in chunks.
+        """
+        yield self.url_prefix()
+        if self.data is not None:
+            for start in range(0, len(self.data), CHUNK_SIZE):
+                yield base64.b64encode(self.data[start:start + CHUNK_SIZE])
+        else:
+            with open(self.path, "rb") as image_file:
+                for chunk in iter(lambda: image_file.read(CHUNK_SIZE), b""):
+                    yield base64.b64encode(chunk)
+
+
+class StreamingBody:
+    """
+    File-like JSON request body that encodes its images while it is being read.
+
+    Any `ImageData` inside the payload is serialized as its data URL. The length is
+    known up front, so requests sends a regular Content-Length body. The seconds
+    spent producing chunks, i.e. reading and encoding images, add up in `encode_seconds`.
+    """
+
+    def __init__(self, payload: dict):
+        images = []
+
+        def default(obj):
+            if isinstance(obj, ImageData):
+                images.append(obj)
+                return f"{MARKER}{len(images) - 1}"
+            raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+        text = json.dumps(payload, default=default)
+        parts = re.split(f"{MARKER}(\\d+)", text)
+        # Literal JSON at even indexes, image numbers at odd indexes.
+        self._segments = [
+            images[int(part)] if index % 2 else part.encode("utf-8")
+            for index, part in enumerate(parts)
+        ]
+        self._length = sum(
+            segment.url_length() if isinstance(segment, ImageData) else len(segment)
+            for segment in self._segments
+        )
+        self._chunks = self._iter_chunks()
+        self._chunk = b""
+        self._offset = 0
+        self.encode_seconds = 0.0
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        for segment in self._segments:
+            if isinstance(segment, ImageData):
+                yield from segment.iter_url()
+            elif segment:
+                yield segment
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        parts = []
+        while size > 0:
+            if self._offset >= len(self._chunk):
+                start = time.perf_counter()
+                self._chunk = next(self._chunks, b"")
+                self.encode_seconds += time.perf_counter() - start
+                self._offset = 0
+                if not self._chunk:
+                    break
+            part = self._chunk[self._offset:self._offset + size]
+            self._offset += len(part)
+            size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
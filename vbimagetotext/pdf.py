@@ -0,0 +1,146 @@
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+from typing import Iterator, List, Tuple
+
+from rich.console import Console
+
+
+# Default number of pages rendered ahead of the API calls.
+DEFAULT_PREFETCH = 4
+# The model works on images whose long side is at most this many pixels, see
+# `token_cost_calculations.resize`, so rendering any finer only costs time.
+TARGET_LONG_SIDE = 1024
+
+
+def is_pdf(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() == ".pdf"
+
+
+def load_pdfium():
+    """
+    Imports pypdfium2, which is only needed for PDF input.
+    """
+    try:
+        import pypdfium2
+    except ImportError:
+        Console().print(
+            "PDF input needs pypdfium2, install the `pdf` extra with `pip install 'vbimagetotext[pdf]'`.",
+            style="bold red", markup=False)
+        sys.exit(1)
+    return pypdfium2
+
+
+def pdf_page_count(path: str) -> int:
+    pdfium = load_pdfium()
+    document = pdfium.PdfDocument(path)
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+
+def render_scale(width_pt: float, height_pt: float, dpi: float = None) -> float:
+    """
+    Returns the scale from PDF points to pixels for rendering a page.
+
+    Args:
+        width_pt (float): Width of the page in points (1/72 inch).
+        height_pt (float): Height of the page in points.
+        dpi (float, optional): Fixed resolution. By default the page is rendered at the
+            resolution the model downscales images to.
+    """
+    if dpi is not None:
+        return dpi / 72
+    return TARGET_LONG_SIDE / max(width_pt, height_pt)
+
+
+class PdfPages:
+    """
+    Renders pages of a PDF to PNG files on demand, in a background thread.
+
+    At most `prefetch` rendered pages wait for the consumer, so rendering overlaps
+    with the API calls in flight while memory and disk use stay flat however long
+    the document is. Each page is written to a temporary directory that is removed
+    on `close`; consumers may delete a page file as soon as they are done with it.
+
+    Usage:
+        with PdfPages("book.pdf", range(1, 101)) as pages:
+            for page, image_path in pages:
+                ...
+    """
+
+    def __init__(self, path: str, pages: List[int], prefetch: int = DEFAULT_PREFETCH, dpi: float = None):
+        self.pdfium = load_pdfium()
+        self.path = path
+        self.pages = list(pages)
+        self.dpi = dpi
+        self.stem = os.path.splitext(os.path.basename(path))[0]
+        self.directory = tempfile.mkdtemp(prefix="vbimagetotext-pdf-")
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._render_all, daemon=True)
+        self.thread.start()
+
+    def _put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _render_all(self) -> None:
+        document = None
+        try:
+            # pdfium is not thread-safe, so the document only ever lives in this thread.
+            document = self.pdfium.PdfDocument(self.path)
+            for page in self.pages:
+                if not self._put((page, self._render(document, page))):
+                    return
+            self._put(None)
+        except Exception as e:
+            # Raised again in the consumer.
+            self._put(e)
+        finally:
+            if document is not None:
+                document.close()
+
+    def _render(self, document, page: int) -> str:
+        pdf_page = document[page - 1]
+        try:
+            width, height = pdf_page.get_size()
+            bitmap = pdf_page.render(scale=render_scale(width, height, self.dpi))
+            try:
+                image = bitmap.to_pil()
+                image_path = os.path.join(self.directory, f"{self.stem}_{page}.png")
+                image.save(image_path, "PNG")
+                return image_path
+            finally:
+                bitmap.close()
+        finally:
+            pdf_page.close()
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self) -> None:
+        self.stop.set()
+        self.thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "PdfPages":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
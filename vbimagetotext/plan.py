@@ -0,0 +1,179 @@
+import click
+import os
+import sys
+
+from rich.console import Console
+
+from .imagemeta import MetadataStore, find_images
+from .metrics import format_duration, percentile
+from .prompts import switch_prompt
+from .response_cache import DEFAULT_CACHE_DIR
+from .token_cost_calculations import count_text_tokens, exact_text_tokens, image_tokens, model_pricing, tokens_cost
+from .choice_option import ChoiceOption
+
+
+def requests_per_minute(concurrency: int, latency: float, rpm: float, tpm: float, tokens_per_request: float) -> float:
+    """
+    Returns the sustained request rate, the lowest of what the workers, the request
+    limit and the token limit allow.
+    """
+    rates = [concurrency * 60 / latency]
+    if rpm:
+        rates.append(rpm)
+    if tpm and tokens_per_request:
+        rates.append(tpm / tokens_per_request)
+    return min(rates)
+
+
+@click.command(
+    help="Estimate the tokens, cost and time of converting a book, without calling the API."
+)
+@click.option(
+    "-i",
+    "--images",
+    required=True,
+    help="Directory of page images, a glob pattern, or a sample page like 'book/page_1.png' with --ranges",
+)
+@click.option(
+    '-r',
+    '--ranges',
+    nargs=2,
+    default=None,
+    type=click.Tuple([int, int]),
+    help="Range of pages, when --images is a sample page as for gptloop",
+)
+@click.option(
+    "-p",
+    "--prompt",
+    cls=ChoiceOption,
+    type=click.Choice(
+        [
+            "assertion_reason",
+            "mcq",
+            "mcq_list",
+            "mcq_solution",
+            "subjective",
+            "subjective_list",
+            "match",
+            "comprehension",
+            "answer",
+            "subjective_irodov",
+            "solution_irodov",
+        ],
+        case_sensitive=False),
+    prompt=True,
+    default=2,
+    show_default=True,
+    help="Prompt to estimate for",
+)
+@click.option(
+    "-m",
+    "--model",
+    cls=ChoiceOption,
+    type=click.Choice(
+        [
+            "gpt-4o",
+            "gpt-4o-2024-08-06",
+            "gpt-4-turbo",
+            "gpt-4o-mini",
+        ],
+        case_sensitive=False),
+    prompt=True,
+    default=1,
+    show_default=True,
+    help="Model to estimate for",
+)
+@click.option(
+    "--output-tokens",
+    type=click.IntRange(min=0),
+    default=500,
+    show_default=True,
+    help="Expected output tokens per page",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of pages sent at the same time",
+)
+@click.option(
+    "--latency",
+    type=click.FloatRange(min=0, min_open=True),
+    default=15.0,
+    show_default=True,
+    help="Assumed seconds per request",
+)
+@click.option(
+    "--rpm",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Requests per minute limit of the account",
+)
+@click.option(
+    "--tpm",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Tokens per minute limit of the account",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=32,
+    show_default=True,
+    help="Number of files probed at the same time",
+)
+def plan(images, ranges, prompt, model, output_tokens, concurrency, latency, rpm, tpm, workers):
+    """
+    Estimate the tokens, cost and time of converting a book, without calling the API.
+
+    Only the image headers are read, in parallel, and their dimensions are kept in
+    `imagemeta.json` in the cache directory, so planning the same book again is
+    almost instant.
+    """
+    console = Console()
+    if ranges is not None:
+        # Imported here, gptloop pulls in every backend, which only --ranges needs.
+        from .gptloop import page_image_path
+
+        paths = [page_image_path(images, page) for page in range(ranges[0], ranges[1] + 1)]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            console.print(f"Warning: {len(missing)} pages not found, e.g. {missing[0]}", style="bold red")
+            paths = [path for path in paths if os.path.exists(path)]
+    else:
+        paths = find_images(images)
+    if not paths:
+        console.print(f"Error: No images found for {images}.", style="bold red")
+        sys.exit(1)
+
+    store = MetadataStore(os.path.join(DEFAULT_CACHE_DIR, "imagemeta.json"))
+    infos = store.probe_many(paths, workers)
+    store.save()
+
+    prompt_tokens = count_text_tokens(switch_prompt(prompt), model)
+    page_tokens = sorted(image_tokens(info.width, info.height) for info in infos)
+    pages = len(page_tokens)
+    total_image_tokens = sum(page_tokens)
+    total_input_tokens = total_image_tokens + pages * prompt_tokens
+    total_output_tokens = pages * output_tokens
+
+    input_price, output_price = model_pricing(model)
+    input_cost = tokens_cost(total_input_tokens, input_price)
+    output_cost = tokens_cost(total_output_tokens, output_price)
+
+    tokens_per_request = (total_input_tokens + total_output_tokens) / pages
+    rate = requests_per_minute(concurrency, latency, rpm, tpm, tokens_per_request)
+    minutes = pages / rate
+
+    console.print(f"{pages} pages, {model}, prompt '{prompt}'", style="deep_pink3")
+    print(f"Image tokens per page: min {page_tokens[0]}, p50 {percentile(page_tokens, 0.5)}, "
+          f"p95 {percentile(page_tokens, 0.95)}, max {page_tokens[-1]}")
+    estimated = "" if exact_text_tokens(model) else " (estimated, install the `tokens` extra for exact counts)"
+    print(f"Prompt tokens per page: {prompt_tokens}{estimated}")
+    print(f"Output tokens per page: {output_tokens} (assumed)")
+    print(f"Input tokens: {total_input_tokens}, output tokens: {total_output_tokens}")
+    print(f"Cost: input ₹{input_cost:.2f}, output ₹{output_cost:.2f}")
+    print(f"Time at {rate:.1f} requests per minute: {format_duration(minutes * 60)}")
+    print(f'\n\tTotal cost: {input_cost + output_cost:.2f}\n')
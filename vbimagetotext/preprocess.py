@@ -0,0 +1,162 @@
+import io
+from dataclasses import dataclass
+from typing import List
+
+import click
+
+from .crop import choose_regions
+from .token_cost_calculations import resize
+
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "PNG": "image/png",
+}
+
+
+@dataclass(frozen=True)
+class Preprocessing:
+    """
+    Settings for shrinking an image before it is uploaded.
+
+    The image is downscaled to the resolution the model works at (see
+    `token_cost_calculations.resize`), so the token count does not change.
+    With `crop`, the margins are trimmed (`trim`) or the page is split into
+    per-question crops (`questions`), which does reduce the tokens.
+    """
+    grayscale: bool = False
+    format: str = "JPEG"
+    quality: int = 85
+    downscale: bool = True
+    crop: str = "none"
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+
+def encode_image(img, preprocessing: Preprocessing) -> bytes:
+    """
+    Downscales and re-encodes a decoded image for upload.
+    """
+    from PIL import Image
+
+    if preprocessing.downscale:
+        size = resize(*img.size)
+        if size != img.size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+
+    if preprocessing.grayscale:
+        img = img.convert("L")
+    elif preprocessing.format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA")
+
+    buffer = io.BytesIO()
+    if preprocessing.format == "PNG":
+        img.save(buffer, format="PNG", optimize=True)
+    else:
+        img.save(buffer, format=preprocessing.format, quality=preprocessing.quality)
+    return buffer.getvalue()
+
+
+def preprocess_image(image_path: str, preprocessing: Preprocessing) -> bytes:
+    """
+    Downscales and re-encodes an image for upload.
+
+    Args:
+        image_path (str): The path to the image file.
+        preprocessing (Preprocessing): How to convert the image.
+
+    Returns:
+        bytes: The re-encoded image.
+    """
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        if preprocessing.downscale:
+            # Let the JPEG decoder skip detail we are about to throw away.
+            img.draft("L" if preprocessing.grayscale else "RGB", resize(*img.size))
+        return encode_image(img, preprocessing)
+
+
+def preprocess_regions(image_path: str, preprocessing: Preprocessing) -> List[bytes]:
+    """
+    Crops an image as set by `preprocessing.crop`, then downscales and re-encodes
+    every region for upload.
+
+    Args:
+        image_path (str): The path to the image file.
+        preprocessing (Preprocessing): How to convert the image.
+
+    Returns:
+        List[bytes]: The re-encoded regions, a single image when `crop` is `none`.
+    """
+    if preprocessing.crop == "none":
+        return [preprocess_image(image_path, preprocessing)]
+
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        # Decoded at full resolution: a crop keeps more detail than the whole page.
+        img.load()
+        return [encode_image(img.crop(box), preprocessing) for box in choose_regions(img, preprocessing.crop)]
+
+
+def make_preprocessing(downscale: bool, grayscale: bool, image_format: str, quality: int, crop: str = "none") -> Preprocessing:
+    """
+    Builds the preprocessing settings from the command line options.
+
+    Returns:
+        Preprocessing: The settings, or None when neither downscaling nor cropping is enabled.
+    """
+    if not downscale and crop == "none":
+        return None
+    return Preprocessing(
+        grayscale=grayscale, format=image_format.upper(), quality=quality, downscale=downscale, crop=crop)
+
+
+def preprocessing_options(command):
+    """
+    Adds the `--downscale`, `--grayscale`, `--image-format`, `--quality` and `--crop`
+    options to a click command.
+    """
+    options = [
+        click.option(
+            "--downscale/--no-downscale",
+            default=False,
+            show_default=True,
+            help="Downscale and re-encode images to the resolution the model uses before upload.",
+        ),
+        click.option(
+            "--grayscale",
+            is_flag=True,
+            help="Convert images to grayscale when downscaling.",
+        ),
+        click.option(
+            "--image-format",
+            type=click.Choice(["jpeg", "webp", "png"], case_sensitive=False),
+            default="jpeg",
+            show_default=True,
+            help="Format to re-encode images in when downscaling.",
+        ),
+        click.option(
+            "--quality",
+            type=click.IntRange(1, 100),
+            default=85,
+            show_default=True,
+            help="JPEG/WebP quality to re-encode images with when downscaling.",
+        ),
+        click.option(
+            "--crop",
+            type=click.Choice(["none", "trim", "questions"], case_sensitive=False),
+            default="none",
+            show_default=True,
+            help="Trim the margins of pages, or split them into per-question crops when that takes fewer image tokens.",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
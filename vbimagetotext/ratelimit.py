@@ -0,0 +1,375 @@
+import email.utils
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+import click
+import requests
+
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+T = TypeVar("T")
+
+
+class APIError(Exception):
+    """
+    Raised when an API request fails for good, after any retries.
+    """
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parses the durations used in `x-ratelimit-reset-*` headers, like `1s`, `6m0s` or
+    `20ms`, and days like `7d`.
+
+    Returns:
+        float: The duration in seconds, or None if it cannot be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|d|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"d": 86400, "h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Reads how long the server asked us to wait from `retry-after-ms` or `Retry-After`.
+    """
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `capacity` per minute.
+
+    A capacity of None means no limit until the server reports one through the
+    `x-ratelimit-limit-*` headers.
+    """
+
+    def __init__(self, capacity: float = None):
+        self.capacity = capacity
+        self.tokens = capacity or 0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def acquire(self, amount: float = 1) -> None:
+        """
+        Blocks until `amount` tokens are available and takes them.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.capacity is None:
+                    return
+                else:
+                    # A request larger than the bucket goes through once the bucket is full.
+                    amount = min(amount, self.capacity)
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return
+                    wait = (amount - self.tokens) * 60 / self.capacity
+            time.sleep(wait)
+
+    def update(self, limit: Optional[float], remaining: Optional[float], reset: Optional[float]) -> None:
+        """
+        Adapts the bucket to the limit and remaining quota reported by the server.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if limit is not None and self.capacity is None:
+                self.capacity = limit
+                self.tokens = limit if remaining is None else remaining
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds back every caller for the given number of seconds.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Limits both requests per minute and tokens per minute.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens: float = 0) -> None:
+        self.requests.acquire(1)
+        if tokens:
+            self.tokens.acquire(tokens)
+
+    def update(self, headers) -> None:
+        """
+        Reads the `x-ratelimit-*` headers of a response.
+        """
+        def number(name):
+            try:
+                return float(headers[name])
+            except (KeyError, TypeError, ValueError):
+                return None
+
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            bucket.update(
+                number(f"x-ratelimit-limit-{kind}"),
+                number(f"x-ratelimit-remaining-{kind}"),
+                parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+            )
+
+    def pause(self, seconds: float) -> None:
+        self.requests.pause(seconds)
+
+
+class RetryBudget:
+    """
+    Caps the total number of retries over a whole run.
+    """
+
+    def __init__(self, max_retries: int = None):
+        self.max_retries = max_retries
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            if self.max_retries is not None and self.used >= self.max_retries:
+                return False
+            self.used += 1
+            return True
+
+
+class RequestExecutor:
+    """
+    Sends requests through a rate limiter, retrying failures with exponential backoff.
+
+    Retries honour `Retry-After` and the `x-ratelimit-*` headers, and otherwise wait a
+    random time up to `base_delay * 2 ** attempt` (full jitter), capped at `max_delay`.
+    """
+
+    def __init__(self, limiter: RateLimiter = None, budget: RetryBudget = None, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.limiter = limiter or RateLimiter()
+        self.budget = budget or RetryBudget()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def execute(self, send: Callable[[], requests.Response], tokens: float = 0) -> requests.Response:
+        """
+        Calls `send` until it returns a response that should not be retried.
+
+        Args:
+            send (Callable[[], requests.Response]): Sends the request. Called once per attempt.
+            tokens (float, optional): Estimated tokens of the request, for the tokens per minute limit.
+
+        Returns:
+            requests.Response: The last response. Its status code may still be an error.
+
+        Raises:
+            APIError: If the request could not be sent at all.
+        """
+        for attempt in range(self.max_attempts):
+            self.limiter.acquire(tokens)
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt + 1 < self.max_attempts and self.budget.take():
+                    time.sleep(self.backoff(attempt))
+                    continue
+                raise APIError(f"API request failed: {e}") from e
+
+            self.limiter.update(response.headers)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+            if attempt + 1 == self.max_attempts or not self.budget.take():
+                return response
+
+            delay = parse_retry_after(response.headers)
+            if delay is None and response.status_code == 429:
+                delay = max(filter(None, [
+                    parse_duration(response.headers.get("x-ratelimit-reset-requests")),
+                    parse_duration(response.headers.get("x-ratelimit-reset-tokens")),
+                ]), default=None)
+            if delay is None:
+                delay = self.backoff(attempt)
+            else:
+                delay = min(self.max_delay, delay) + random.uniform(0, self.base_delay / 4)
+            if response.status_code == 429:
+                self.limiter.pause(delay)
+            response.close()
+            time.sleep(delay)
+        return response
+
+    def call(self, fn: Callable[[], T], tokens: float = 0, retryable: Callable[[Exception], bool] = None) -> T:
+        """
+        Calls `fn` through the rate limiter, for client libraries that raise on errors
+        instead of returning a response.
+
+        Args:
+            fn (Callable[[], T]): Makes the request. Called once per attempt.
+            tokens (float, optional): Estimated tokens of the request, for the tokens per minute limit.
+            retryable (Callable[[Exception], bool], optional): Tells whether an error is
+                worth retrying. Nothing is retried if not given.
+
+        Returns:
+            T: What `fn` returned.
+
+        Raises:
+            APIError: If the last attempt failed.
+        """
+        for attempt in range(self.max_attempts):
+            self.limiter.acquire(tokens)
+            try:
+                return fn()
+            except APIError:
+                raise
+            except Exception as e:
+                status_code = getattr(e, "code", None)
+                if retryable is None or not retryable(e) or attempt + 1 == self.max_attempts or not self.budget.take():
+                    raise APIError(f"API request failed: {e}", status_code if isinstance(status_code, int) else None) from e
+                delay = self.backoff(attempt)
+                if status_code == 429:
+                    self.limiter.pause(delay)
+                time.sleep(delay)
+
+
+def _env(name: str, convert: Callable):
+    value = os.getenv(name)
+    return convert(value) if value else None
+
+
+def env_limits() -> tuple:
+    """
+    Returns the requests per minute, tokens per minute and retries set with
+    `VBIMAGETOTEXT_RPM`, `VBIMAGETOTEXT_TPM` and `VBIMAGETOTEXT_MAX_RETRIES`, None for unset.
+    """
+    return _env("VBIMAGETOTEXT_RPM", float), _env("VBIMAGETOTEXT_TPM", float), _env("VBIMAGETOTEXT_MAX_RETRIES", int)
+
+
+def resolve_limits(requests_per_minute: float = None, tokens_per_minute: float = None, max_retries: int = None) -> tuple:
+    """
+    Returns the given limits, with those not given taken from the environment.
+    """
+    env_rpm, env_tpm, env_retries = env_limits()
+    return (
+        requests_per_minute if requests_per_minute is not None else env_rpm,
+        tokens_per_minute if tokens_per_minute is not None else env_tpm,
+        max_retries if max_retries is not None else env_retries,
+    )
+
+
+def make_executor(requests_per_minute: float = None, tokens_per_minute: float = None, max_retries: int = None) -> RequestExecutor:
+    """
+    Creates an executor with the given limits, taking those not given from the environment.
+    """
+    requests_per_minute, tokens_per_minute, max_retries = resolve_limits(requests_per_minute, tokens_per_minute, max_retries)
+    return RequestExecutor(RateLimiter(requests_per_minute, tokens_per_minute), RetryBudget(max_retries))
+
+
+_executor = make_executor()
+
+
+def configure_limits(requests_per_minute: float = None, tokens_per_minute: float = None, max_retries: int = None) -> None:
+    """
+    Replaces the limits of the shared executor for this run.
+
+    Limits that are not given are taken from the environment, see `env_limits`. The
+    retry budget starts over, but the rate limiter, with what it learned from the API
+    headers, is kept if its limits did not change, e.g. between the runs of the
+    `serve` daemon.
+
+    Args:
+        requests_per_minute (float, optional): Requests per minute, None to learn it from the API.
+        tokens_per_minute (float, optional): Tokens per minute, None to learn it from the API.
+        max_retries (int, optional): Total number of retries allowed in this run, None for no cap.
+    """
+    global _executor
+    requests_per_minute, tokens_per_minute, max_retries = resolve_limits(requests_per_minute, tokens_per_minute, max_retries)
+    limiter = _executor.limiter
+    if (limiter.requests_per_minute, limiter.tokens_per_minute) != (requests_per_minute, tokens_per_minute):
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    _executor = RequestExecutor(limiter, RetryBudget(max_retries))
+
+
+def get_executor() -> RequestExecutor:
+    return _executor
+
+
+def rate_limit_options(command):
+    """
+    Adds the `--rpm`, `--tpm` and `--max-retries` options to a click command.
+    """
+    options = [
+        click.option(
+            "--rpm",
+            type=click.FloatRange(min=0, min_open=True),
+            default=None,
+            help="Requests per minute to stay under. Learned from the API headers if not set.",
+        ),
+        click.option(
+            "--tpm",
+            type=click.FloatRange(min=0, min_open=True),
+            default=None,
+            help="Tokens per minute to stay under. Learned from the API headers if not set.",
+        ),
+        click.option(
+            "--max-retries",
+            type=click.IntRange(min=0),
+            default=None,
+            help="Total number of retries allowed over the whole run.",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
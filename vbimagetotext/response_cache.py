@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "VBIMAGETOTEXT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "vbimagetotext"),
+)
+DEFAULT_MAX_SIZE_MB = float(os.getenv("VBIMAGETOTEXT_CACHE_SIZE_MB", "500"))
+
+
+def cache_key(image_names: List[str], prompt: Union[str, List[str]], model: str, max_tokens: int, preprocessing=None) -> str:
+    """
+    Computes the content address of a request.
+
+    Args:
+        image_names (List[str]): List of image file names.
+        prompt (Union[str, List[str]]): The resolved prompt text, or several text parts.
+        model (str): The model name.
+        max_tokens (int): Maximum number of tokens to generate.
+        preprocessing (Preprocessing, optional): How the images are converted before upload.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    digest = hashlib.sha256()
+    for image_name in image_names:
+        with open(image_name, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    digest.update((prompt if isinstance(prompt, str) else "\0".join(prompt)).encode("utf-8"))
+    digest.update(f"\0{model}\0{max_tokens}".encode("utf-8"))
+    if preprocessing is not None:
+        digest.update(f"\0{preprocessing!r}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of API responses with size-based LRU eviction.
+
+    Each entry is a small JSON file named after its key. Reading an entry bumps its
+    mtime, so the least recently used entries are the first to be pruned.
+    """
+
+    def __init__(self, directory: str = None, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        self.directory = os.path.join(directory or DEFAULT_CACHE_DIR, "responses")
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self) -> List[Tuple[str, os.stat_result]]:
+        """
+        Returns the path and stat of every entry. Entries removed meanwhile, e.g. by
+        a concurrent prune, are left out.
+        """
+        entries = []
+        try:
+            buckets = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return entries
+        for bucket in buckets:
+            try:
+                if not bucket.is_dir():
+                    continue
+                files = [e for e in os.scandir(bucket.path) if e.name.endswith(".json")]
+            except FileNotFoundError:
+                continue
+            for entry in files:
+                try:
+                    entries.append((entry.path, entry.stat()))
+                except FileNotFoundError:
+                    pass
+        return entries
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached message for the key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as file:
+                message = json.load(file)["message"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Pruned since it was read, the message is still good.
+            pass
+        return message
+
+    def put(self, key: str, message: str, **metadata) -> None:
+        """
+        Stores a message under the key and evicts old entries if the cache is full.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"message": message, "created": time.time(), **metadata})
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for _, stat in self._entries())
+            else:
+                self._size += len(data)
+            over_limit = self._size > self.max_size
+        if over_limit:
+            self.prune()
+
+    def stats(self) -> dict:
+        """
+        Returns the number of entries, their total size and the oldest/newest access time.
+        """
+        stats = [stat for _, stat in self._entries()]
+        return {
+            "directory": self.directory,
+            "entries": len(stats),
+            "size": sum(s.st_size for s in stats),
+            "max_size": self.max_size,
+            "oldest": min((s.st_mtime for s in stats), default=None),
+            "newest": max((s.st_mtime for s in stats), default=None),
+        }
+
+    def prune(self, max_size: int = None) -> int:
+        """
+        Deletes least recently used entries until the cache fits in max_size bytes.
+
+        Args:
+            max_size (int, optional): Size limit in bytes. Defaults to the cache limit.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        limit = self.max_size if max_size is None else max_size
+        entries = sorted((stat.st_mtime, stat.st_size, path) for path, stat in self._entries())
+        size = sum(s for _, s, _ in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                # Already removed by a concurrent prune.
+                pass
+            size -= entry_size
+        with self._lock:
+            self._size = size
+        return removed
@@ -1,6 +1,7 @@
 import click
 from .functions import process_text
-import os
+from .backends import require_api_key
+from .ratelimit import APIError
 from .prompts import prompt_solution
 from rich.console import Console
 import sys
@@ -27,6 +28,9 @@ from .choice_option import ChoiceOption
             "gpt-4-turbo",
             "gpt-4-turbo-preview",
             "gpt-4-vision-preview",
+            "gemini-1.5-flash",
+            "gemini-1.5-pro",
+            "mock",
         ],
         case_sensitive=False),
     prompt=True,
@@ -49,15 +53,28 @@ from .choice_option import ChoiceOption
     show_default=True,
     help="Prompt to use for the completion",
 )
-def solution(text, model, max_tokens, prompt):
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Print the response and write it to the output file as it arrives.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="File to stream the response to. Defaults to the text file name with a _solution.tex suffix.",
+)
+def solution(text, model, max_tokens, prompt, stream, output):
     """
     Process text using OpenAI's GPT-4 model to solve problem.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if api_key is None:
+    api_key = require_api_key(model)
+
+    try:
+        process_text(text, prompt, model, api_key, max_tokens,
+                     stream=stream, output=output)
+    except APIError as e:
         console = Console()
-        console.print(
-            "OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.", style="bold red")
+        console.print(f"Error: {e}", style="bold red")
         sys.exit(1)
-
-    process_text(text, prompt, model, api_key, max_tokens)
@@ -0,0 +1,174 @@
+import click
+import sys
+import time
+from typing import Dict, List
+
+from rich.console import Console
+
+from .metrics import format_duration, percentile
+from .ratelimit import parse_duration
+from .telemetry import DEFAULT_TELEMETRY_PATH, TelemetryLog
+
+
+# Phases in the order a request goes through them.
+PHASES = ["cache", "prepare", "encode", "connect", "ttfb", "first_token", "total", "postprocess"]
+
+
+def parse_span(value: str, name: str) -> float:
+    seconds = parse_duration(value)
+    if not seconds:
+        raise click.BadParameter(f"expected a duration like 30m, 24h or 7d, got {value!r}", param_hint=name)
+    return seconds
+
+
+def summarize(records: List[dict]) -> Dict[str, float]:
+    """
+    Summarizes a group of telemetry records.
+
+    Latency percentiles only count requests that went to the API and succeeded.
+    Throughput is measured over the span the requests were active, from the first
+    start to the last finish, so an idle tail of a window does not dilute it.
+
+    Returns:
+        Dict[str, float]: Counts, latency percentiles in seconds, throughput and cost.
+    """
+    sent = [r for r in records if r.get("status") == "ok" and r.get("cache") in ("miss", "off")]
+    latencies = sorted(r["phases"]["total"] for r in sent if "total" in r.get("phases", {}))
+    ttfbs = sorted(r["phases"]["ttfb"] for r in sent if "ttfb" in r.get("phases", {}))
+    start = min(r["time"] for r in records)
+    end = max(r["time"] + r.get("phases", {}).get("total", 0) for r in records)
+    span = max(end - start, 1.0)
+    return {
+        "requests": len(records),
+        "cached": sum(1 for r in records if r.get("cache") in ("hit", "dedup")),
+        "failed": sum(1 for r in records if r.get("status") == "error"),
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "ttfb_p50": percentile(ttfbs, 0.5),
+        "requests_per_minute": len(records) * 60 / span,
+        "output_tokens_per_second": sum(r.get("output_tokens", 0) for r in sent) / span,
+        "cost": sum(r.get("cost", 0) for r in records),
+    }
+
+
+def prompt_caching(records: List[dict]) -> Dict[str, dict]:
+    """
+    Compares, per prompt, the requests that read part of their prompt from the
+    provider's prompt cache with those that did not.
+
+    Only requests that went to the API, succeeded and reported their usage count.
+
+    Returns:
+        Dict[str, dict]: Per prompt key, the requests, those with cached tokens, the
+        share of input tokens that were cached, the median latency with and without
+        cached tokens (None if there were no such requests) and the rupees saved.
+    """
+    groups = {}
+    for r in records:
+        if r.get("status") == "ok" and r.get("cache") in ("miss", "off") and r.get("tokens_exact"):
+            groups.setdefault(r.get("prompt", "unknown"), []).append(r)
+    rows = {}
+    for key, group in groups.items():
+        latencies = {True: [], False: []}
+        for r in group:
+            if "total" in r.get("phases", {}):
+                latencies[bool(r.get("cached_tokens"))].append(r["phases"]["total"])
+        input_tokens = sum(r.get("input_tokens", 0) for r in group)
+        rows[key] = {
+            "requests": len(group),
+            "cached_requests": sum(1 for r in group if r.get("cached_tokens")),
+            "cached_share": sum(r.get("cached_tokens", 0) for r in group) / input_tokens if input_tokens else 0.0,
+            "p50_cached": percentile(sorted(latencies[True]), 0.5) if latencies[True] else None,
+            "p50_uncached": percentile(sorted(latencies[False]), 0.5) if latencies[False] else None,
+            "savings": sum(r.get("cache_savings", 0) for r in group),
+        }
+    return rows
+
+
+def format_prompt_caching(key: str, row: dict) -> str:
+    line = (f"  {key}: {row['requests']} requests, {row['cached_requests']} with cached tokens "
+            f"({row['cached_share']:.0%} of input tokens), saved ₹{row['savings']:.2f}")
+    if row["p50_cached"] is not None and row["p50_uncached"] is not None:
+        line += (f", latency p50 {row['p50_cached']:.2f}s cached vs {row['p50_uncached']:.2f}s not "
+                 f"({row['p50_cached'] - row['p50_uncached']:+.2f}s)")
+    return line
+
+
+def format_summary(summary: Dict[str, float]) -> str:
+    return (f"{summary['requests']:>5} requests ({summary['cached']} cached, {summary['failed']} failed)  "
+            f"latency p50 {summary['p50']:.2f}s p95 {summary['p95']:.2f}s p99 {summary['p99']:.2f}s  "
+            f"ttfb p50 {summary['ttfb_p50']:.2f}s  {summary['requests_per_minute']:.1f} req/min  "
+            f"{summary['output_tokens_per_second']:.1f} tok/s  ₹{summary['cost']:.2f}")
+
+
+@click.command(
+    help="Summarize the latency, throughput and cost of past requests from the telemetry log."
+)
+@click.option(
+    "--since",
+    default="24h",
+    show_default=True,
+    help="Only requests from this long ago, e.g. 30m, 24h or 7d, or 'all'.",
+)
+@click.option(
+    "-w",
+    "--window",
+    default="1h",
+    show_default=True,
+    help="Length of the time windows the requests are grouped into, e.g. 5m, 1h or 1d.",
+)
+@click.option(
+    "-m",
+    "--model",
+    default=None,
+    help="Only requests answered by this model.",
+)
+@click.option(
+    "--path",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_TELEMETRY_PATH,
+    help="The telemetry log.  [default: telemetry.jsonl in the cache directory]",
+)
+def stats(since, window, model, path):
+    """
+    Summarizes the telemetry log.
+
+    Prints a line per time window with the number of requests, latency percentiles,
+    throughput and cost, then the same for the whole period, the median of every
+    phase of a request, the bytes sent and received, and per prompt how much the
+    provider's prompt cache saved.
+    """
+    window_seconds = parse_span(window, "'--window'")
+    start = None if since == "all" else time.time() - parse_span(since, "'--since'")
+    records = TelemetryLog(path, enabled=True).read(start)
+    if model is not None:
+        records = [r for r in records if r.get("model") == model]
+    console = Console()
+    if not records:
+        console.print(f"No requests in {path} for this period.", style="bold red")
+        sys.exit(1)
+
+    windows = {}
+    for record in records:
+        windows.setdefault(int(record["time"] // window_seconds), []).append(record)
+    for index, group in sorted(windows.items()):
+        label = time.strftime("%Y-%m-%d %H:%M", time.localtime(index * window_seconds))
+        print(f"{label}  {format_summary(summarize(group))}")
+
+    period = max(r["time"] for r in records) - min(r["time"] for r in records)
+    console.print(f"\nAll {format_duration(period)}  {format_summary(summarize(records))}", style="deep_pink3")
+    medians = []
+    for phase in PHASES:
+        values = sorted(r["phases"][phase] for r in records if phase in r.get("phases", {}))
+        if values:
+            medians.append(f"{phase} {percentile(values, 0.5):.3f}s")
+    print(f"Phases p50: {', '.join(medians)}")
+    sent = sum(r.get("bytes_sent", 0) for r in records)
+    received = sum(r.get("bytes_received", 0) for r in records)
+    print(f"Sent {sent / 1e6:.2f} MB, received {received / 1e6:.2f} MB")
+    caching = prompt_caching(records)
+    if caching:
+        print("Prompt caching:")
+        for key, row in sorted(caching.items()):
+            print(format_prompt_caching(key, row))
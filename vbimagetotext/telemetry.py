@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from .response_cache import DEFAULT_CACHE_DIR
+
+
+DEFAULT_TELEMETRY_PATH = os.getenv(
+    "VBIMAGETOTEXT_TELEMETRY_PATH", os.path.join(DEFAULT_CACHE_DIR, "telemetry.jsonl"))
+# Names `switch_prompt` knows, recorded instead of the prompt text.
+PROMPT_NAMES = [
+    "assertion_reason", "mcq", "mcq_list", "mcq_solution", "subjective", "subjective_list",
+    "match", "comprehension", "answer", "solution", "subjective_irodov", "solution_irodov",
+]
+
+
+class Trace:
+    """
+    Phase timings and sizes of one request, filled in as it goes through the pipeline.
+
+    Phases are seconds: `cache` (hashing and lookup), `prepare` (reading,
+    preprocessing and building the payload), `encode` (reading and base64-encoding
+    images while the body is sent), `connect` (new connections, including TLS),
+    `ttfb` (until the response headers), `first_token` and `total` (as seen by the
+    backend) and `postprocess` (extracting and writing the LaTeX). A phase measured
+    twice, e.g. over retries, adds up.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, name: str, seconds: Optional[float]) -> None:
+        if seconds is not None:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def merge(self, other: "Trace") -> None:
+        for name, seconds in other.phases.items():
+            self.add(name, seconds)
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+
+
+def prompt_key(prompt: str) -> str:
+    """
+    Returns the name of a built-in prompt, or `custom-` and a hash of the text.
+    """
+    from .prompts import switch_prompt
+
+    for name in PROMPT_NAMES:
+        if switch_prompt(name) == prompt:
+            return name
+    return "custom-" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+
+
+class TelemetryLog:
+    """
+    Append-only JSON Lines log with one record per request.
+
+    Each record is written with a single `write` to a file opened for appending,
+    so concurrent workers and processes never interleave lines. Set
+    `VBIMAGETOTEXT_TELEMETRY=0` to turn the log off.
+    """
+
+    def __init__(self, path: str = DEFAULT_TELEMETRY_PATH, enabled: bool = None):
+        if enabled is None:
+            enabled = os.getenv("VBIMAGETOTEXT_TELEMETRY", "1") not in ("0", "false", "no")
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        if not self.enabled:
+            return
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(line)
+
+    def read(self, since: float = None) -> List[dict]:
+        """
+        Returns the records, oldest first, skipping lines that do not parse.
+
+        Args:
+            since (float, optional): Only records of requests started at or after this Unix time.
+        """
+        records = []
+        try:
+            with open(self.path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if since is None or record.get("time", 0) >= since:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        return records
+
+
+_log = TelemetryLog()
+
+
+def get_telemetry() -> TelemetryLog:
+    return _log
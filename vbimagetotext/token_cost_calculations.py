@@ -1,6 +1,43 @@
-from PIL import Image
+import re
+import threading
+from functools import lru_cache
 from math import ceil
-from typing import List
+from typing import Dict, List, Tuple
+
+from .imagemeta import probe_image
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# USD per million tokens: (input, output).
+MODEL_PRICING: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4o-2024-08-06": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4-turbo-preview": (10.0, 30.0),
+    "gpt-4-vision-preview": (10.0, 30.0),
+    "gemini-pro-vision": (0.5, 1.5),
+    "gemini-1.5-flash": (0.075, 0.3),
+    "gemini-1.5-pro": (3.5, 10.5),
+    "mock": (0.0, 0.0),
+}
+DEFAULT_PRICING = (10.0, 30.0)
+# Fraction of the input price charged for prompt tokens read from the provider's
+# prompt cache, by model name prefix.
+CACHED_INPUT_RATES: Dict[str, float] = {
+    "gpt-4o": 0.5,
+    "gemini-1.5": 0.25,
+}
+EXCHANGE_RATE = 84
+TAX_RATE = 0.18
+
+# Splits text roughly the way the cl100k/o200k pre-tokenizers do.
+PIECE_PATTERN = re.compile(
+    r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}|\\[A-Za-z]+| ?[^\s\w\\]+|\s+(?!\S)|\s+""")
 
 
 def resize(width, height):
@@ -24,10 +61,22 @@ def count_image_tokens(image_path: str):
     Returns:
         int: The number of tokens used by the image.
     """
-    # Open the image and get its size
-    with Image.open(image_path) as img:
-        width, height = img.size
+    # Read the size from the image header, without decoding the image
+    info = probe_image(image_path)
+    return image_tokens(info.width, info.height)
 
+
+def image_tokens(width: int, height: int) -> int:
+    """
+    Calculates the number of tokens used by an image of the given size.
+
+    Args:
+        width (int): The width of the image in pixels.
+        height (int): The height of the image in pixels.
+
+    Returns:
+        int: The number of tokens used by the image.
+    """
     # Resize the image if necessary
     width, height = resize(width, height)
 
@@ -55,61 +104,237 @@ def count_total_image_tokens(image_paths: List[str]) -> int:
     return total_tokens
 
 
-def calculate_image_cost(image_path: List[str], cost_per_million_tokens: float = 10.0, exchange_rate: float = 84, tax_rate: float = 0.18) -> None:
+def model_pricing(model: str = None) -> Tuple[float, float]:
+    """
+    Returns the (input, output) price in USD per million tokens of a model.
+    """
+    if model in MODEL_PRICING:
+        return MODEL_PRICING[model]
+    # Dated snapshots are priced like their base model unless listed above.
+    for name in sorted(MODEL_PRICING, key=len, reverse=True):
+        if model and model.startswith(name):
+            return MODEL_PRICING[name]
+    return DEFAULT_PRICING
+
+
+def cached_input_rate(model: str = None) -> float:
+    """
+    Returns the fraction of the input price a model charges for cached prompt tokens.
+    """
+    for prefix, rate in CACHED_INPUT_RATES.items():
+        if model and model.startswith(prefix):
+            return rate
+    return 1.0
+
+
+def cache_savings(model: str, cached_tokens: int) -> float:
+    """
+    Returns what reading `cached_tokens` prompt tokens from the prompt cache saved, in rupees.
+    """
+    return tokens_cost(cached_tokens, model_pricing(model)[0] * (1 - cached_input_rate(model)))
+
+
+def tokens_cost(tokens: float, cost_per_million_tokens: float, exchange_rate: float = EXCHANGE_RATE, tax_rate: float = TAX_RATE) -> float:
+    """
+    Converts a number of tokens to rupees, including tax.
+    """
+    cost_in_dollars = (tokens / 1000000) * cost_per_million_tokens
+    cost_in_rupees = cost_in_dollars * exchange_rate
+    return cost_in_rupees * (1 + tax_rate)
+
+
+@lru_cache(maxsize=65536)
+def estimate_piece_tokens(piece: str) -> int:
+    """
+    Estimates the BPE tokens of one pre-tokenized piece. Results are memoized, since
+    LaTeX output repeats the same commands and words over and over.
+    """
+    stripped = piece.strip()
+    if not stripped:
+        return 1
+    if stripped.isdigit():
+        return ceil(len(stripped) / 3)
+    if stripped.startswith("\\"):
+        return 1 + estimate_piece_tokens(stripped[1:])
+    if stripped[0].isalpha():
+        return max(1, ceil(len(stripped) / 5))
+    return max(1, ceil(len(stripped) / 2))
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base" if model and model.startswith("gpt-4o") else "cl100k_base")
+    except Exception:
+        # The encoding files are downloaded on first use, which fails offline.
+        return None
+
+
+def exact_text_tokens(model: str = None) -> bool:
     """
-    Calculates and prints the cost of the API call in rupees, including tax.
+    Returns whether `count_text_tokens` counts exactly, with tiktoken, for a model.
+    """
+    return _encoding(model) is not None
+
+
+def count_text_tokens(text: str, model: str = None) -> int:
+    """
+    Counts the tokens of a text.
+
+    Uses tiktoken, from the `tokens` extra, when it is installed. Otherwise the text is split like the BPE
+    pre-tokenizer does and each piece is estimated, which is far closer than counting
+    words on LaTeX.
 
     Args:
-        image_path (str): The path to the image file.
-        cost_per_million_tokens (float, optional): The cost per million tokens. Defaults to 60.0.
-        exchange_rate (float, optional): The exchange rate from dollars to rupees. Defaults to 74.5.
+        text (str): The text.
+        model (str, optional): The model, to pick the tiktoken encoding.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(estimate_piece_tokens(piece) for piece in PIECE_PATTERN.findall(text))
+
+
+def calculate_image_cost(image_path: List[str], model: str = None, exchange_rate: float = EXCHANGE_RATE, tax_rate: float = TAX_RATE) -> float:
+    """
+    Calculates and prints the cost of the images of an API call in rupees, including tax.
+
+    Args:
+        image_path (List[str]): The paths to the image files.
+        model (str, optional): The model, to look up its price in MODEL_PRICING.
+        exchange_rate (float, optional): The exchange rate from dollars to rupees. Defaults to 84.
         tax_rate (float, optional): The tax rate. Defaults to 0.18.
     """
     tokens = count_total_image_tokens(image_path)
     print(f"Number of tokens used by the image: {tokens}")
-    cost_in_dollars = (tokens / 1000000) * cost_per_million_tokens
-    cost_in_rupees = cost_in_dollars * exchange_rate
-    cost_with_tax = cost_in_rupees * (1 + tax_rate)
+    cost_with_tax = tokens_cost(tokens, model_pricing(model)[0], exchange_rate, tax_rate)
     print(f"Cost of API call: Images including tax: ₹{cost_with_tax:.2f}")
 
     return cost_with_tax
 
 
-def calculate_input_cost(input_text: str, cost_per_million_tokens: float = 10.0, exchange_rate: float = 84, tax_rate: float = 0.18) -> None:
+def calculate_input_cost(input_text: str, model: str = None, tokens: int = None, exchange_rate: float = EXCHANGE_RATE, tax_rate: float = TAX_RATE) -> float:
     """
-    Calculates and prints the cost of the API call in rupees, including tax.
+    Calculates and prints the input cost of the API call in rupees, including tax.
 
     Args:
         input_text (str): The input text.
-        cost_per_million_tokens (float, optional): The cost per million tokens. Defaults to 60.0.
-        exchange_rate (float, optional): The exchange rate from dollars to rupees. Defaults to 74.5.
+        model (str, optional): The model, to look up its price in MODEL_PRICING.
+        tokens (int, optional): Exact number of input tokens, from the `usage` of the response.
+            Estimated from the text if not given.
+        exchange_rate (float, optional): The exchange rate from dollars to rupees. Defaults to 84.
         tax_rate (float, optional): The tax rate. Defaults to 0.18.
     """
-    input_tokens = len(input_text.split())
+    input_tokens = tokens if tokens is not None else count_text_tokens(input_text, model)
     print(f"Number of input tokens: {input_tokens}")
-    cost_in_dollars = (input_tokens / 1000000) * cost_per_million_tokens
-    cost_in_rupees = cost_in_dollars * exchange_rate
-    cost_with_tax = cost_in_rupees * (1 + tax_rate)
+    cost_with_tax = tokens_cost(input_tokens, model_pricing(model)[0], exchange_rate, tax_rate)
     print(f"Cost of API call: Input including tax: ₹{cost_with_tax:.2f}")
 
     return cost_with_tax
 
 
-def calculate_output_cost(input_text: str, cost_per_million_tokens: float = 30.0, exchange_rate: float = 84, tax_rate: float = 0.18) -> None:
+def calculate_output_cost(input_text: str, model: str = None, tokens: int = None, exchange_rate: float = EXCHANGE_RATE, tax_rate: float = TAX_RATE) -> float:
     """
-    Calculates and prints the cost of the API call in rupees, including tax.
+    Calculates and prints the output cost of the API call in rupees, including tax.
 
     Args:
-        input_text (str): The input text.
-        cost_per_million_tokens (float, optional): The cost per million tokens. Defaults to 60.0.
-        exchange_rate (float, optional): The exchange rate from dollars to rupees. Defaults to 74.5.
+        input_text (str): The output text.
+        model (str, optional): The model, to look up its price in MODEL_PRICING.
+        tokens (int, optional): Exact number of output tokens, from the `usage` of the response.
+            Estimated from the text if not given.
+        exchange_rate (float, optional): The exchange rate from dollars to rupees. Defaults to 84.
         tax_rate (float, optional): The tax rate. Defaults to 0.18.
     """
-    output_tokens = len(input_text.split())
+    output_tokens = tokens if tokens is not None else count_text_tokens(input_text, model)
     print(f"Number of output tokens: {output_tokens}")
-    cost_in_dollars = (output_tokens / 1000000) * cost_per_million_tokens
-    cost_in_rupees = cost_in_dollars * exchange_rate
-    cost_with_tax = cost_in_rupees * (1 + tax_rate)
+    cost_with_tax = tokens_cost(output_tokens, model_pricing(model)[1], exchange_rate, tax_rate)
     print(f"Cost of API call: Output including tax: ₹{cost_with_tax:.2f}")
 
     return cost_with_tax
+
+
+class CostLedger:
+    """
+    Collects the token usage of every request in a run, to report the cost once at the end.
+
+    Usage is stored column-wise, one list per field, and priced per model by
+    `totals`, instead of being priced and printed on every call.
+    """
+
+    def __init__(self):
+        self.models: List[str] = []
+        self.input_tokens: List[int] = []
+        self.output_tokens: List[int] = []
+        self.exact: List[bool] = []
+        self.cached_tokens: List[int] = []
+        self.lock = threading.Lock()
+
+    def add(self, model: str, input_tokens: int, output_tokens: int, exact: bool = True, cached_tokens: int = 0) -> None:
+        with self.lock:
+            self.models.append(model)
+            self.input_tokens.append(input_tokens)
+            self.output_tokens.append(output_tokens)
+            self.exact.append(exact)
+            self.cached_tokens.append(cached_tokens)
+
+    def merge(self, other: "CostLedger") -> None:
+        """
+        Adds the usage collected by another ledger, e.g. the one of a single page.
+        """
+        with other.lock:
+            rows = list(zip(other.models, other.input_tokens, other.output_tokens, other.exact, other.cached_tokens))
+        for row in rows:
+            self.add(*row)
+
+    def total_cost(self) -> float:
+        return sum(row["cost"] for row in self.totals().values())
+
+    def totals(self) -> Dict[str, dict]:
+        """
+        Returns the requests, tokens and cost in rupees per model. Cached prompt
+        tokens are charged at the model's cached input price.
+
+        The rows are summed per model in one pass while the lock is held, and each
+        model is priced once afterwards.
+        """
+        totals = {}
+        with self.lock:
+            for model, input_tokens, output_tokens, cached_tokens in zip(
+                    self.models, self.input_tokens, self.output_tokens, self.cached_tokens):
+                row = totals.get(model)
+                if row is None:
+                    row = totals[model] = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+                row["requests"] += 1
+                row["input_tokens"] += input_tokens
+                row["output_tokens"] += output_tokens
+                row["cached_tokens"] += cached_tokens
+        for model, row in totals.items():
+            input_price, output_price = model_pricing(model)
+            row["cost"] = (tokens_cost(row["input_tokens"], input_price) + tokens_cost(row["output_tokens"], output_price)
+                           - cache_savings(model, row["cached_tokens"]))
+        return totals
+
+    def print_summary(self) -> float:
+        """
+        Prints the totals per model and returns the total cost in rupees.
+        """
+        total = 0.0
+        for model, row in sorted(self.totals().items()):
+            cached = f" ({row['cached_tokens']} cached)" if row["cached_tokens"] else ""
+            print(f"{model}: {row['requests']} requests, {row['input_tokens']} input tokens{cached}, "
+                  f"{row['output_tokens']} output tokens, ₹{row['cost']:.2f}")
+            total += row["cost"]
+        with self.lock:
+            estimated = len(self.exact) - sum(self.exact)
+        if estimated:
+            print(f"{estimated} requests had no usage in the response and were estimated.")
+        print(f'\n\tTotal cost: {total:.2f}\n')
+        return total
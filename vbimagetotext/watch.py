@@ -0,0 +1,408 @@
+import click
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from rich.console import Console
+
+from .functions import process_images, write_atomic
+from .backends import require_api_key
+from .ratelimit import APIError, configure_limits, rate_limit_options
+from .prompts import switch_prompt
+from .response_cache import ResponseCache
+from .imagemeta import IMAGE_EXTENSIONS
+from .token_cost_calculations import CostLedger
+from .preprocess import make_preprocessing, preprocessing_options
+from .choice_option import ChoiceOption
+
+
+# inotify event flags, from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_image(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (size, mtime in ns) of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def scan_tree(root: str, exclude: str = None) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the signature of every image under a directory, skipping `exclude`.
+    """
+    signatures = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if exclude is not None:
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != exclude]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if is_image(path):
+                signature = file_signature(path)
+                if signature is not None:
+                    signatures[path] = signature
+    return signatures
+
+
+class InotifyWatcher:
+    """
+    Reports files created, written or moved into a directory tree, through Linux inotify.
+
+    Every directory needs a watch of its own, so directories created later are
+    added as they appear, and the files already in them are reported.
+    """
+
+    def __init__(self, root: str, exclude: str = None):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.exclude = exclude
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.root = root
+        self._add_tree(root)
+
+    def _add_tree(self, root: str) -> List[str]:
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != self.exclude]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {dirpath}")
+            self.watches[wd] = dirpath
+            files.extend(os.path.join(dirpath, filename) for filename in filenames)
+        return files
+
+    def poll(self, timeout: float) -> List[str]:
+        """
+        Waits up to `timeout` seconds and returns the paths that changed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so look at everything once.
+                changed.extend(scan_tree(self.root, self.exclude))
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and path != self.exclude:
+                    changed.extend(self._add_tree(path))
+            else:
+                changed.append(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Reports changed files by comparing the size and mtime of every image in the
+    tree every `interval` seconds, where inotify is not available.
+    """
+
+    def __init__(self, root: str, exclude: str = None, interval: float = 1.0):
+        self.root = root
+        self.exclude = exclude
+        self.interval = interval
+        self.signatures = scan_tree(root, exclude)
+
+    def poll(self, timeout: float) -> List[str]:
+        time.sleep(min(timeout, self.interval))
+        signatures = scan_tree(self.root, self.exclude)
+        changed = [path for path, signature in signatures.items() if self.signatures.get(path) != signature]
+        self.signatures = signatures
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(root: str, exclude: str = None, polling: bool = False, interval: float = 1.0):
+    """
+    Returns an inotify watcher on Linux, and a polling one elsewhere, when asked
+    for, or when inotify fails (e.g. the watch limit is reached).
+    """
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, exclude)
+        except (OSError, AttributeError) as e:
+            Console().print(f"inotify is not available ({e}), polling instead", style="deep_pink3")
+    return PollingWatcher(root, exclude, interval)
+
+
+class Debouncer:
+    """
+    Holds changed files back until their size and mtime have not changed for
+    `settle` seconds, so a scan is only read once the scanner has finished writing it.
+    """
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        self.pending: Dict[str, tuple] = {}
+
+    def touch(self, path: str, now: float) -> None:
+        self.pending[path] = (file_signature(path), now)
+
+    def ready(self, now: float) -> List[str]:
+        ready = []
+        for path, (signature, since) in list(self.pending.items()):
+            current = file_signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != signature:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+    def timeout(self, now: float, default: float = 1.0) -> float:
+        """
+        Returns how long to wait for events before the next file may settle.
+        """
+        if not self.pending:
+            return default
+        return max(0.05, min(since + self.settle - now for _, since in self.pending.values()))
+
+
+def mirror_path(path: str, input_root: str, output_root: str) -> str:
+    """
+    Maps `input_root/a/b/scan.png` to `output_root/a/b/scan.tex`.
+    """
+    relative = os.path.relpath(path, input_root)
+    return os.path.join(output_root, os.path.splitext(relative)[0] + ".tex")
+
+
+def is_stale(path: str, output_path: str) -> bool:
+    """
+    Tells whether an image has no output yet, or changed after its output was written.
+    An image that has been removed in the meantime is not stale.
+    """
+    source = file_signature(path)
+    if source is None:
+        return False
+    output = file_signature(output_path)
+    return output is None or output[1] < source[1]
+
+
+@click.command(
+    help="Watch a directory and convert new or changed scans as they arrive."
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_root",
+    type=click.Path(exists=True, file_okay=False),
+    required=True,
+    help="Directory the scans are dropped into, watched with its subdirectories",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_root",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory the .tex files are written to, mirroring the input tree  [default: <input>_tex]",
+)
+@click.option(
+    "-p",
+    "--prompt",
+    cls=ChoiceOption,
+    type=click.Choice(
+        [
+            "assertion_reason",
+            "mcq",
+            "mcq_list",
+            "mcq_solution",
+            "subjective",
+            "subjective_list",
+            "match",
+            "comprehension",
+            "answer",
+            "subjective_irodov",
+            "solution_irodov",
+            "prompt",
+        ],
+        case_sensitive=False),
+    prompt=True,
+    default=2,
+    show_default=True,
+    help="Prompt to use for the completion",
+)
+@click.option(
+    "-m",
+    "--model",
+    cls=ChoiceOption,
+    type=click.Choice(
+        [
+            "gpt-4o",
+            "gpt-4o-2024-08-06",
+            "gpt-4-turbo",
+            "gpt-4-turbo-preview",
+            "gpt-4-vision-preview",
+            "gemini-1.5-flash",
+            "gemini-1.5-pro",
+            "mock",
+        ],
+        case_sensitive=False),
+    prompt=True,
+    default=1,
+    show_default=True,
+    help="Model to use for the completion",
+)
+@click.option(
+    "-t",
+    "--max-tokens",
+    type=int,
+    default=2000,
+    show_default=True,
+    help="Maximum number of tokens to generate",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Number of scans to send to the API at the same time",
+)
+@click.option(
+    "--settle",
+    type=click.FloatRange(min=0),
+    default=2.0,
+    show_default=True,
+    help="Seconds a file must stay unchanged before it is read",
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    help="Poll the directory instead of using inotify, e.g. on network filesystems.",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    show_default=True,
+    help="Seconds between two scans of the directory when polling",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or write the response cache.",
+)
+@rate_limit_options
+@preprocessing_options
+def watch(input_root, output_root, prompt, model, max_tokens, concurrency, settle, poll, interval, no_cache, rpm, tpm, max_retries, downscale, grayscale, image_format, quality, crop):
+    """
+    Watch a directory and convert new or changed scans as they arrive.
+
+    On start, the scans with no output yet, or changed since their output was
+    written, are queued. After that only the files the watcher reports are looked
+    at, so the directory is never swept again. A file is read once it has settled,
+    and sent through the `gptvision` pipeline by `concurrency` workers. Its LaTeX
+    is written atomically to the same relative path under the output directory.
+    Stop with Ctrl-C; the scans in flight are finished first.
+    """
+    api_key = require_api_key(model)
+
+    if prompt == "prompt":
+        prompt = click.prompt("Please enter your custom prompt", type=str)
+
+    prompt = switch_prompt(prompt)
+    input_root = os.path.abspath(input_root)
+    output_root = os.path.abspath(output_root or input_root.rstrip(os.sep) + "_tex")
+    cache = None if no_cache else ResponseCache()
+    preprocessing = make_preprocessing(downscale, grayscale, image_format, quality, crop)
+    ledger = CostLedger()
+    configure_limits(rpm, tpm, max_retries)
+    console = Console()
+
+    def process(path):
+        output_path = mirror_path(path, input_root, output_root)
+        try:
+            result = process_images([path], prompt, model, api_key, max_tokens,
+                                    copy=False, cache=cache, preprocessing=preprocessing, ledger=ledger)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            write_atomic(output_path, result)
+        except (APIError, OSError) as e:
+            console.print(f"Error: {os.path.relpath(path, input_root)} failed: {e}", style="bold red")
+            return
+        except Exception as e:
+            # Nobody waits on the future, so anything not reported here is lost.
+            console.print(
+                f"Error: {os.path.relpath(path, input_root)} failed: {type(e).__name__}: {e}", style="bold red")
+            return
+        console.print(
+            f"{os.path.relpath(path, input_root)} written to {os.path.relpath(output_path)}", style="deep_pink3")
+
+    watcher = make_watcher(input_root, output_root, poll, interval)
+    debouncer = Debouncer(settle)
+    now = time.monotonic()
+    backlog = [path for path in scan_tree(input_root, output_root)
+               if is_stale(path, mirror_path(path, input_root, output_root))]
+    for path in backlog:
+        debouncer.touch(path, now)
+    console.print(
+        f"Watching {input_root} with {type(watcher).__name__.replace('Watcher', '').lower()}, "
+        f"{len(backlog)} scans to catch up on, writing to {output_root}", style="deep_pink3")
+
+    in_flight = {}
+    # Files that changed again while they were being processed.
+    changed_again = set()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while True:
+            for path in watcher.poll(debouncer.timeout(time.monotonic())):
+                if is_image(path) and not path.startswith(output_root + os.sep):
+                    debouncer.touch(path, time.monotonic())
+            for path, future in list(in_flight.items()):
+                if future.done():
+                    del in_flight[path]
+                    if path in changed_again:
+                        changed_again.discard(path)
+                        debouncer.touch(path, time.monotonic())
+            for path in debouncer.ready(time.monotonic()):
+                if path in in_flight:
+                    changed_again.add(path)
+                else:
+                    in_flight[path] = executor.submit(process, path)
+    except KeyboardInterrupt:
+        console.print(f"Stopping, finishing {len(in_flight)} scans in flight", style="deep_pink3")
+    finally:
+        executor.shutdown(wait=True)
+        watcher.close()
+    ledger.print_summary()